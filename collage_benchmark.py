@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""Benchmark reprodutível do pipeline de colagens com corpora sintéticos.
+
+Gera (ou reaproveita) um corpus determinístico com tamanhos, modos (RGB/RGBA/L/P),
+formatos e proporção de duplicatas configuráveis. Depois mede:
+  * componentes por imagem, numa thread, como o pipeline os executa: decode, hash de conteúdo
+    (hash_image_pixels com o algoritmo escolhido em --content-hash) e resize;
+  * os algoritmos de hash de conteúdo (CONTENT_HASHES) contra o SHA-256 de tobytes() antigo;
+  * o pipeline completo para cada combinação de backend, nº de workers e montagem,
+    com o tempo de cada etapa (CollagePipeline.stage_times) e o pico de RSS.
+Cada configuração roda num subprocesso novo e o pico de RSS é o VmHWM dele (/proc/self/status):
+o ru_maxrss do getrusage passa adiante no exec e repetiria o pico do processo que gerou o corpus.
+Sem /proc, vale o pico do RSS amostrado pelo MetricsRecorder durante o trabalho.
+
+Exemplo:
+    python collage_benchmark.py --images 300 --duplicates 0.2 --workers 1,2,4,8 \\
+        --backends thread,process --output resultados.json
+"""
+
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+from itertools import product
+
+from PIL import Image
+
+import collage_core
+from collage_core import (CollagePipeline, decode_image, resize_to_target, collage_mode_for,
+                          process_peak_rss_bytes, new_content_hasher, feed_image_pixels, content_digest,
+                          hash_image_pixels, RESIZE_FACTOR, DECODE_QUALITY, EXECUTION_BACKENDS,
+                          ASSEMBLY_MODES, CONTENT_HASH, CONTENT_HASHES)
+
+# --- Constantes ---
+CORPUS_MODES = ('RGB', 'RGBA', 'L', 'P')
+CORPUS_FORMATS = ('jpg', 'png', 'webp')
+CORPUS_ASPECTS = ((4, 3), (3, 4), (16, 9), (1, 1), (3, 1))
+CORPUS_MTIME_BASE = 1_600_000_000 # mtimes determinísticos: originais mais antigos que as cópias
+DEFAULT_IMAGES = 200
+DEFAULT_MIN_SIZE = 640
+DEFAULT_MAX_SIZE = 3000
+DEFAULT_DUPLICATE_RATIO = 0.2
+DEFAULT_SEED = 1234
+MANIFEST_NAME = 'corpus.json'
+
+
+# --- Corpus sintético ---
+def synthetic_image(rng, width, height, mode):
+    """Imagem com variação suave (ruído de baixa resolução ampliado) mais textura fina."""
+    low_w, low_h = max(2, width // 32), max(2, height // 32)
+    img = Image.frombytes('RGB', (low_w, low_h), rng.randbytes(low_w * low_h * 3)).resize((width, height), Image.BICUBIC)
+    fine = Image.frombytes('L', (width // 2, height // 2), rng.randbytes((width // 2) * (height // 2)))
+    img = Image.blend(img, fine.resize((width, height)).convert('RGB'), 0.12)
+    if mode == 'RGBA':
+        alpha = Image.radial_gradient('L').resize((width, height))
+        img.putalpha(alpha.point(lambda value: 255 - value // 2))
+    elif mode == 'L':
+        img = img.convert('L')
+    elif mode == 'P':
+        img = img.convert('P', palette=Image.ADAPTIVE, colors=64)
+    return img
+
+
+def _save_synthetic(img, path, image_format):
+    if image_format == 'jpg':
+        img.save(path, 'JPEG', quality=90)
+    elif image_format == 'webp':
+        img.save(path, 'WEBP', quality=85)
+    else:
+        img.save(path, 'PNG', compress_level=1)
+
+
+def corpus_spec(images=DEFAULT_IMAGES, min_size=DEFAULT_MIN_SIZE, max_size=DEFAULT_MAX_SIZE,
+                duplicate_ratio=DEFAULT_DUPLICATE_RATIO, modes=CORPUS_MODES, formats=CORPUS_FORMATS,
+                seed=DEFAULT_SEED):
+    if images < 1:
+        raise ValueError(f"Número de imagens inválido: {images}")
+    if not 0 < min_size <= max_size:
+        raise ValueError(f"Faixa de tamanhos inválida: {min_size}-{max_size}")
+    if not 0 <= duplicate_ratio < 1:
+        raise ValueError(f"Proporção de duplicatas inválida: {duplicate_ratio} (use 0 <= p < 1)")
+    if set(modes) - set(CORPUS_MODES) or set(formats) - set(CORPUS_FORMATS):
+        raise ValueError(f"Modos/formatos inválidos (use {CORPUS_MODES} e {CORPUS_FORMATS})")
+    return {'images': images, 'min_size': min_size, 'max_size': max_size, 'duplicate_ratio': duplicate_ratio,
+            'modes': list(modes), 'formats': list(formats), 'seed': seed}
+
+
+def generate_corpus(directory, spec):
+    """Gera o corpus descrito por `spec` em `directory` e devolve o manifesto.
+
+    Um corpus já gerado com o mesmo spec é reaproveitado. As duplicatas ficam em
+    dups/NNNNN/ com o mesmo nome do original (a filtragem mantém o mais antigo por hash
+    OU por nome, então nomes novos nunca seriam descartados) e alternam entre cópias
+    byte a byte (descartadas antes de decodificar) e reencodes em PNG dos mesmos pixels
+    (descartados pelo hash do conteúdo, que cobre os pixels em resolução total nas duas
+    qualidades de decodificação). JPEG não guarda RGBA/P, então essas imagens
+    saem em PNG quando o sorteio dá 'jpg'.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('spec') == spec and all(os.path.exists(os.path.join(directory, item['file']))
+                                                for item in manifest['files']):
+            return manifest
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(spec['seed'])
+    duplicates = int(spec['images'] * spec['duplicate_ratio'])
+    originals = spec['images'] - duplicates
+    files = []
+    for index in range(originals):
+        aspect_w, aspect_h = rng.choice(CORPUS_ASPECTS)
+        long_side = rng.randint(spec['min_size'], spec['max_size'])
+        scale = long_side / max(aspect_w, aspect_h)
+        width, height = max(1, round(aspect_w * scale)), max(1, round(aspect_h * scale))
+        mode = rng.choice(spec['modes'])
+        image_format = rng.choice(spec['formats'])
+        if image_format == 'jpg' and mode in ('RGBA', 'P'):
+            image_format = 'png'
+        name = f'img_{index:05d}.{image_format}'
+        _save_synthetic(synthetic_image(rng, width, height, mode), os.path.join(directory, name), image_format)
+        files.append({'file': name, 'width': width, 'height': height, 'mode': mode, 'format': image_format,
+                      'duplicate_of': None})
+    if duplicates:
+        os.makedirs(os.path.join(directory, 'dups'), exist_ok=True)
+    used = set() # Cada original ganha no máximo uma duplicata enquanto houver originais livres
+    for index in range(duplicates):
+        source_index = rng.choice([i for i in range(originals) if i not in used] or range(originals))
+        used.add(source_index)
+        source = files[source_index]
+        source_path = os.path.join(directory, source['file'])
+        name = os.path.join('dups', f'{index:05d}', source['file'])
+        os.makedirs(os.path.dirname(os.path.join(directory, name)), exist_ok=True)
+        kind = 'copy' if index % 2 == 0 else 'reencode'
+        if kind == 'copy':
+            shutil.copyfile(source_path, os.path.join(directory, name))
+        else:
+            with Image.open(source_path) as img:
+                img.load()
+                img.save(os.path.join(directory, name), 'PNG', compress_level=1)
+        files.append(dict(source, file=name, format='png' if kind == 'reencode' else source['format'],
+                          duplicate_of=source['file'], duplicate_kind=kind))
+    for order, item in enumerate(files):
+        mtime = CORPUS_MTIME_BASE + order * 60
+        os.utime(os.path.join(directory, item['file']), (mtime, mtime))
+    manifest = {'spec': spec, 'files': files,
+                'bytes': sum(os.path.getsize(os.path.join(directory, item['file'])) for item in files)}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+# --- Medições ---
+def measure_components(paths, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, content_hash=CONTENT_HASH):
+    """Custo de decode, hash de conteúdo e resize por imagem, numa única thread.
+
+    Segue load_and_resize_image: a decodificação é a da passada com hash (JPEGs em resolução
+    total) e o hash é o de content_hash em blocos; em TIFFs lidos por faixas ele acontece
+    durante a leitura e entra no decode.
+    """
+    totals = {'decode': 0.0, 'hash': 0.0, 'resize': 0.0}
+    pixels = 0
+    for path in paths:
+        start = time.perf_counter()
+        hasher = new_content_hasher(content_hash)
+        decoded_image = decode_image(path, factor, quality, hasher=hasher)
+        img, target_size = decoded_image.image, decoded_image.target_size
+        decoded = time.perf_counter()
+        if not decoded_image.hashed:
+            feed_image_pixels(hasher, img)
+        content_digest(hasher, content_hash)
+        hashed = time.perf_counter()
+        collage_mode = collage_mode_for(img.mode)
+        if img.mode != collage_mode:
+            img = img.convert(collage_mode)
+        resize_to_target(img, target_size, quality)
+        resized = time.perf_counter()
+        totals['decode'] += decoded - start
+        totals['hash'] += hashed - decoded
+        totals['resize'] += resized - hashed
+        pixels += img.width * img.height
+    count = max(1, len(paths))
+    return {stage: {'total_s': round(total, 4), 'per_image_ms': round(total / count * 1000, 3)}
+            for stage, total in totals.items()} | {'decoded_megapixels': round(pixels / 1e6, 2),
+                                                   'content_hash': content_hash}
+
+
+def measure_hashers(paths, hashers=CONTENT_HASHES, factor=RESIZE_FACTOR, quality=DECODE_QUALITY):
+    """Tempo de cada hash de conteúdo sobre os mesmos pixels, numa única thread.
+
+    Os pixels são os que o pipeline passa pelo hash (resolução total, também no modo 'fast').
+    'tobytes' é a referência antiga (SHA-256 de uma cópia inteira); os demais usam
+    hash_image_pixels, em blocos. Algoritmos indisponíveis (ex.: sem xxhash) são pulados.
+    """
+    hashers = [name for name in hashers if name != 'xxh3_128' or collage_core.xxhash is not None]
+    totals = dict.fromkeys(['tobytes'] + hashers, 0.0)
+    total_bytes = 0
+    for path in paths:
+        img = decode_image(path, factor, quality, hasher=new_content_hasher('sha256')).image
+        start = time.perf_counter()
+        hashlib.sha256(img.tobytes()).hexdigest()
+        totals['tobytes'] += time.perf_counter() - start
+        for name in hashers:
+            start = time.perf_counter()
+            hash_image_pixels(img, name)
+            totals[name] += time.perf_counter() - start
+        total_bytes += len(img.getbands()) * img.width * img.height
+    return {name: {'total_s': round(total, 4), 'mb_per_s': round(total_bytes / 1024**2 / total, 1) if total else None}
+            for name, total in totals.items()}
+
+
+def own_peak_rss_bytes():
+    """VmHWM deste processo em bytes (pico do próprio espaço de memória, não herdado no exec); None sem /proc."""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024 # Informado em kB
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def run_pipeline_once(config):
+    """Roda um CollagePipeline com `config` e devolve as medições (chamado no subprocesso)."""
+    paths = config['paths']
+    output_dir = tempfile.mkdtemp(prefix='collage_bench_')
+    try:
+        pipeline = CollagePipeline(paths, output_dir, backend=config['backend'], num_workers=config['workers'],
+                                   assembly_mode=config['assembly'], decode_quality=config['quality'],
+                                   output_format=config['format'], save_preset=config.get('preset'),
+                                   content_hash=config.get('content_hash', CONTENT_HASH))
+        errors = []
+        pipeline.error_occurred.connect(errors.append)
+        final_path = pipeline.run()
+        return {
+            'backend': config['backend'], 'workers': config['workers'], 'assembly': config['assembly'],
+            'quality': config['quality'], 'format': config['format'], 'preset': config.get('preset'),
+            'content_hash': config.get('content_hash', CONTENT_HASH),
+            'ok': final_path is not None, 'errors': errors,
+            'stage_times': {stage: round(value, 4) for stage, value in pipeline.stage_times.items()},
+            'images_in': len(paths), 'pre_dropped': pipeline.pre_dropped_count,
+            'output_bytes': os.path.getsize(final_path) if final_path else None,
+            'peak_rss_bytes': own_peak_rss_bytes() or pipeline.metrics.memory['rss'],
+            'peak_rss_children_bytes': process_peak_rss_bytes(children=True) if config['backend'] == 'process' else None,
+        }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def run_pipeline_isolated(config):
+    """Roda run_pipeline_once num interpretador novo (VmHWM só desta configuração)."""
+    with tempfile.TemporaryDirectory(prefix='collage_bench_cfg_') as work_dir:
+        config_path = os.path.join(work_dir, 'config.json')
+        result_path = os.path.join(work_dir, 'result.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-config', config_path, result_path],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if completed.returncode != 0 or not os.path.exists(result_path):
+            return dict(config, paths=None, ok=False, errors=[completed.stdout[-2000:]])
+        with open(result_path, encoding='utf-8') as f:
+            return json.load(f)
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(), 'pillow': Image.__version__,
+        'numpy': getattr(collage_core.np, '__version__', None), 'platform': platform.platform(),
+        'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def run_benchmark(corpus_dir, spec, worker_counts, backends, assembly_modes, quality=DECODE_QUALITY,
+                  output_format='png', preset=None, repeat=1, hashers=CONTENT_HASHES, log=print,
+                  content_hash=CONTENT_HASH):
+    manifest = generate_corpus(corpus_dir, spec)
+    paths = [os.path.join(corpus_dir, item['file']) for item in manifest['files']]
+    log(f"Corpus: {len(paths)} arquivos, {manifest['bytes'] / 1024**2:.1f} MB em {corpus_dir}")
+    components = measure_components([os.path.join(corpus_dir, item['file'])
+                                     for item in manifest['files'] if item['duplicate_of'] is None],
+                                    quality=quality, content_hash=content_hash)
+    log(f"Componentes (ms/imagem, hash {content_hash}): " + ", ".join(f"{stage} {components[stage]['per_image_ms']:.1f}"
+                                                 for stage in ('decode', 'hash', 'resize')))
+    hashing = measure_hashers([os.path.join(corpus_dir, item['file'])
+                               for item in manifest['files'] if item['duplicate_of'] is None], hashers, quality=quality)
+    log("Hash de conteúdo (MB/s): " + ", ".join(f"{name} {result['mb_per_s']}" for name, result in hashing.items()))
+    runs = []
+    for backend, workers, assembly, attempt in product(backends, worker_counts, assembly_modes, range(repeat)):
+        config = {'paths': paths, 'backend': backend, 'workers': workers, 'assembly': assembly,
+                  'quality': quality, 'format': output_format, 'preset': preset, 'content_hash': content_hash}
+        result = run_pipeline_isolated(config)
+        result['repeat'] = attempt
+        runs.append(result)
+        stages = result.get('stage_times', {})
+        rss = result.get('peak_rss_bytes')
+        log(f"{backend:7s} workers={workers:<3d} {assembly:9s} "
+            + (" ".join(f"{stage}={value:.2f}s" for stage, value in stages.items()) if result['ok'] else "FALHOU")
+            + (f" rss={rss / 1024**2:.0f}MB" if rss else ""))
+    return {
+        'environment': environment_info(),
+        'corpus': {'directory': os.path.abspath(corpus_dir), 'spec': spec, 'files': len(paths),
+                   'bytes': manifest['bytes'],
+                   'duplicates': sum(1 for item in manifest['files'] if item['duplicate_of'])},
+        'components': components,
+        'hashing': hashing,
+        'runs': runs,
+    }
+
+
+def _csv(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de colagens com corpus sintético.")
+    parser.add_argument('--corpus-dir', default=os.path.join(tempfile.gettempdir(), 'collage_bench_corpus'),
+                        help="Diretório do corpus (reaproveitado se o spec for o mesmo)")
+    parser.add_argument('--images', type=int, default=DEFAULT_IMAGES)
+    parser.add_argument('--min-size', type=int, default=DEFAULT_MIN_SIZE)
+    parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE)
+    parser.add_argument('--duplicates', type=float, default=DEFAULT_DUPLICATE_RATIO, help="Proporção de duplicatas")
+    parser.add_argument('--modes', type=_csv, default=list(CORPUS_MODES))
+    parser.add_argument('--formats', type=_csv, default=list(CORPUS_FORMATS))
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--workers', type=lambda value: _csv(value, int), default=[1, os.cpu_count() or 1],
+                        help="Lista de nº de workers, ex.: 1,2,4,8")
+    parser.add_argument('--backends', type=_csv, default=list(EXECUTION_BACKENDS))
+    parser.add_argument('--assembly', type=_csv, default=['memory'], help=f"Lista de {ASSEMBLY_MODES}")
+    parser.add_argument('--quality', default=DECODE_QUALITY)
+    parser.add_argument('--format', default='png', help="Formato da colagem (encode)")
+    parser.add_argument('--preset', default=None)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--content-hash', default=CONTENT_HASH, choices=CONTENT_HASHES,
+                        help="Hash de conteúdo do pipeline (componentes e execuções)")
+    parser.add_argument('--hashers', type=_csv, default=list(CONTENT_HASHES), help=f"Lista de {CONTENT_HASHES}")
+    parser.add_argument('-o', '--output', default='collage_benchmark.json', help="Arquivo JSON de resultados")
+    parser.add_argument('--run-config', nargs=2, metavar=('CONFIG', 'RESULTADO'), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.run_config: # Subprocesso de uma configuração
+        with open(args.run_config[0], encoding='utf-8') as f:
+            result = run_pipeline_once(json.load(f))
+        with open(args.run_config[1], 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return 0
+    spec = corpus_spec(args.images, args.min_size, args.max_size, args.duplicates, args.modes, args.formats, args.seed)
+    results = run_benchmark(args.corpus_dir, spec, args.workers, args.backends, args.assembly,
+                            args.quality, args.format, args.preset, args.repeat, args.hashers,
+                            content_hash=args.content_hash)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Resultados gravados em {args.output}")
+    return 0 if all(run['ok'] for run in results['runs']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
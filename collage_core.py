@@ -0,0 +1,3886 @@
+# -*- coding: utf-8 -*-
+"""Núcleo do gerador de colagens, sem dependência de Qt.
+
+Decodificação, deduplicação, layout, montagem e gravação; usado pela GUI
+(collage_gui) e pela linha de comando (Collage_generator).
+"""
+
+import sys
+import os
+import math
+import time
+import glob
+import shutil
+import struct # Chunks do PNG escrito por faixas
+import zlib
+import hashlib # Para calcular hash
+import json
+import sqlite3 # Índice do cache persistente
+import threading
+import select # Espera pelos eventos do inotify (modo vigia)
+import ctypes # inotify pela libc, sem dependências (modo vigia)
+import ctypes.util
+import traceback
+import inspect # Nomes das opções de CollagePipeline (validate_pipeline_options)
+import cProfile
+import pstats
+import tracemalloc
+from bisect import bisect_left
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing # Evento de cancelamento compartilhado com o pool de processos
+from multiprocessing import shared_memory, resource_tracker # Buffers de pixels entre processos
+from dataclasses import dataclass # Para estrutura de dados organizada
+
+try:
+    from PIL import Image, ImageFile, TiffImagePlugin
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+except ImportError:
+    print("Erro: Biblioteca Pillow não encontrada. Instale com 'pip install Pillow'")
+    sys.exit(1)
+
+try:
+    import numpy as np # Opcional: hashes perceptuais
+except ImportError:
+    np = None
+
+try:
+    import resource # Só em POSIX: pico de RSS
+except ImportError:
+    resource = None
+
+try:
+    import psutil # Opcional: pico de memória no Windows
+except ImportError:
+    psutil = None
+
+try:
+    import xxhash # Opcional: hash de conteúdo não criptográfico
+except ImportError:
+    xxhash = None
+
+
+# --- Constantes ---
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tiff', '.tif')
+RESIZE_FACTOR = 0.50
+RESAMPLING_FILTER = Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS
+# Orientação EXIF (tag 0x0112) -> transposição que deixa a imagem em pé; 5-8 trocam largura e altura.
+# Aplicada à miniatura, depois do hash de conteúdo (que continua sobre os pixels como gravados).
+_TRANSPOSE = Image.Transpose if hasattr(Image, 'Transpose') else Image
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_TRANSPOSITIONS = {2: _TRANSPOSE.FLIP_LEFT_RIGHT, 3: _TRANSPOSE.ROTATE_180, 4: _TRANSPOSE.FLIP_TOP_BOTTOM,
+                       5: _TRANSPOSE.TRANSPOSE, 6: _TRANSPOSE.ROTATE_270, 7: _TRANSPOSE.TRANSVERSE,
+                       8: _TRANSPOSE.ROTATE_90}
+# Qualidade da decodificação/redimensionamento:
+#   'fast'  -> JPEG decodificado já reduzido (escala DCT via draft), reduce() inteiro
+#              e só então um resample final pequeno com RESAMPLING_FILTER. O draft só vale
+#              quando o hash de conteúdo não é calculado na mesma leitura (2ª passada do
+#              streaming, hash vindo do cache): o hash cobre sempre os pixels em resolução
+#              total, então a deduplicação exata não depende da qualidade.
+#   'exact' -> decodifica em resolução total e aplica RESAMPLING_FILTER direto (comportamento original).
+DECODE_QUALITY = 'fast'
+DECODE_QUALITIES = ('fast', 'exact')
+# Arquivos com vários quadros (GIF animado, TIFF de várias páginas, WebP animado):
+#   'first' -> só o primeiro quadro (comportamento original)
+#   'all'   -> cada quadro vira uma imagem da colagem ('foto.tif#quadro=2', ...)
+#   'sheet' -> uma folha de contato com todos os quadros, no espaço que o primeiro ocuparia
+# Quadros e folhas são caminhos virtuais '<arquivo>#quadro=<n|todos>' (ver split_frame_path).
+FRAME_POLICY = 'first'
+FRAME_POLICIES = ('first', 'all', 'sheet')
+FRAME_SEPARATOR = '#quadro='
+FRAME_SHEET = 'todos'
+# TIFFs grandes (sem compressão, Deflate ou PackBits) são lidos faixa por faixa direto do arquivo:
+# cada faixa de ~STRIP_DECODE_BAND_BYTES passa pelo hash, é convertida e reduzida com reduce()
+# inteiro, então só a versão reduzida fica residente. Vale a partir de STRIP_DECODE_MIN_BYTES
+# decodificados; o resultado é o do modo 'fast' (reduce + resample final) também em 'exact'.
+STRIP_DECODE_MIN_BYTES = 256 * 1024**2
+STRIP_DECODE_BAND_BYTES = 16 * 1024**2
+# Cancelamento cooperativo: hash, leitura por faixas, redimensionamento e gravação verificam o
+# pedido a cada bloco e param com OperationCancelled. Imagens a partir de CHUNKED_RESIZE_MIN_PIXELS
+# são redimensionadas em faixas de RESIZE_BAND_ROWS linhas de saída para o resample poder parar.
+CHUNKED_RESIZE_MIN_PIXELS = 16 * 1024**2
+RESIZE_BAND_ROWS = 256
+# Progresso das etapas com muitos itens (decodificação, montagem): no máximo um progress_update
+# a cada PROGRESS_INTERVAL segundos, para lotes enormes não inundarem o loop de eventos da GUI.
+PROGRESS_INTERVAL = 0.1
+# Backend de execução da etapa de decodificação/hash/redimensionamento:
+#   'thread'  -> ThreadPoolExecutor (padrão e fallback)
+#   'process' -> ProcessPoolExecutor; os pixels voltam por memória compartilhada
+EXECUTION_BACKEND = 'thread'
+EXECUTION_BACKENDS = ('thread', 'process')
+NUM_WORKERS = None # None = automático (2x CPUs com threads, 1x CPUs com processos)
+# Janela de submissão da Etapa 1: no máximo MAX_IN_FLIGHT imagens em voo (None = 2x num_workers).
+# Com MEMORY_BUDGET (bytes, ou 'auto' = MEMORY_BUDGET_FRACTION da RAM disponível no início da etapa)
+# a memória de decodificação estimada pelo cabeçalho das imagens em voo também fica limitada;
+# uma imagem sozinha sempre pode entrar, mesmo acima do orçamento.
+MAX_IN_FLIGHT = None
+MEMORY_BUDGET = None
+MEMORY_BUDGET_FRACTION = 0.5
+# Montagem da colagem:
+#   'memory'    -> guarda todas as imagens redimensionadas até colar (uma decodificação por imagem)
+#   'streaming' -> 1ª passada só coleta metadados (hash/ctime/tamanho); a 2ª decodifica e cola
+#                  uma imagem por vez. Pico de memória = tela + imagens em voo, ao custo de decodificar 2x.
+ASSEMBLY_MODE = 'memory'
+ASSEMBLY_MODES = ('memory', 'streaming')
+# Cache persistente de hash + miniatura (None = desativado). Chave: caminho, tamanho e mtime
+# do arquivo, RESIZE_FACTOR, filtro e qualidade; arquivos inalterados não são decodificados de novo.
+CACHE_DIR = None
+CACHE_MAX_BYTES = 2 * 1024**3 # Limite dos blobs; os menos usados recentemente são removidos
+# Pré-filtragem de arquivos byte a byte idênticos, antes de qualquer decodificação:
+# agrupa por tamanho, depois por hash parcial (início/fim) e só então pelo hash do arquivo inteiro.
+PRE_DECODE_DEDUP = True
+PARTIAL_HASH_BLOCK = 64 * 1024
+# Hash de conteúdo (chave da deduplicação exata) sobre os pixels decodificados, alimentado em blocos
+# de ~HASH_BLOCK_BYTES direto do encoder raw, sem a cópia inteira de tobytes():
+#   'sha256'   -> compatível com caches e estados incrementais já gravados (padrão)
+#   'blake2b'  -> BLAKE2b de 256 bits (biblioteca padrão)
+#   'xxh3_128' -> não criptográfico, o mais rápido; requer o pacote xxhash
+# Digests que não são SHA-256 levam o nome do algoritmo como prefixo ('blake2b:...').
+CONTENT_HASH = 'sha256'
+CONTENT_HASHES = ('sha256', 'blake2b', 'xxh3_128')
+HASH_BLOCK_BYTES = 4 * 1024**2
+# Filtragem de quase-duplicatas (reencodadas/redimensionadas) por hash perceptual de 64 bits:
+# None (desativada), 'dhash' ou 'phash'. Requer NumPy. Imagens a até PERCEPTUAL_THRESHOLD bits
+# de distância de Hamming de uma mais antiga são descartadas.
+PERCEPTUAL_HASH = None
+PERCEPTUAL_HASHES = ('dhash', 'phash')
+PERCEPTUAL_THRESHOLD = 6
+# Saída da colagem:
+#   'single'     -> uma tela inteira em memória salva com Pillow (limite de MAX_CANVAS_DIMENSION px)
+#   'png-strips' -> PNG escrito faixa por faixa (uma linha da grade por vez), sem limite prático
+#   'dzi'        -> pirâmide de tiles Deep Zoom (.dzi + pasta _files), também faixa por faixa
+#   'auto'       -> 'single' quando cabe no limite, senão 'png-strips'
+OUTPUT_ENGINE = 'auto'
+OUTPUT_ENGINES = ('single', 'png-strips', 'dzi', 'auto')
+MAX_CANVAS_DIMENSION = 65500 # Limite arbitrário (comum em algumas libs) para a tela única
+PNG_COMPRESS_LEVEL = 6 # 0-9 (zlib); 1 grava várias vezes mais rápido com arquivo um pouco maior
+# Formato da tela única ('single'); as saídas em faixas usam sempre PNG (ou os tiles do DZI)
+OUTPUT_FORMAT = 'png'
+OUTPUT_FORMATS = ('png', 'jpeg', 'webp', 'webp-lossless')
+OUTPUT_EXTENSIONS = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp', 'webp-lossless': '.webp'}
+JPEG_QUALITY = 95
+WEBP_QUALITY = 90
+WEBP_LOSSLESS_EFFORT = 50 # Em WebP sem perdas 'quality' é o esforço de compressão (0-100)
+WEBP_METHOD = 4 # 0 (rápido) a 6 (menor arquivo)
+WEBP_MAX_DIMENSION = 16383
+# Threads do encoder PNG paralelo (1 = encoder do Pillow/serial). Cada faixa de PNG_STRIP_ROWS linhas
+# é comprimida como um bloco deflate independente. None = automático: o encoder paralelo (núm. de CPUs)
+# só entra com NumPy (sem ele as linhas não são filtradas e o arquivo cresce) e a partir de
+# PARALLEL_PNG_MIN_PIXELS; abaixo disso a sobrecarga das faixas não compensa.
+ENCODE_WORKERS = None
+PARALLEL_PNG_MIN_PIXELS = 32 * 1024**2
+PNG_STRIP_ROWS = 256
+PNG_FILTER_CHUNK_BYTES = 64 * 1024**2 # Memória de trabalho do filtro adaptativo por faixa
+# Presets de gravação: sobrescrevem formato/compressão quando escolhidos no worker
+SAVE_PRESETS = {
+    'default': {'output_format': 'png', 'png_compress_level': PNG_COMPRESS_LEVEL},
+    'fast': {'output_format': 'png', 'png_compress_level': 1},
+    'small': {'output_format': 'webp', 'png_compress_level': PNG_COMPRESS_LEVEL},
+}
+# Layout da colagem:
+#   'grid'      -> grade uniforme; cada célula tem a largura e a altura máximas (comportamento original)
+#   'justified' -> linhas justificadas com altura ~LAYOUT_ROW_HEIGHT (imagens reescaladas para a altura da linha)
+#   'skyline'   -> empacotamento skyline bottom-left, sem reescalar as imagens
+LAYOUT_MODE = 'grid'
+LAYOUT_MODES = ('grid', 'justified', 'skyline')
+LAYOUT_ROW_HEIGHT = None # None = mediana das alturas (modo 'justified')
+LAYOUT_BAND_HEIGHT = 512 # Altura das faixas de saída quando o layout não tem linhas (modo 'skyline')
+DZI_TILE_SIZE = 256
+DZI_TILE_FORMAT = 'jpg'
+# Modo incremental: o estado (layout, células e índices de dedup) fica ao lado da colagem em
+# <saída>.estado.json; um novo arraste só processa os arquivos ainda não vistos e cola as novas
+# células na tela existente. O layout só é refeito quando a grade precisa crescer (ou, nos modos
+# 'justified'/'skyline', quando a altura passaria de INCREMENTAL_MAX_ASPECT vezes a largura).
+INCREMENTAL_OUTPUT_NAME = 'colagem_incremental' # Nome da colagem em save_dir quando não há output_path
+INCREMENTAL_STATE_SUFFIX = '.estado.json'
+INCREMENTAL_STATE_VERSION = 1
+INCREMENTAL_MAX_ASPECT = 2.0
+# Instrumentação: spans/contadores vão para os sinks do trabalho (JsonLinesSink, PrometheusTextfileSink,
+# CallbackSink). Perfil opcional por trabalho: 'cprofile' (thread do pipeline; com backend de threads o
+# código dos workers não entra), 'tracemalloc' (alocações de todas as threads) ou 'both'. O profiler e o
+# tracemalloc são do processo: só um trabalho por vez é perfilado (os simultâneos rodam sem perfil e
+# avisam), e o pico do tracemalloc inclui o que outros trabalhos rodando junto alocaram.
+PROFILE_MODES = ('cprofile', 'tracemalloc', 'both')
+# Pico de memória do trabalho: o RSS atual é amostrado nesse intervalo (s) enquanto ele roda. O pico do
+# getrusage vale para a vida toda do processo e sai à parte, como 'rss_lifetime'.
+MEMORY_SAMPLE_INTERVAL = 0.05
+PROFILE_TOP_ENTRIES = 40
+TRACEMALLOC_FRAMES = 10
+# Fila de trabalhos (CollageJobQueue): até MAX_CONCURRENT_JOBS colagens ao mesmo tempo, dividindo um
+# orçamento global de DECODE_WORKER_BUDGET workers de decodificação (None = 2x CPUs, o padrão de um
+# único trabalho com threads). Um trabalho sozinho recebe todo o orçamento livre; só quando há outros
+# esperando por uma vaga ele fica com orçamento / MAX_CONCURRENT_JOBS.
+MAX_CONCURRENT_JOBS = 2
+DECODE_WORKER_BUDGET = None
+# Modo vigia (CollageWatchDaemon): pastas monitoradas com inotify (Linux) ou por varredura a cada
+# WATCH_POLL_INTERVAL s ('auto' tenta inotify e cai para varredura, ex.: fora do Linux ou sem watches
+# livres; em compartilhamentos de rede só a varredura vê arquivos gravados por outras máquinas).
+# Na varredura um arquivo só entra depois de WATCH_SETTLE_TIME s com o mesmo tamanho e mtime.
+# Um lote vira colagem ao juntar WATCH_BATCH_SIZE arquivos ou WATCH_BATCH_WINDOW s depois do
+# primeiro; até WATCH_CONCURRENT_BATCHES lotes rodam juntos, dividindo um único executor.
+WATCH_MODE = 'auto'
+WATCH_MODES = ('auto', 'inotify', 'poll')
+WATCH_POLL_INTERVAL = 2.0
+WATCH_SETTLE_TIME = 1.0
+WATCH_BATCH_SIZE = 200
+WATCH_BATCH_WINDOW = 60.0
+WATCH_CONCURRENT_BATCHES = 2
+
+# --- Cancelamento cooperativo ---
+class OperationCancelled(Exception):
+    """Operação longa interrompida porque o cancel_check passado a ela indicou cancelamento."""
+
+def check_cancelled(cancel_check):
+    """Levanta OperationCancelled se cancel_check (função sem argumentos ou None) devolver True."""
+    if cancel_check is not None and cancel_check():
+        raise OperationCancelled("Operação cancelada")
+
+# Nos processos filhos do backend 'process': o multiprocessing.Event de cancelamento do pipeline,
+# recebido pelo initializer do pool (um Event não pode ir como argumento de cada tarefa)
+_worker_cancel_event = None
+
+def _init_process_worker(cancel_event):
+    global _worker_cancel_event
+    _worker_cancel_event = cancel_event
+
+def _worker_cancel_requested():
+    return _worker_cancel_event is not None and _worker_cancel_event.is_set()
+
+# --- Funções auxiliares de decodificação ---
+def collage_mode_for(mode):
+    """Modo final usado na colagem para uma imagem no modo informado."""
+    if mode == 'P': return 'RGBA'
+    if mode in ('RGB', 'RGBA'): return mode
+    return 'RGB' # L e demais modos
+def calculate_target_size(size, factor=RESIZE_FACTOR):
+    """Tamanho final (largura, altura) de uma imagem após o redimensionamento."""
+    w_orig, h_orig = size
+    return max(1, int(w_orig * factor)), max(1, int(h_orig * factor))
+
+def open_image_reduced(image_path, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, target_size=None):
+    """Abre e decodifica a imagem na menor resolução útil para o fator pedido.
+
+    Retorna (imagem carregada, tamanho alvo). Em modo 'fast' JPEGs usam draft(),
+    que escala no domínio DCT (1/2, 1/4, 1/8) e nunca materializa a resolução total.
+    target_size (já orientado, ex.: a célula planejada no layout) substitui o fator;
+    o tamanho devolvido está sempre na orientação dos pixels gravados. TIFFs grandes
+    chegam já reduzidos por faixas (ver decode_image).
+    """
+    decoded = decode_image(image_path, factor, quality, target_size)
+    return decoded.image, decoded.target_size
+
+def exif_orientation(img):
+    """Orientação EXIF declarada no cabeçalho (1 = normal, também se ausente ou inválida).
+
+    Em PNG, getexif() sem chunk eXIf antes do IDAT chama load() e decodifica a imagem
+    inteira atrás de um eXIf no fim do arquivo (fora da especificação): esse caso conta como 1.
+    """
+    if img.format == 'PNG' and 'exif' not in img.info:
+        return 1
+    try:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+    return orientation if orientation in EXIF_TRANSPOSITIONS else 1
+
+def oriented_size(size, orientation):
+    """Tamanho (largura, altura) depois de aplicar a orientação EXIF."""
+    return (size[1], size[0]) if orientation in (5, 6, 7, 8) else tuple(size)
+
+def resize_to_target(img, target_size, quality=DECODE_QUALITY, cancel_check=None):
+    """Redimensiona para target_size; em modo 'fast' usa reduce() inteiro antes do resample.
+
+    Com cancel_check, imagens grandes são redimensionadas em faixas (ver resize_in_bands).
+    """
+    if img.size == target_size:
+        return img
+    check_cancelled(cancel_check)
+    if quality == 'fast':
+        reduce_factor = min(img.width // target_size[0], img.height // target_size[1])
+        if reduce_factor >= 2:
+            img = img.reduce(reduce_factor)
+            if img.size == target_size:
+                return img
+    if cancel_check is not None and img.width * img.height >= CHUNKED_RESIZE_MIN_PIXELS:
+        return resize_in_bands(img, target_size, cancel_check)
+    return img.resize(target_size, RESAMPLING_FILTER)
+
+def resize_in_bands(img, target_size, cancel_check=None, band_rows=RESIZE_BAND_ROWS):
+    """Resample de img para target_size por faixas de saída, verificando cancel_check entre elas.
+
+    Cada faixa usa resize(box=...) com as coordenadas de origem dela; o filtro continua lendo
+    as linhas vizinhas fora da caixa, então não há emendas (só arredondamentos de 1 nível).
+    """
+    width, height = target_size
+    scale = img.height / height
+    resized = Image.new(img.mode, target_size)
+    for top in range(0, height, band_rows):
+        check_cancelled(cancel_check)
+        bottom = min(top + band_rows, height)
+        band = img.resize((width, bottom - top), RESAMPLING_FILTER, box=(0, top * scale, img.width, bottom * scale))
+        resized.paste(band, (0, top))
+    return resized
+
+def flatten_over_black(img):
+    """Compõe uma imagem RGBA sobre preto e devolve RGB (3 bytes/pixel).
+
+    Equivale a colar com máscara alfa no fundo preto da colagem, já que as células não se
+    sobrepõem; feito no worker, a montagem vira cópia direta de pixels RGB.
+    """
+    flat = Image.new('RGB', img.size, (0, 0, 0))
+    flat.paste(img, (0, 0), img) # A própria imagem como máscara: sem split() do canal alfa
+    return flat
+
+# --- Hash de conteúdo ---
+def new_content_hasher(name=CONTENT_HASH):
+    """Objeto hashlib-compatível (update/hexdigest) para o algoritmo de conteúdo pedido."""
+    if name == 'sha256':
+        return hashlib.sha256()
+    if name == 'blake2b':
+        return hashlib.blake2b(digest_size=32)
+    if name == 'xxh3_128':
+        if xxhash is None:
+            raise ValueError("O hash 'xxh3_128' requer o pacote xxhash ('pip install xxhash')")
+        return xxhash.xxh3_128()
+    raise ValueError(f"Hash de conteúdo inválido: {name!r} (use {CONTENT_HASHES})")
+
+def hash_image_pixels(img, name=CONTENT_HASH, block_bytes=HASH_BLOCK_BYTES, cancel_check=None):
+    """Hash dos pixels da imagem, idêntico ao de hash(img.tobytes()), sem materializar essa cópia."""
+    hasher = new_content_hasher(name)
+    feed_image_pixels(hasher, img, block_bytes, cancel_check)
+    return content_digest(hasher, name)
+
+def content_digest(hasher, name=CONTENT_HASH):
+    """Digest final no formato de content_hash (prefixado pelo algoritmo quando não é SHA-256)."""
+    digest = hasher.hexdigest()
+    return digest if name == 'sha256' else f'{name}:{digest}'
+
+def feed_image_pixels(hasher, img, block_bytes=HASH_BLOCK_BYTES, cancel_check=None):
+    """Passa os bytes de img.tobytes() para o hasher em blocos de linhas.
+
+    O encoder raw do Pillow (o mesmo usado por tobytes) entrega os blocos direto para o
+    hasher. Como Image._getencoder e img.im são internos, ele só é usado se existir e se
+    _raw_encoder_matches confirmar, para o modo, que a saída é igual à de tobytes();
+    senão os blocos saem de crop().tobytes(). Chamadas seguidas com faixas consecutivas
+    da mesma imagem dão o mesmo hash da imagem inteira. cancel_check é verificado antes
+    de cada bloco.
+    """
+    img.load()
+    row_bytes = max(1, len(img.crop((0, 0, img.width, 1)).tobytes())) if img.height else 1
+    rows_per_block = max(1, block_bytes // row_bytes)
+    if not (img.width and img.height):
+        return # Imagem vazia: hash de zero bytes, como hash(b'')
+    encoder = _open_raw_encoder(img) if _raw_encoder_matches(img.mode) else None
+    if encoder is not None:
+        buffer_size = max(rows_per_block * row_bytes, img.width * 4) # Mínimo exigido pelo RawEncode
+        for data in _raw_encoder_blocks(encoder, buffer_size, cancel_check):
+            hasher.update(data)
+    else:
+        for top in range(0, img.height, rows_per_block):
+            check_cancelled(cancel_check)
+            hasher.update(img.crop((0, top, img.width, min(top + rows_per_block, img.height))).tobytes())
+
+def _open_raw_encoder(img):
+    """Encoder raw do Pillow já ligado aos pixels de img; None se os internos não estiverem disponíveis."""
+    try:
+        encoder = Image._getencoder(img.mode, 'raw', img.mode)
+        encoder.setimage(img.im, (0, 0) + img.size)
+    except (AttributeError, TypeError, ValueError, OSError):
+        return None
+    return encoder
+
+def _raw_encoder_blocks(encoder, buffer_size, cancel_check=None):
+    while True:
+        check_cancelled(cancel_check)
+        _, error_code, data = encoder.encode(buffer_size)
+        yield data
+        if error_code:
+            if error_code < 0:
+                raise RuntimeError(f"Erro {error_code} do encoder raw ao calcular o hash")
+            break
+
+@lru_cache(maxsize=None)
+def _raw_encoder_matches(mode):
+    """Confere uma vez por modo se o encoder raw ainda reproduz tobytes() nesta versão do Pillow."""
+    try:
+        size = (7, 5) # Largura ímpar: pega diferenças de alinhamento por linha
+        length = len(Image.new(mode, size).tobytes())
+        sample = Image.frombytes(mode, size, bytes((index * 37 + 11) % 256 for index in range(length)))
+        encoder = _open_raw_encoder(sample)
+        if encoder is None:
+            return False
+        return b''.join(_raw_encoder_blocks(encoder, max(length, size[0] * 4))) == sample.tobytes()
+    except Exception:
+        return False
+
+# --- Quadros múltiplos e leitura de TIFFs por faixas ---
+def frame_path(image_path, frame):
+    """Caminho virtual de um quadro (índice) ou da folha de contato (FRAME_SHEET) de um arquivo."""
+    return f'{image_path}{FRAME_SEPARATOR}{frame}'
+
+def split_frame_path(image_path):
+    """(arquivo real, quadro): quadro é o índice, FRAME_SHEET ou 0 para caminhos comuns."""
+    real_path, separator, frame = image_path.rpartition(FRAME_SEPARATOR)
+    if not separator:
+        return image_path, 0
+    if frame == FRAME_SHEET:
+        return real_path, FRAME_SHEET
+    if frame.isdigit():
+        return real_path, int(frame)
+    return image_path, 0
+
+def open_frame(image_path):
+    """Abre o arquivo (sem decodificar) já posicionado no quadro do caminho virtual."""
+    real_path, frame = split_frame_path(image_path)
+    img = Image.open(real_path)
+    if frame and frame != FRAME_SHEET: # A folha de contato abre no primeiro quadro
+        img.seek(frame)
+    return img
+
+def count_frames(img):
+    """Quantidade de quadros; só percorre o arquivo inteiro se houver mais de um."""
+    return img.n_frames if getattr(img, 'is_animated', False) else 1
+
+def contact_sheet_grid(count):
+    """(colunas, linhas) da folha de contato com `count` quadros, o mais quadrada possível."""
+    columns = math.ceil(math.sqrt(count))
+    return columns, math.ceil(count / columns)
+
+def _strip_pieces(img, max_rows=None):
+    """Blocos (caixa, offset, bytes, compressão, rawmode, tamanho do bloco) do TIFF, ou None.
+
+    Só TIFFs com planos contíguos e sem preditor, sem compressão, Deflate ou PackBits (o Pillow
+    não expõe decodificadores por faixa para LZW/JPEG; esses caem na decodificação normal).
+    Faixas sem compressão com mais de max_rows linhas são divididas (são linhas contíguas).
+    """
+    if img.format != 'TIFF' or img.mode == 'P' or not img.tile:
+        return None
+    tags = img.tag_v2
+    compression = getattr(img, '_compression', None)
+    rawmode = img.tile[0][3][0]
+    if (tags.get(TiffImagePlugin.PLANAR_CONFIGURATION, 1) != 1 or tags.get(TiffImagePlugin.PREDICTOR, 1) != 1
+            or compression not in ('raw', 'tiff_adobe_deflate', 'tiff_deflate', 'packbits')):
+        return None
+    if compression != 'raw' and (tags.get(TiffImagePlugin.FILLORDER, 1) != 1
+                                 or rawmode not in ('1', '1;I', 'L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK')):
+        return None # O rawmode do libtiff já vem ajustado para a saída dele, não para os bytes crus
+    width, height = img.size
+    if TiffImagePlugin.STRIPOFFSETS in tags:
+        offsets, counts = tags[TiffImagePlugin.STRIPOFFSETS], tags.get(TiffImagePlugin.STRIPBYTECOUNTS)
+        piece_width, piece_height = width, min(tags.get(TiffImagePlugin.ROWSPERSTRIP, height), height)
+    else:
+        if compression == 'packbits':
+            return None # PackBits em blocos parciais precisaria de stride, que o decodificador não aceita
+        offsets, counts = tags.get(TiffImagePlugin.TILEOFFSETS), tags.get(TiffImagePlugin.TILEBYTECOUNTS)
+        piece_width, piece_height = tags.get(TiffImagePlugin.TILEWIDTH), tags.get(TiffImagePlugin.TILELENGTH)
+    if not (offsets and counts and len(offsets) == len(counts) and piece_width and piece_height):
+        return None
+    pieces = []
+    x = y = 0
+    for offset, count in zip(offsets, counts):
+        if y >= height:
+            return None
+        box = (x, y, min(x + piece_width, width), min(y + piece_height, height))
+        rows = box[3] - box[1]
+        if compression == 'raw' and piece_width == width and max_rows and rows > max_rows:
+            row_bytes = count // rows
+            for top in range(0, rows, max_rows):
+                part_rows = min(max_rows, rows - top)
+                pieces.append(((0, y + top, width, y + top + part_rows), offset + top * row_bytes,
+                               part_rows * row_bytes, compression, rawmode, (width, part_rows)))
+        else:
+            pieces.append((box, offset, count, compression, rawmode, (piece_width, piece_height)))
+        x += piece_width
+        if x >= width:
+            x, y = 0, y + piece_height
+    return pieces
+
+def strip_reduce_factor(img, target_size):
+    """Fator inteiro de reduce() da leitura por faixas (0 = decodificar a imagem inteira).
+
+    target_size na orientação dos pixels gravados. Só imagens grandes (STRIP_DECODE_MIN_BYTES)
+    e ao menos 2x maiores que o alvo compensam; o fator não deixa a imagem menor que o alvo.
+    """
+    decoded_bytes = img.width * img.height * len(img.getbands())
+    reduce_factor = min(img.width // target_size[0], img.height // target_size[1])
+    if decoded_bytes < STRIP_DECODE_MIN_BYTES or reduce_factor < 2 or _strip_pieces(img) is None:
+        return 0
+    return reduce_factor
+
+def _decode_piece(img, piece):
+    """Decodifica um bloco do TIFF (lido direto do arquivo) numa imagem do tamanho do bloco."""
+    (x0, y0, x1, y1), offset, count, compression, rawmode, (piece_width, piece_height) = piece
+    img.fp.seek(offset)
+    data = img.fp.read(count)
+    if compression in ('tiff_adobe_deflate', 'tiff_deflate'):
+        data = zlib.decompress(data)
+    if compression == 'packbits':
+        decoder = Image._getdecoder(img.mode, 'packbits', (rawmode,))
+    else:
+        # Blocos na borda direita guardam a largura cheia do bloco: o stride pula o excedente
+        stride = len(data) // piece_height if x1 - x0 < piece_width else 0
+        decoder = Image._getdecoder(img.mode, 'raw', (rawmode, stride, 1))
+    piece_img = Image.new(img.mode, (x1 - x0, y1 - y0))
+    decoder.setimage(piece_img.im, (0, 0) + piece_img.size)
+    try:
+        decoder.decode(data)
+    finally:
+        decoder.cleanup()
+    return piece_img
+
+def decode_strips_reduced(img, reduce_factor, hasher=None, band_bytes=STRIP_DECODE_BAND_BYTES, cancel_check=None):
+    """Lê o TIFF faixa por faixa e devolve a imagem reduzida por reduce_factor, no modo da colagem.
+
+    Cada faixa (altura múltipla do fator) passa pelo hasher antes de converter, então o hash
+    é o mesmo da imagem inteira; convertida e reduzida, ela vai para o resultado e é descartada.
+    Pico de memória: uma faixa, uma linha de blocos e a imagem reduzida. cancel_check é
+    verificado a cada linha de blocos e a cada bloco do hash.
+    """
+    width, height = img.size
+    collage_mode = collage_mode_for(img.mode)
+    row_bytes = max(1, width * len(img.getbands()))
+    band_rows = max(reduce_factor, band_bytes // row_bytes // reduce_factor * reduce_factor)
+    reduced = Image.new(collage_mode, (-(-width // reduce_factor), -(-height // reduce_factor)))
+
+    def flush(band, band_top):
+        if hasher is not None:
+            feed_image_pixels(hasher, band, cancel_check=cancel_check)
+        if band.mode != collage_mode:
+            band = band.convert(collage_mode)
+        reduced.paste(band.reduce(reduce_factor), (0, band_top // reduce_factor))
+
+    groups = defaultdict(list) # Linha de blocos (topo) -> blocos
+    for piece in _strip_pieces(img, band_rows):
+        groups[piece[0][1]].append(piece)
+    band_top = 0
+    band = Image.new(img.mode, (width, min(band_rows, height)))
+    for top in sorted(groups):
+        check_cancelled(cancel_check)
+        decoded = [(piece[0], _decode_piece(img, piece)) for piece in groups[top]]
+        bottom = max(box[3] for box, _ in decoded)
+        while band_top < height:
+            for box, piece_img in decoded: # paste() recorta o que fica fora da faixa
+                band.paste(piece_img, (box[0], box[1] - band_top))
+            band_bottom = band_top + band.height
+            if bottom < band_bottom:
+                break
+            flush(band, band_top)
+            band_top = band_bottom
+            band = Image.new(img.mode, (width, min(band_rows, height - band_top))) if band_top < height else None
+            if bottom <= band_top:
+                break
+    if band_top < height: # Blocos faltando no arquivo: o resto fica preto
+        flush(band, band_top)
+    return reduced
+
+def decode_contact_sheet(image_path, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, target_size=None, hasher=None,
+                         cancel_check=None):
+    """Folha de contato de todos os quadros do arquivo, no tamanho alvo do primeiro quadro.
+
+    Os quadros são decodificados um por vez (cada um já reduzido ao tamanho da sua célula,
+    orientado e composto sobre preto); o hasher recebe os pixels de todos, em ordem.
+    Devolve (folha RGB, tamanho alvo, pixels decodificados).
+    """
+    with Image.open(image_path) as img:
+        count = count_frames(img)
+        if target_size is None:
+            target_size = calculate_target_size(oriented_size(img.size, exif_orientation(img)), factor)
+        columns, rows = contact_sheet_grid(count)
+        cell_width, cell_height = max(1, target_size[0] // columns), max(1, target_size[1] // rows)
+        sheet = Image.new('RGB', target_size)
+        pixels_decoded = 0
+        for index in range(count):
+            check_cancelled(cancel_check)
+            img.seek(index)
+            orientation = exif_orientation(img)
+            width, height = oriented_size(img.size, orientation)
+            scale = min(cell_width / width, cell_height / height)
+            frame_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            decoded = decode_opened(img, factor, quality, frame_size, hasher, cancel_check)
+            if hasher is not None and not decoded.hashed:
+                feed_image_pixels(hasher, decoded.image, cancel_check=cancel_check)
+            pixels_decoded += decoded.pixels_decoded
+            thumbnail = decoded.image
+            collage_mode = collage_mode_for(thumbnail.mode)
+            if thumbnail.mode != collage_mode: thumbnail = thumbnail.convert(collage_mode)
+            thumbnail = resize_to_target(thumbnail, decoded.target_size, quality, cancel_check)
+            if orientation != 1:
+                thumbnail = thumbnail.transpose(EXIF_TRANSPOSITIONS[orientation])
+            if thumbnail.mode == 'RGBA':
+                thumbnail = flatten_over_black(thumbnail)
+            column, row = index % columns, index // columns
+            sheet.paste(thumbnail, (column * cell_width + (cell_width - thumbnail.width) // 2,
+                                    row * cell_height + (cell_height - thumbnail.height) // 2))
+    return sheet, target_size, pixels_decoded
+
+def decode_opened(img, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, target_size=None, hasher=None,
+                  cancel_check=None):
+    """Decodifica o quadro atual de uma imagem aberta na menor resolução útil (ver decode_image).
+
+    Com hasher, JPEGs não passam pelo draft: o hash é dos pixels em resolução total.
+    """
+    orientation = exif_orientation(img)
+    if target_size is None:
+        target_size = calculate_target_size(img.size, factor)
+    else:
+        target_size = oriented_size(target_size, orientation) # Troca de volta nas rotações de 90°
+    reduce_factor = strip_reduce_factor(img, target_size)
+    if reduce_factor:
+        reduced = decode_strips_reduced(img, reduce_factor, hasher, cancel_check=cancel_check)
+        return DecodedImage(reduced, target_size, orientation, img.width * img.height, hasher is not None)
+    if quality == 'fast' and img.format == 'JPEG' and hasher is None:
+        img.draft(img.mode, target_size) # Nunca reduz abaixo do tamanho alvo
+    img.load()
+    return DecodedImage(img, target_size, orientation, img.width * img.height)
+
+def decode_image(image_path, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, target_size=None, hasher=None,
+                 cancel_check=None):
+    """Decodifica uma imagem (ou quadro/folha de contato, pelo caminho virtual) para a miniatura.
+
+    TIFFs grandes vêm reduzidos por faixas e folhas de contato já prontas; nos dois casos os
+    pixels originais passam pelo hasher durante a leitura (DecodedImage.hashed). cancel_check
+    interrompe a leitura por faixas e a folha de contato com OperationCancelled.
+    """
+    real_path, frame = split_frame_path(image_path)
+    if frame == FRAME_SHEET:
+        sheet, target_size, pixels_decoded = decode_contact_sheet(real_path, factor, quality, target_size, hasher,
+                                                                  cancel_check)
+        return DecodedImage(sheet, target_size, 1, pixels_decoded, hasher is not None)
+    return decode_opened(open_frame(image_path), factor, quality, target_size, hasher, cancel_check)
+
+# --- Estrutura de Dados para Informações da Imagem ---
+@dataclass
+class DecodedImage:
+    """Resultado de decode_image: pixels prontos para converter, redimensionar e orientar."""
+    image: Image.Image
+    target_size: tuple[int, int] # Na orientação dos pixels de `image`
+    orientation: int # Orientação EXIF ainda a aplicar (1 = nenhuma)
+    pixels_decoded: int # Pixels lidos do arquivo (resolução cheia quando a leitura é por faixas)
+    hashed: bool = False # Os pixels originais já passaram pelo hasher durante a leitura
+
+@dataclass
+class ProcessedImageInfo:
+    original_path: str
+    creation_time: float
+    content_hash: str # Vazio quando calculado sem hash (2ª passada do modo streaming)
+    resized_size: tuple[int, int] # Tamanho após o redimensionamento (conhecido mesmo sem os pixels)
+    # A imagem PIL já redimensionada (None no modo só-metadados ou enquanto estiver em memória compartilhada)
+    resized_image: Image.Image | None = None
+    perceptual_hash: int | None = None # dHash/pHash de 64 bits, só quando a filtragem perceptual está ativa
+    # Medições da decodificação (segundos por fase, bytes lidos, pixels decodificados); None vindo do cache
+    metrics: dict | None = None
+
+
+@dataclass
+class ImageFailure:
+    """Falha ao processar uma imagem (load_and_resize_image com report_errors=True).
+
+    Atravessa o pool de processos, então o tipo do erro chega à instrumentação do pai.
+    """
+    original_path: str
+    error_type: str
+    message: str
+
+@dataclass
+class ImageProbe:
+    """Cabeçalho de uma imagem (probe_image), lido sem decodificar pixels."""
+    original_path: str
+    size: tuple[int, int] # Tamanho original, já com a orientação EXIF aplicada
+    mode: str
+    format: str | None
+    orientation: int # Tag EXIF de orientação (1 = normal)
+    target_size: tuple[int, int] # Tamanho após o redimensionamento (orientado), igual a resized_size
+    estimated_bytes: int # Memória de pico estimada para processar a imagem
+    frames: int = 1 # Quadros no arquivo (só contados com with_frames ou na folha de contato)
+
+# --- Sondagem de cabeçalhos (sem decodificar) ---
+def probe_image(image_path, factor=RESIZE_FACTOR, quality=DECODE_QUALITY,
+                with_frames=False, with_hash=True) -> ImageProbe | ImageFailure:
+    """Lê só o cabeçalho: tamanho, modo, formato, orientação EXIF e, com with_frames, os quadros.
+
+    Aceita os caminhos virtuais de quadros; a folha de contato tem o tamanho do primeiro quadro,
+    já orientada. A memória estimada conta a imagem decodificada (JPEGs em modo 'fast' na
+    escala do draft só com with_hash=False; TIFFs lidos por faixas só com a faixa e a versão
+    reduzida), a conversão de modo e a miniatura.
+    """
+    sheet = split_frame_path(image_path)[1] == FRAME_SHEET
+    try:
+        with open_frame(image_path) as img:
+            width, height = img.size
+            mode, image_format = img.mode, img.format
+            bands = len(img.getbands())
+            orientation = exif_orientation(img)
+            frames = count_frames(img) if with_frames or sheet else 1
+            target_width, target_height = calculate_target_size((width, height), factor)
+            reduce_factor = strip_reduce_factor(img, (target_width, target_height))
+    except Exception as e:
+        return ImageFailure(image_path, type(e).__name__, str(e))
+    decoded_width, decoded_height = width, height
+    if quality == 'fast' and image_format == 'JPEG' and not with_hash:
+        scale = 1 # draft() reduz por 1/2, 1/4 ou 1/8 sem ficar abaixo do alvo
+        while (scale < 8 and width // (scale * 2) >= target_width
+               and height // (scale * 2) >= target_height):
+            scale *= 2
+        decoded_width, decoded_height = -(-width // scale), -(-height // scale)
+    collage_mode = collage_mode_for(mode)
+    converted_bands = len(collage_mode) if collage_mode != mode else 0
+    if reduce_factor:
+        estimated_bytes = (3 * STRIP_DECODE_BAND_BYTES
+                           + -(-width // reduce_factor) * -(-height // reduce_factor) * len(collage_mode))
+    else:
+        estimated_bytes = decoded_width * decoded_height * (bands + converted_bands)
+    estimated_bytes += target_width * target_height * 4
+    size, target_size = (width, height), (target_width, target_height)
+    if sheet: # Quadros decodificados um por vez; a folha já sai orientada e em RGB
+        size, target_size = oriented_size(size, orientation), oriented_size(target_size, orientation)
+        return ImageProbe(image_path, size, 'RGB', image_format, 1, target_size, estimated_bytes, frames)
+    return ImageProbe(image_path, oriented_size(size, orientation), mode, image_format, orientation,
+                      oriented_size(target_size, orientation), estimated_bytes, frames)
+
+def probe_images(paths, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, max_workers=8, with_frames=False,
+                 cancel_check=None):
+    """probe_image em paralelo (threads: só E/S de cabeçalho); resultados na ordem de `paths`.
+
+    cancel_check é consultado antes de cada cabeçalho (OperationCancelled interrompe o lote).
+    """
+    def probe(path):
+        check_cancelled(cancel_check)
+        return probe_image(path, factor, quality, with_frames)
+    if len(paths) < 2 or max_workers <= 1:
+        return [probe(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ImgProbe') as executor:
+        return list(executor.map(probe, paths))
+
+def estimate_decode_bytes(image_path, factor=RESIZE_FACTOR, quality=DECODE_QUALITY):
+    """Memória de pico estimada (bytes) para processar uma imagem; None se o cabeçalho for ilegível."""
+    probe = probe_image(image_path, factor, quality)
+    return probe.estimated_bytes if isinstance(probe, ImageProbe) else None
+
+# --- Hash perceptual e índice de similaridade ---
+@lru_cache(maxsize=None)
+def _dct_matrix(n):
+    """Matriz da DCT-II ortonormal n x n."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+def compute_perceptual_hash(img, method='dhash'):
+    """Hash perceptual de 64 bits (dHash ou pHash) de uma imagem PIL, calculado com NumPy."""
+    gray = img.convert('L')
+    if method == 'dhash':
+        # Gradiente horizontal numa miniatura 9x8
+        pixels = np.asarray(gray.resize((9, 8), RESAMPLING_FILTER), dtype=np.int16)
+        bits = pixels[:, 1:] > pixels[:, :-1]
+    elif method == 'phash':
+        # Frequências baixas (8x8) da DCT de uma miniatura 32x32, comparadas à mediana
+        pixels = np.asarray(gray.resize((32, 32), RESAMPLING_FILTER), dtype=np.float64)
+        dct = _dct_matrix(32)
+        low_freq = (dct @ pixels @ dct.T)[:8, :8]
+        bits = low_freq > np.median(low_freq.ravel()[1:]) # Ignora o termo DC
+    else:
+        raise ValueError(f"Hash perceptual inválido: {method!r} (use {PERCEPTUAL_HASHES})")
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+class BKTree:
+    """Árvore BK sobre distância de Hamming: busca por vizinhos sem comparar todos os pares."""
+
+    def __init__(self):
+        self._root = None # Nó: (valor, item, {distância: filho})
+
+    def add(self, value, item):
+        if self._root is None:
+            self._root = (value, item, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def find_within(self, value, max_distance):
+        """Algum item a até max_distance de value, ou None."""
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                return item
+            # Desigualdade triangular: só filhos em [d - max, d + max] podem conter vizinhos
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return None
+
+def load_and_resize_image(image_path, factor=RESIZE_FACTOR, quality=DECODE_QUALITY,
+                          with_pixels=True, with_hash=True, perceptual=None,
+                          report_errors=False, target_size=None,
+                          content_hash=CONTENT_HASH, cancel_check=None) -> ProcessedImageInfo | ImageFailure | None:
+    """Carrega, obtém hash/ctime, converte modo, redimensiona e orienta (EXIF) UMA imagem.
+
+    with_pixels=False devolve só os metadados (sem converter/redimensionar);
+    with_hash=False pula o hash (imagem já filtrada numa passada anterior);
+    perceptual='dhash'/'phash' calcula também o hash perceptual;
+    target_size redimensiona direto para um tamanho planejado em vez de usar o fator;
+    content_hash escolhe o algoritmo do hash de conteúdo (CONTENT_HASHES);
+    cancel_check (função sem argumentos) interrompe hash, leitura por faixas e redimensionamento.
+    Em caso de erro devolve None, ou ImageFailure com report_errors=True; se cancelada, None.
+    """
+    def failed(error):
+        return ImageFailure(image_path, type(error).__name__, str(error)) if report_errors else None
+
+    try:
+        started = time.perf_counter()
+        # Obter tempo de criação primeiro (menos propenso a falhar que o carregamento)
+        try:
+             file_stat = os.stat(split_frame_path(image_path)[0])
+             creation_time = file_stat.st_ctime
+        except OSError as e:
+             print(f"Erro ao obter ctime para '{os.path.basename(image_path)}': {e}")
+             return failed(e) # Não podemos comparar sem ctime
+
+        # Carregar imagem (sem hash, em modo 'fast' JPEGs chegam reduzidos pelo draft; TIFFs grandes
+        # por faixas e folhas de contato já passam pelo hasher durante a leitura)
+        hasher = new_content_hasher(content_hash) if with_hash else None
+        decoded_image = decode_image(image_path, factor, quality, target_size, hasher, cancel_check)
+        img, target_size, orientation = decoded_image.image, decoded_image.target_size, decoded_image.orientation
+        decoded = time.perf_counter()
+        pixels_decoded = decoded_image.pixels_decoded
+
+        # Calcular hash do conteúdo ANTES de converter ou redimensionar
+        # Os pixels vão em blocos para o hasher (sem a cópia inteira de tobytes())
+        # Com hash, JPEGs vêm em resolução total também no modo 'fast' (ver decode_opened)
+        digest = ''
+        if with_hash:
+            try:
+                if not decoded_image.hashed:
+                    feed_image_pixels(hasher, img, cancel_check=cancel_check)
+                digest = content_digest(hasher, content_hash)
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                print(f"Erro ao calcular hash para '{os.path.basename(image_path)}': {e}")
+                return failed(e) # Não podemos comparar sem hash
+        hashed = time.perf_counter()
+
+        resized_img = None
+        if with_pixels or (perceptual and with_hash):
+            # Converter modos (após hash): P -> RGBA, L e outros -> RGB
+            collage_mode = collage_mode_for(img.mode)
+            if img.mode != collage_mode: img = img.convert(collage_mode)
+
+            # Redimensionar (após hash e conversão) e só então girar: a transposição fica barata
+            resized_img = resize_to_target(img, target_size, quality, cancel_check)
+            if orientation != 1:
+                resized_img = resized_img.transpose(EXIF_TRANSPOSITIONS[orientation])
+        resized = time.perf_counter()
+
+        # Hash perceptual sobre a imagem já redimensionada (também no modo só-metadados,
+        # para o valor não depender do modo de montagem nem de onde veio do cache)
+        perceptual_hash = None
+        if perceptual and with_hash:
+            perceptual_hash = compute_perceptual_hash(resized_img, perceptual)
+        if not with_pixels:
+            resized_img = None
+        elif resized_img.mode == 'RGBA':
+            # Composição sobre o fundo preto depois do hash perceptual (valores não mudam)
+            resized_img = flatten_over_black(resized_img)
+
+        # Retornar a estrutura completa
+        return ProcessedImageInfo(
+            original_path=image_path,
+            creation_time=creation_time,
+            content_hash=digest,
+            resized_size=oriented_size(target_size, orientation),
+            resized_image=resized_img,
+            perceptual_hash=perceptual_hash,
+            metrics={'decode_s': decoded - started, 'hash_s': hashed - decoded, 'resize_s': resized - hashed,
+                     'perceptual_s': time.perf_counter() - resized, 'bytes_read': file_stat.st_size,
+                     'pixels_decoded': pixels_decoded},
+        )
+
+    except OperationCancelled:
+        return None
+    except FileNotFoundError as e:
+         print(f"Erro: Arquivo não encontrado: {os.path.basename(image_path)}")
+         return failed(e)
+    except Exception as e:
+        print(f"Erro ao processar '{os.path.basename(image_path)}': {e}")
+        return failed(e)
+
+
+# --- Backend de processos: pixels via memória compartilhada ---
+def allocate_shared_buffer(image_path, factor=RESIZE_FACTOR, size=None):
+    """Aloca o buffer para os pixels redimensionados (size da sondagem, ou lido do cabeçalho).
+
+    Retorna (SharedMemory, tamanho, modo) ou (None, None, None) se o cabeçalho não puder ser lido.
+    """
+    mode = 'RGB' # Imagens RGBA chegam já compostas sobre preto (flatten_over_black)
+    if size is None:
+        probe = probe_image(image_path, factor)
+        if not isinstance(probe, ImageProbe):
+            return None, None, None # O worker reporta o erro real ao decodificar
+        size = probe.target_size
+    try:
+        shm = shared_memory.SharedMemory(create=True, size=size[0] * size[1] * len(mode))
+    except OSError as e:
+        print(f"Aviso: memória compartilhada indisponível para '{os.path.basename(image_path)}': {e}")
+        return None, None, None # Resultado volta serializado
+    return shm, size, mode
+
+def release_shared_buffer(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except (OSError, BufferError):
+        pass
+
+def new_process_pool(max_workers, cancel_event=None):
+    """ProcessPoolExecutor da decodificação; cancel_event (multiprocessing.Event) chega aos filhos."""
+    if os.name == 'posix':
+        # Os filhos precisam herdar o resource tracker do pai; se cada um iniciar
+        # o seu, os buffers anexados seriam "limpos" quando o filho terminasse.
+        resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_process_worker, initargs=(cancel_event,))
+
+def process_image_to_shared_memory(image_path, factor, quality, shm_name, expected_size, expected_mode,
+                                   with_pixels=True, with_hash=True, perceptual=None, report_errors=False,
+                                   target_size=None, content_hash=CONTENT_HASH):
+    """Executado no processo filho: processa a imagem e escreve os pixels no buffer do pai.
+
+    Se o resultado não bater com o tamanho/modo previstos pelo cabeçalho,
+    devolve a imagem PIL serializada normalmente (fallback). O cancelamento chega
+    pelo Event recebido em _init_process_worker.
+    """
+    info = load_and_resize_image(image_path, factor, quality, with_pixels, with_hash, perceptual, report_errors,
+                                 target_size, content_hash, _worker_cancel_requested)
+    if not isinstance(info, ProcessedImageInfo) or shm_name is None or info.resized_image is None:
+        return info
+    img = info.resized_image
+    if img.size != tuple(expected_size) or img.mode != expected_mode:
+        return info
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = img.tobytes()
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    info.resized_image = None # Pixels já estão no buffer compartilhado
+    return info
+
+def read_shared_buffer(shm, size, mode):
+    """Copia os pixels do buffer compartilhado para uma imagem PIL própria."""
+    view = shm.buf[:size[0] * size[1] * len(mode)]
+    try:
+        return Image.frombytes(mode, size, view)
+    finally:
+        view.release()
+
+
+# --- Pré-filtragem de arquivos idênticos (sem decodificar) ---
+def hash_file(image_path, partial=False):
+    """Hash dos bytes do arquivo; partial=True lê só o primeiro e o último bloco."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(image_path, 'rb') as f:
+        if partial:
+            digest.update(f.read(PARTIAL_HASH_BLOCK))
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - PARTIAL_HASH_BLOCK))
+            digest.update(f.read(PARTIAL_HASH_BLOCK))
+        else:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.digest()
+
+def find_identical_files(paths, max_workers=8):
+    """Grupos (listas de índices em paths) de arquivos byte a byte idênticos.
+
+    Só arquivos com o mesmo tamanho são lidos; o hash completo é calculado
+    apenas para quem colidiu no hash parcial e é maior que os dois blocos.
+    """
+    by_size = defaultdict(list)
+    for index, path in enumerate(paths):
+        try:
+            by_size[os.path.getsize(path)].append(index)
+        except OSError:
+            continue # O erro real aparece na decodificação
+    groups = [(size, group) for size, group in by_size.items() if len(group) > 1]
+
+    def safe_hash(args):
+        index, partial = args
+        try:
+            return hash_file(paths[index], partial)
+        except OSError:
+            return None
+
+    def refine(size_groups, partial):
+        jobs = [(index, partial) for _, group in size_groups for index in group]
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='FileHash') as executor:
+            digests = dict(zip((index for index, _ in jobs), executor.map(safe_hash, jobs)))
+        refined = []
+        for size, group in size_groups:
+            by_digest = defaultdict(list)
+            for index in group:
+                if digests[index] is not None:
+                    by_digest[digests[index]].append(index)
+            refined.extend((size, sub) for sub in by_digest.values() if len(sub) > 1)
+        return refined
+
+    groups = refine(groups, partial=True)
+    # Arquivos de até dois blocos já foram lidos por inteiro no hash parcial
+    fully_read = [group for size, group in groups if size <= 2 * PARTIAL_HASH_BLOCK]
+    needs_full = [(size, group) for size, group in groups if size > 2 * PARTIAL_HASH_BLOCK]
+    return fully_read + [group for _, group in refine(needs_full, partial=False)]
+
+
+# --- Layouts ---
+@dataclass
+class CollageLayout:
+    mode: str
+    width: int
+    height: int
+    placements: list[tuple[int, int, int, int]] # (x, y, largura, altura) por imagem, na ordem filtrada
+    bands: list[tuple[int, int]] # Faixas horizontais (y0, y1) usadas pela saída faixa por faixa
+    grid: tuple[int, int, int, int] | None = None # (cols, rows, cell_width, cell_height) no modo 'grid'
+    # Parâmetros para continuar o layout com novas imagens (modo incremental): 'justified' guarda
+    # row_height/target_width, 'skyline' guarda width e o skyline final
+    resume: dict | None = None
+
+    @property
+    def fill_ratio(self):
+        """Fração da tela coberta por imagens."""
+        used = sum(w * h for _, _, w, h in self.placements)
+        return used / (self.width * self.height) if self.width and self.height else 0.0
+
+def compute_grid_layout(sizes, cols, rows, cell_width, cell_height):
+    """Grade uniforme: imagem centralizada na sua célula, na ordem recebida."""
+    placements = []
+    for index, (w, h) in enumerate(sizes):
+        r, c = divmod(index, cols)
+        placements.append((c * cell_width + (cell_width - w) // 2, r * cell_height + (cell_height - h) // 2, w, h))
+    bands = [(r * cell_height, (r + 1) * cell_height) for r in range(rows)]
+    return CollageLayout('grid', cols * cell_width, rows * cell_height, placements, bands,
+                         (cols, rows, cell_width, cell_height))
+
+def compute_justified_layout(sizes, row_height=None, target_width=None):
+    """Linhas justificadas: cada linha é reescalada para a mesma largura da tela.
+
+    As imagens entram na altura row_height; ao passar da largura alvo
+    (~raiz da área total, tela quase quadrada) a linha fecha e é ajustada
+    à largura exata (panoramas maiores que a tela ficam sozinhos numa linha
+    mais baixa). A última linha, se incompleta, fica na altura alvo.
+    Com target_width fixo, acrescentar imagens só altera a última linha.
+    """
+    if row_height is None:
+        heights = sorted(h for _, h in sizes)
+        row_height = heights[len(heights) // 2]
+    row_height = max(1, int(row_height))
+    scaled_widths = [max(1, round(w * row_height / h)) for w, h in sizes]
+    if target_width is None:
+        target_width = max(1, int(math.sqrt(sum(scaled_widths) * row_height)))
+
+    rows, current = [], []
+    for index, scaled_width in enumerate(scaled_widths):
+        current.append(index)
+        if sum(scaled_widths[i] for i in current) >= target_width:
+            rows.append(current)
+            current = []
+    if current:
+        rows.append(current)
+
+    placements = [None] * len(sizes)
+    bands = []
+    y = 0
+    for row_number, row in enumerate(rows):
+        row_width = sum(scaled_widths[i] for i in row)
+        is_last_partial = row_number == len(rows) - 1 and row_width < target_width
+        scale = 1.0 if is_last_partial else target_width / row_width
+        height = max(1, round(row_height * scale))
+        x = 0
+        for position, index in enumerate(row):
+            if position == len(row) - 1 and not is_last_partial:
+                width = max(1, target_width - x) # Última da linha fecha a largura exata
+            else:
+                width = max(1, round(scaled_widths[index] * scale))
+            placements[index] = (x, y, width, height)
+            x += width
+        bands.append((y, y + height))
+        y += height
+    width = max(x + w for x, _, w, _ in placements) # Só difere de target_width com uma única linha incompleta
+    return CollageLayout('justified', width, y, placements, bands,
+                         resume={'row_height': row_height, 'target_width': target_width})
+
+def compute_skyline_layout(sizes, width=None, band_height=LAYOUT_BAND_HEIGHT, placed=(), skyline=None):
+    """Empacotamento skyline bottom-left (sem reescalar), das imagens mais altas às mais baixas.
+
+    No modo incremental as len(placed) primeiras imagens mantêm as posições `placed`
+    e só as demais são empacotadas, sobre o `skyline` salvo do layout anterior.
+    """
+    if width is None:
+        total_area = sum(w * h for w, h in sizes)
+        width = max(max(w for w, _ in sizes), int(math.sqrt(total_area)))
+    # Segmentos [x, y, largura], da esquerda para a direita
+    skyline = [list(segment) for segment in skyline] if skyline else [[0, 0, width]]
+    placements = [tuple(placement) for placement in placed] + [None] * (len(sizes) - len(placed))
+    for index in sorted(range(len(placed), len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0], i)):
+        w, h = sizes[index]
+        best = None # (topo resultante, x, índice do segmento)
+        for start, (seg_x, _, _) in enumerate(skyline):
+            if seg_x + w > width:
+                break
+            # Apoia no segmento mais alto dentre os que ficam sob [seg_x, seg_x + w)
+            top, covered, i = 0, 0, start
+            while covered < w:
+                top = max(top, skyline[i][1])
+                covered = skyline[i][0] + skyline[i][2] - seg_x
+                i += 1
+            if best is None or top + h < best[0] or (top + h == best[0] and seg_x < best[1]):
+                best = (top + h, seg_x, start)
+        bottom, x, start = best
+        placements[index] = (x, bottom - h, w, h)
+
+        # Substitui os segmentos cobertos por [x, x + w) pelo novo, preservando a sobra do último
+        new_segments = skyline[:start] + [[x, bottom, w]]
+        for seg_x, seg_y, seg_w in skyline[start:]:
+            seg_end = seg_x + seg_w
+            if seg_end <= x + w:
+                continue
+            if seg_x < x + w:
+                seg_x, seg_w = x + w, seg_end - (x + w)
+            new_segments.append([seg_x, seg_y, seg_w])
+        skyline = []
+        for segment in new_segments: # Junta vizinhos de mesma altura
+            if skyline and skyline[-1][1] == segment[1]:
+                skyline[-1][2] += segment[2]
+            else:
+                skyline.append(segment)
+
+    height = max(y + h for _, y, _, h in placements)
+    bands = [(y, min(y + band_height, height)) for y in range(0, height, band_height)]
+    return CollageLayout('skyline', width, height, placements, bands, resume={'width': width, 'skyline': skyline})
+
+
+def filter_png_rows(raw, rows, stride, previous_row=None):
+    """Filtra `rows` linhas RGB para o PNG (filtro adaptativo com NumPy, senão None).
+
+    previous_row são os bytes da linha logo acima (None na primeira linha da imagem).
+    Como a libpng/Pillow, escolhe por linha o filtro (None, Sub, Up, Average, Paeth)
+    com a menor soma dos resíduos em valor absoluto.
+    """
+    if np is None:
+        return b''.join(b'\x00' + raw[i * stride:(i + 1) * stride] for i in range(rows))
+    pixels = np.frombuffer(raw, dtype=np.uint8, count=rows * stride).reshape(rows, stride)
+    above = np.zeros(stride, dtype=np.uint8) if previous_row is None else np.frombuffer(previous_row, dtype=np.uint8)
+    filtered = np.empty((rows, stride + 1), dtype=np.uint8)
+    chunk = max(1, PNG_FILTER_CHUNK_BYTES // (stride * 16)) # Limita os temporários (5 candidatos em int16)
+    for top in range(0, rows, chunk):
+        x = pixels[top:top + chunk].astype(np.int16)
+        b = np.vstack((above[np.newaxis].astype(np.int16), x[:-1])) # Linha de cima
+        a = np.zeros_like(x)
+        a[:, 3:] = x[:, :-3] # Pixel à esquerda (3 bytes por pixel)
+        c = np.zeros_like(x)
+        c[:, 3:] = b[:, :-3]
+        p = a + b - c
+        pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+        candidates = np.stack((x, x - a, x - b, x - ((a + b) >> 1), x - paeth)).astype(np.uint8)
+        costs = np.abs(candidates.view(np.int8).astype(np.int16)).sum(axis=2, dtype=np.int64)
+        best = costs.argmin(axis=0)
+        filtered[top:top + chunk, 0] = best
+        filtered[top:top + chunk, 1:] = candidates[best, np.arange(len(best))]
+        above = pixels[top + len(best) - 1]
+    return filtered.tobytes()
+
+
+def adler32_combine(adler1, adler2, length2):
+    """Adler-32 da concatenação A+B a partir dos checksums de A e B (como adler32_combine da zlib)."""
+    base = 65521
+    remainder = length2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % base
+    sum1 = (sum1 + (adler2 & 0xffff) + base - 1) % base
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + base - remainder) % base
+    return sum1 | (sum2 << 16)
+
+
+def _deflate_png_rows(raw, rows, stride, previous_row, compress_level, final):
+    """Filtra e comprime um bloco de linhas como deflate cru independente.
+
+    Blocos intermediários terminam com Z_SYNC_FLUSH (alinhados em byte, sem BFINAL),
+    então podem ser concatenados num único fluxo zlib. Retorna (dados, adler32, tamanho filtrado).
+    """
+    filtered = filter_png_rows(raw, rows, stride, previous_row)
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    data = compressor.compress(filtered) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(filtered), len(filtered)
+
+
+# --- Saída faixa por faixa (sem a tela inteira em memória) ---
+class PngStripWriter:
+    """Escreve um PNG RGB de 8 bits faixa por faixa.
+
+    Só a faixa atual fica em memória; as linhas são filtradas (filtro adaptativo
+    com NumPy, senão None) e comprimidas incrementalmente em chunks IDAT.
+    Com workers > 1 cada faixa é comprimida numa thread como bloco deflate
+    independente; os blocos são gravados em ordem e o Adler-32 é combinado.
+    """
+    IDAT_SIZE = 1024 * 1024
+
+    def __init__(self, path, width, height, compress_level=PNG_COMPRESS_LEVEL, workers=1):
+        if not (0 < width < 2**31 and 0 < height < 2**31):
+            raise ValueError(f"Dimensões inválidas para PNG: {width}x{height}")
+        if not 0 <= compress_level <= 9:
+            raise ValueError(f"Nível de compressão PNG inválido: {compress_level} (use 0-9)")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.compress_level = compress_level
+        self.rows_written = 0
+        self._stride = width * 3
+        self._previous_row = None
+        self._pending = []
+        self._pending_size = 0
+        self._executor = None
+        if workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='png')
+            self._max_in_flight = workers * 2
+            self._in_flight = deque()
+            self._adler = 1
+            self._compressor = None
+        else:
+            self._compressor = zlib.compressobj(compress_level)
+        self._file = open(path, 'wb')
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        if self._executor is not None:
+            self._queue_compressed(b'\x78\x9c') # Cabeçalho zlib (deflate, janela de 32 KiB)
+
+    def _write_chunk(self, tag, data):
+        self._file.write(struct.pack('>I', len(data)) + tag)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(tag))))
+
+    def _queue_compressed(self, data, final=False):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= self.IDAT_SIZE or (final and self._pending):
+            self._write_chunk(b'IDAT', b''.join(self._pending))
+            self._pending, self._pending_size = [], 0
+
+    def _drain(self, keep):
+        """Grava, em ordem, os blocos paralelos prontos até restarem `keep` em voo."""
+        while len(self._in_flight) > keep or (self._in_flight and self._in_flight[0].done()):
+            data, adler, length = self._in_flight.popleft().result()
+            self._adler = adler32_combine(self._adler, adler, length)
+            self._queue_compressed(data)
+
+    def write_strip(self, strip):
+        """Acrescenta as linhas de uma faixa (largura igual à da imagem)."""
+        if strip.width != self.width:
+            raise ValueError(f"Faixa com largura {strip.width}, esperado {self.width}.")
+        if strip.mode != 'RGB':
+            strip = strip.convert('RGB')
+        rows = min(strip.height, self.height - self.rows_written)
+        if rows <= 0:
+            return
+        raw = strip.tobytes()
+        previous_row = self._previous_row
+        self._previous_row = raw[(rows - 1) * self._stride:rows * self._stride]
+        self.rows_written += rows
+        if self._executor is None:
+            self._queue_compressed(self._compressor.compress(
+                filter_png_rows(raw, rows, self._stride, previous_row)))
+            return
+        final = self.rows_written == self.height
+        self._in_flight.append(self._executor.submit(
+            _deflate_png_rows, raw, rows, self._stride, previous_row, self.compress_level, final))
+        self._drain(self._max_in_flight)
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG incompleto: {self.rows_written} de {self.height} linhas escritas.")
+        if self._executor is None:
+            self._queue_compressed(self._compressor.flush(), final=True)
+        else:
+            self._drain(0)
+            self._executor.shutdown()
+            self._queue_compressed(struct.pack('>I', self._adler), final=True)
+        self._write_chunk(b'IEND', b'')
+        self._file.close()
+        return self.path
+
+    def abort(self):
+        """Fecha e remove o arquivo parcial."""
+        if self._executor is not None:
+            for future in self._in_flight:
+                future.cancel()
+            self._executor.shutdown()
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class CancellableWriter:
+    """Arquivo de saída para Image.save() que para a gravação quando cancel_check() devolve True.
+
+    Sem fileno(), o Pillow passa o resultado do encoder por write() em blocos (~64 KiB no PNG e
+    no JPEG), e cada bloco verifica o cancelamento. O WebP é codificado inteiro antes da primeira
+    escrita: nele só a escrita é evitada.
+    """
+
+    def __init__(self, file, cancel_check):
+        self._file = file
+        self._cancel_check = cancel_check
+
+    def write(self, data):
+        check_cancelled(self._cancel_check)
+        return self._file.write(data)
+
+    def tell(self):
+        return self._file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def flush(self):
+        self._file.flush()
+
+
+def png_encode_workers(size, encode_workers=ENCODE_WORKERS):
+    """Threads do encoder PNG para uma imagem de `size` (1 = encoder do Pillow); ver ENCODE_WORKERS."""
+    if encode_workers is not None:
+        return max(1, encode_workers)
+    if np is None or size[0] * size[1] < PARALLEL_PNG_MIN_PIXELS:
+        return 1
+    return os.cpu_count() or 1
+
+def save_png_parallel(image, path, compress_level=PNG_COMPRESS_LEVEL, workers=None, strip_rows=PNG_STRIP_ROWS,
+                      cancel_check=None):
+    """Salva uma imagem inteira como PNG comprimindo faixas horizontais em paralelo.
+
+    cancel_check é verificado a cada faixa; cancelado ou com erro, o arquivo parcial é removido.
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    workers = workers or os.cpu_count() or 1
+    writer = PngStripWriter(path, image.width, image.height, compress_level, workers=workers)
+    try:
+        for top in range(0, image.height, strip_rows):
+            check_cancelled(cancel_check)
+            writer.write_strip(image.crop((0, top, image.width, min(top + strip_rows, image.height))))
+        return writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def save_collage(image, path, output_format=OUTPUT_FORMAT, compress_level=PNG_COMPRESS_LEVEL,
+                 encode_workers=ENCODE_WORKERS, cancel_check=None):
+    """Salva a tela da colagem no formato pedido e retorna o tempo gasto (s).
+
+    PNG usa o encoder paralelo quando png_encode_workers() dá mais de uma thread e a
+    imagem tem mais de PNG_STRIP_ROWS linhas; WebP é limitado a WEBP_MAX_DIMENSION px por lado.
+    Com cancel_check a gravação pode ser interrompida (OperationCancelled, ver
+    CancellableWriter) e o arquivo parcial é removido.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato de saída inválido: {output_format!r} (use {OUTPUT_FORMATS})")
+    if output_format.startswith('webp') and max(image.size) > WEBP_MAX_DIMENSION:
+        raise ValueError(f"WebP aceita no máximo {WEBP_MAX_DIMENSION} px por lado; "
+                         f"a colagem tem {image.width}x{image.height}.")
+    encode_workers = png_encode_workers(image.size, encode_workers)
+    start = time.perf_counter()
+    if output_format == 'png' and encode_workers > 1 and image.height > PNG_STRIP_ROWS:
+        save_png_parallel(image, path, compress_level, encode_workers, cancel_check=cancel_check)
+        return time.perf_counter() - start
+    if output_format == 'png':
+        file_format, params = 'PNG', {'compress_level': compress_level}
+    elif output_format == 'jpeg':
+        file_format, params = 'JPEG', {'quality': JPEG_QUALITY}
+    elif output_format == 'webp':
+        file_format, params = 'WEBP', {'quality': WEBP_QUALITY, 'method': WEBP_METHOD}
+    else:
+        file_format, params = 'WEBP', {'lossless': True, 'quality': WEBP_LOSSLESS_EFFORT, 'method': WEBP_METHOD}
+    if cancel_check is None:
+        image.save(path, file_format, **params)
+        return time.perf_counter() - start
+    try:
+        with open(path, 'wb') as f:
+            image.save(CancellableWriter(f, cancel_check), file_format, **params)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return time.perf_counter() - start
+
+
+def compare_output_formats(image, directory, formats=OUTPUT_FORMATS, compress_levels=(1, PNG_COMPRESS_LEVEL),
+                           encode_workers=ENCODE_WORKERS):
+    """Grava a mesma tela em cada formato (e nível PNG) e retorna [(rótulo, segundos, bytes)].
+
+    Os arquivos de teste são removidos; útil para escolher o formato de um trabalho.
+    """
+    results = []
+    variants = [('png', level) for level in compress_levels if 'png' in formats]
+    variants += [(fmt, PNG_COMPRESS_LEVEL) for fmt in formats if fmt != 'png']
+    for output_format, level in variants:
+        if output_format.startswith('webp') and max(image.size) > WEBP_MAX_DIMENSION:
+            continue
+        path = os.path.join(directory, f'formato_teste_{output_format}_{level}{OUTPUT_EXTENSIONS[output_format]}')
+        try:
+            elapsed = save_collage(image, path, output_format, level, encode_workers)
+            label = f'png (nível {level})' if output_format == 'png' else output_format
+            results.append((label, elapsed, os.path.getsize(path)))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+    return results
+
+class DeepZoomWriter:
+    """Gera uma pirâmide Deep Zoom (.dzi + pasta _files) a partir de faixas horizontais.
+
+    Cada nível guarda só uma banda de tile_size linhas; quando ela enche, os tiles
+    são gravados e a banda reduzida pela metade alimenta o nível de baixo.
+    """
+
+    def __init__(self, dzi_path, width, height, tile_size=DZI_TILE_SIZE, tile_format=DZI_TILE_FORMAT):
+        self.path = dzi_path
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.tile_format = tile_format
+        self.files_dir = os.path.splitext(dzi_path)[0] + '_files'
+        self.max_level = math.ceil(math.log2(max(width, height))) if max(width, height) > 1 else 0
+        # Por nível: [largura, altura, linhas já gravadas, banda atual, linhas na banda]
+        self._levels = {}
+        for level in range(self.max_level + 1):
+            scale = 2 ** (self.max_level - level)
+            self._levels[level] = [math.ceil(width / scale), math.ceil(height / scale), 0, None, 0]
+        os.makedirs(self.files_dir, exist_ok=True)
+
+    def write_strip(self, strip):
+        if strip.mode != 'RGB':
+            strip = strip.convert('RGB')
+        self._push(self.max_level, strip)
+
+    def _push(self, level, img):
+        state = self._levels[level]
+        level_width, level_height = state[0], state[1]
+        offset = 0
+        while offset < img.height and state[2] < level_height:
+            if state[3] is None:
+                band_height = min(self.tile_size, level_height - state[2])
+                state[3], state[4] = Image.new('RGB', (level_width, band_height), (0, 0, 0)), 0
+            band = state[3]
+            take = min(band.height - state[4], img.height - offset)
+            band.paste(img.crop((0, offset, level_width, offset + take)), (0, state[4]))
+            state[4] += take
+            offset += take
+            if state[4] == band.height:
+                self._flush_band(level)
+
+    def _flush_band(self, level):
+        state = self._levels[level]
+        band = state[3]
+        level_dir = os.path.join(self.files_dir, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        tile_row = state[2] // self.tile_size
+        save_args = {'quality': 90} if self.tile_format in ('jpg', 'jpeg', 'webp') else {}
+        for tile_col, x in enumerate(range(0, band.width, self.tile_size)):
+            tile = band.crop((x, 0, min(x + self.tile_size, band.width), band.height))
+            tile.save(os.path.join(level_dir, f'{tile_col}_{tile_row}.{self.tile_format}'), **save_args)
+        state[2] += band.height
+        state[3], state[4] = None, 0
+        if level > 0:
+            self._push(level - 1, band.reduce(2) if min(band.size) > 1 else band.resize(
+                (max(1, math.ceil(band.width / 2)), max(1, math.ceil(band.height / 2)))))
+
+    def close(self):
+        for level, state in self._levels.items():
+            if state[2] != state[1]:
+                raise ValueError(f"Nível {level} incompleto: {state[2]} de {state[1]} linhas.")
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{self.tile_size}" '
+                    f'Overlap="0" Format="{self.tile_format}"><Size Width="{self.width}" Height="{self.height}"/></Image>\n')
+        return self.path
+
+    def abort(self):
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# --- Cache persistente de miniaturas ---
+class ThumbnailCache:
+    """Cache em disco de hash + pixels redimensionados (índice SQLite + blobs brutos).
+
+    Entradas podem existir só com o hash (1ª passada do modo streaming); os pixels
+    são anexados depois. Remoção LRU quando os blobs passam de max_bytes.
+
+    Vários jobs (--each, --jobs, watch) podem abrir o mesmo cache_dir: a conexão fica em
+    autocommit, então cada escrita é uma transação curta e nunca segura o lock do banco
+    entre uma imagem e outra.
+    """
+
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite3'), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL') # Com WAL, commit por escrita sem fsync a cada uma
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, path TEXT NOT NULL, content_hash TEXT NOT NULL,
+            width INTEGER NOT NULL, height INTEGER NOT NULL, mode TEXT,
+            nbytes INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL, perceptual_hash TEXT)""")
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(entries)')}
+        if 'perceptual_hash' not in columns: # Índices criados antes da filtragem perceptual
+            self._conn.execute('ALTER TABLE entries ADD COLUMN perceptual_hash TEXT')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries').fetchone()[0]
+        self.hits = self.misses = self.stores = self.evictions = 0
+
+    @staticmethod
+    def make_key(image_path, stat_result, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, content_hash=CONTENT_HASH):
+        filter_name = getattr(RESAMPLING_FILTER, 'name', RESAMPLING_FILTER)
+        raw_key = (f"{os.path.abspath(image_path)}|{stat_result.st_size}|{stat_result.st_mtime_ns}"
+                   f"|{factor}|{filter_name}|{quality}|exif") # Miniaturas já orientadas (EXIF)
+        if content_hash != 'sha256': # sha256 mantém as chaves de índices antigos
+            raw_key += f"|{content_hash}"
+        return hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+
+    def _blob_path(self, key):
+        return os.path.join(self.blob_dir, key[:2], key + '.raw')
+
+    def get(self, image_path, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, with_pixels=True, perceptual=None,
+            content_hash=CONTENT_HASH):
+        """ProcessedImageInfo do cache, ou None (arquivo alterado, ausente ou sem os pixels pedidos).
+
+        Sem pixels, o hash perceptual pedido também precisa estar gravado (não há como recalculá-lo).
+        """
+        try:
+            stat_result = os.stat(split_frame_path(image_path)[0])
+        except OSError:
+            return None # O worker reporta o erro ao tentar decodificar
+        key = self.make_key(image_path, stat_result, factor, quality, content_hash)
+        with self._lock:
+            row = self._conn.execute('SELECT content_hash, width, height, mode, nbytes, perceptual_hash '
+                                     'FROM entries WHERE key = ?', (key,)).fetchone()
+            perceptual_hash = None
+            if row is not None and perceptual and row[5] and row[5].startswith(perceptual + ':'):
+                perceptual_hash = int(row[5].split(':', 1)[1], 16)
+            if row is None or (with_pixels and not row[4]) or (perceptual and not with_pixels and perceptual_hash is None):
+                self.misses += 1
+                return None
+            content_hash, width, height, mode, nbytes, _ = row
+            resized_image = None
+            if with_pixels:
+                try:
+                    with open(self._blob_path(key), 'rb') as f:
+                        resized_image = Image.frombytes(mode, (width, height), f.read())
+                except (OSError, ValueError):
+                    self._delete(key, nbytes) # Blob sumiu ou corrompeu
+                    self.misses += 1
+                    return None
+            self._conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+        return ProcessedImageInfo(
+            original_path=image_path,
+            creation_time=stat_result.st_ctime,
+            content_hash=content_hash,
+            resized_size=(width, height),
+            resized_image=resized_image,
+            perceptual_hash=perceptual_hash
+        )
+
+    def put(self, image_info, factor=RESIZE_FACTOR, quality=DECODE_QUALITY, perceptual=None,
+            content_hash=CONTENT_HASH):
+        """Grava hash, pixels e/ou hash perceptual. Sem hash (2ª passada) só completa uma entrada existente."""
+        try:
+            key = self.make_key(image_info.original_path, os.stat(split_frame_path(image_info.original_path)[0]),
+                                factor, quality, content_hash)
+        except OSError:
+            return
+        img = image_info.resized_image
+        with self._lock:
+            row = self._conn.execute('SELECT content_hash, nbytes, mode, perceptual_hash FROM entries WHERE key = ?',
+                                     (key,)).fetchone()
+            content_hash = image_info.content_hash or (row[0] if row else '')
+            if not content_hash:
+                return
+            nbytes, mode = (row[1], row[2]) if row else (0, None)
+            perceptual_text = row[3] if row else None
+            new_perceptual = (f"{perceptual}:{image_info.perceptual_hash:016x}"
+                              if perceptual and image_info.perceptual_hash is not None else perceptual_text)
+            if img is not None and not nbytes:
+                blob_path = self._blob_path(key)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                data = img.tobytes()
+                tmp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, blob_path) # Escrita atômica
+                nbytes, mode = len(data), img.mode
+                self._total_bytes += nbytes
+            elif row is not None and new_perceptual == perceptual_text:
+                return # Nada novo a gravar
+            width, height = image_info.resized_size
+            self._conn.execute("""INSERT INTO entries (key, path, content_hash, width, height, mode, nbytes, last_used,
+                                                       perceptual_hash)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                  ON CONFLICT(key) DO UPDATE SET mode = excluded.mode, nbytes = excluded.nbytes,
+                                                                 last_used = excluded.last_used,
+                                                                 perceptual_hash = excluded.perceptual_hash""",
+                               (key, image_info.original_path, content_hash, width, height, mode, nbytes, time.time(),
+                                new_perceptual))
+            self.stores += 1
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove entradas menos usadas até ficar em 90% do limite (chamado com o lock)."""
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute('SELECT key, nbytes FROM entries WHERE nbytes > 0 ORDER BY last_used').fetchall()
+        for key, nbytes in rows:
+            if self._total_bytes <= target:
+                break
+            self._delete(key, nbytes)
+            self.evictions += 1
+
+    def _delete(self, key, nbytes):
+        try:
+            os.remove(self._blob_path(key))
+        except OSError:
+            pass
+        self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self._total_bytes -= nbytes
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores,
+                'evictions': self.evictions, 'bytes': self._total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- Instrumentação: spans, contadores e memória ---
+def current_rss_bytes():
+    """RSS atual do processo (/proc/self/statm ou psutil); None se indisponível."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def process_peak_rss_bytes(children=False):
+    """Pico de RSS do processo (ou do maior filho já finalizado) desde o início; None se indisponível.
+
+    É um pico da vida toda do processo: num processo com vários trabalhos, os seguintes herdam o
+    pico dos anteriores. Para o pico de um trabalho, veja MetricsRecorder.start_memory_sampling().
+    """
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+        return usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024) # Linux informa em KiB
+    if psutil is not None and not children:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def available_memory_bytes():
+    """RAM disponível agora (psutil, MemAvailable do /proc/meminfo ou sysconf); None se não der para saber.
+
+    SC_AVPHYS_PAGES é só a memória livre (MemFree), sem o cache de páginas que o kernel
+    devolve sob pressão: fica como último recurso, porque subestima bastante.
+    """
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open('/proc/meminfo', 'rb') as f:
+            for line in f:
+                if line.startswith(b'MemAvailable:'):
+                    return int(line.split()[1]) * 1024 # Informado em kB
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class JsonLinesSink:
+    """Acrescenta cada evento (spans e o resumo final) como uma linha JSON num arquivo."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def emit(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self, summary=None):
+        """Grava o resumo (se houver) e fecha; sem resumo, só fecha um arquivo compartilhado por vários trabalhos."""
+        if summary is not None:
+            self.emit(summary)
+        self._file.close()
+
+
+class PrometheusTextfileSink:
+    """Grava o resumo do trabalho num .prom para o textfile collector do node_exporter.
+
+    Os valores são do último trabalho (gauges); o arquivo é trocado atomicamente.
+    """
+
+    def __init__(self, path, prefix='collage'):
+        self.path = path
+        self.prefix = prefix
+
+    def emit(self, event):
+        pass # Só o resumo interessa
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        pairs = []
+        for key, value in sorted(labels.items()):
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def close(self, summary):
+        p = self.prefix
+        job = {'job_id': summary['job_id']}
+        series = [
+            (f'{p}_job_success', 'Último trabalho terminou com sucesso (1) ou não (0).',
+             [(job, 1 if summary['status'] == 'ok' else 0)]),
+            (f'{p}_job_duration_seconds', 'Duração do último trabalho.', [(job, summary['duration_s'])]),
+            (f'{p}_job_timestamp_seconds', 'Fim do último trabalho (epoch).', [(job, summary['end'])]),
+            (f'{p}_stage_seconds', 'Tempo de parede por etapa no último trabalho.',
+             [(dict(job, stage=stage), value) for stage, value in summary['stages'].items()]),
+            (f'{p}_memory_peak_bytes', ('Memória do último trabalho: rss = pico amostrado no trabalho, rss_start = no início, '
+              '*_lifetime = pico do processo desde que começou, tracemalloc_process = pico do tracemalloc.'),
+             [(dict(job, kind=kind), value) for kind, value in summary['memory'].items() if value is not None]),
+        ]
+        counters = defaultdict(list)
+        for counter in summary['counters']:
+            counters[counter['name']].append((dict(job, **counter['labels']), counter['value']))
+        for name, samples in sorted(counters.items()):
+            series.append((f'{p}_{name}', f'Contador {name} do último trabalho.', samples))
+        lines = []
+        for name, help_text, samples in series:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(f'{name}{self._labels(labels)} {value}' for labels, value in samples)
+        temporary_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temporary_path, self.path)
+
+
+class CallbackSink:
+    """Entrega cada evento (e o resumo final) a uma função, no processo atual."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, event):
+        self.callback(event)
+
+    def close(self, summary):
+        self.callback(summary)
+
+
+class MetricsRecorder:
+    """Coleta spans, contadores e picos de memória de um trabalho e repassa aos sinks.
+
+    Eventos são dicts com 'type' ('span' ou 'summary') e 'job_id'. Seguro entre
+    threads; um sink que falha é desativado com um aviso, sem derrubar o trabalho.
+
+    Memória: 'rss' é o pico do RSS atual amostrado durante o trabalho (desde
+    start_memory_sampling) e 'rss_start' o RSS no início; o RSS é do processo todo,
+    então inclui trabalhos simultâneos. 'rss_lifetime' e 'rss_children_lifetime' são
+    os picos do getrusage desde o início do processo; 'tracemalloc_process' é o pico
+    do tracemalloc (global ao processo), quando ativo.
+    """
+
+    def __init__(self, job_id, sinks=()):
+        self.job_id = job_id
+        self.sinks = list(sinks)
+        self.counters = {} # (nome, rótulos ordenados) -> valor
+        self.stages = {} # etapa -> segundos acumulados
+        self.memory = {'rss': None, 'rss_start': None, 'rss_lifetime': None, 'rss_children_lifetime': None,
+                       'tracemalloc_process': None}
+        self.start = time.time()
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._sampler_stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def emit(self, event):
+        for sink in list(self.sinks):
+            try:
+                sink.emit(event)
+            except Exception as e:
+                print(f"Aviso: sink de métricas {type(sink).__name__} falhou e foi desativado: {e}")
+                self.sinks.remove(sink)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_span(self, kind, name, start, duration, **attributes):
+        if kind == 'stage':
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + duration
+        if self.sinks:
+            self.emit(dict(type='span', job_id=self.job_id, kind=kind, name=name, start=start,
+                           duration_s=round(duration, 6), **attributes))
+
+    @contextmanager
+    def span(self, kind, name, **attributes):
+        start, started = time.time(), time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(kind, name, start, time.perf_counter() - started, **attributes)
+            if kind == 'stage':
+                self.sample_memory()
+
+    def start_memory_sampling(self, interval=MEMORY_SAMPLE_INTERVAL):
+        """Marca o RSS de início e amostra o RSS atual numa thread até close()."""
+        rss = current_rss_bytes()
+        if rss is None or self._sampler is not None:
+            return
+        with self._lock:
+            self.memory['rss_start'] = self.memory['rss'] = rss
+        self._sampler = threading.Thread(target=self._sample_rss_loop, args=(interval,),
+                                         name=f'MemSampler-{self.job_id}', daemon=True)
+        self._sampler.start()
+
+    def _sample_rss_loop(self, interval):
+        while not self._sampler_stop.wait(interval):
+            self._record_rss()
+
+    def _record_rss(self):
+        rss = current_rss_bytes()
+        if rss is not None:
+            with self._lock:
+                self.memory['rss'] = max(rss, self.memory['rss'] or 0)
+
+    def sample_memory(self):
+        """Atualiza os picos de memória (RSS do trabalho, picos do processo e dos filhos, tracemalloc se ativo)."""
+        if self._sampler is not None:
+            self._record_rss()
+        with self._lock:
+            self.memory['rss_lifetime'] = process_peak_rss_bytes()
+            self.memory['rss_children_lifetime'] = process_peak_rss_bytes(children=True)
+            if tracemalloc.is_tracing():
+                self.memory['tracemalloc_process'] = tracemalloc.get_traced_memory()[1]
+
+    def summary(self, status):
+        end = time.time()
+        return {
+            'type': 'summary', 'job_id': self.job_id, 'status': status, 'start': self.start, 'end': end,
+            'duration_s': round(end - self.start, 6),
+            'stages': {stage: round(value, 6) for stage, value in self.stages.items()},
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(self.counters.items())],
+            'memory': dict(self.memory),
+        }
+
+    def close(self, status):
+        self.sample_memory()
+        if self._sampler is not None:
+            self._sampler_stop.set()
+            self._sampler.join()
+            self._sampler = None
+        summary = self.summary(status)
+        for sink in self.sinks:
+            try:
+                sink.close(summary)
+            except Exception as e:
+                print(f"Aviso: erro ao finalizar o sink de métricas {type(sink).__name__}: {e}")
+        self.sinks = []
+        return summary
+
+
+# --- Coleta de arquivos de entrada ---
+def collect_image_paths(inputs, recursive=False):
+    """Expande arquivos, diretórios e padrões glob em caminhos de imagem, sem repetições.
+
+    Diretórios e padrões são ordenados por nome; a ordem das entradas é mantida.
+    """
+    paths = []
+    seen = set()
+
+    def add(path):
+        key = path_key(path)
+        if key not in seen and os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+            seen.add(key)
+            paths.append(path)
+
+    def add_directory(directory):
+        if recursive:
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                for name in sorted(files):
+                    add(os.path.join(root, name))
+        else:
+            for name in sorted(os.listdir(directory)):
+                add(os.path.join(directory, name))
+
+    for entry in inputs:
+        matches = [entry] if os.path.exists(entry) else sorted(glob.glob(entry, recursive=True))
+        for path in matches:
+            if os.path.isdir(path):
+                add_directory(path)
+            else:
+                add(path)
+    return paths
+
+
+# --- Estado do modo incremental ---
+def path_key(path):
+    """Chave usada para reconhecer um arquivo já visto entre execuções."""
+    return os.path.normcase(os.path.abspath(path))
+
+def incremental_state_path(output_path):
+    """Sidecar de estado de uma colagem incremental (<saída sem extensão>.estado.json)."""
+    return os.path.splitext(output_path)[0] + INCREMENTAL_STATE_SUFFIX
+
+def load_incremental_state(state_path):
+    """Lê o estado salvo; None se não existir ou estiver ilegível/em outra versão."""
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Aviso: estado incremental '{state_path}' ilegível, a colagem será refeita: {e}")
+        return None
+    if not isinstance(state, dict) or state.get('version') != INCREMENTAL_STATE_VERSION:
+        print(f"Aviso: estado incremental '{state_path}' em versão incompatível, a colagem será refeita.")
+        return None
+    return state
+
+def save_incremental_state(state_path, state):
+    """Grava o estado atomicamente (nunca deixa um sidecar pela metade)."""
+    temporary_path = f'{state_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(temporary_path, state_path)
+
+
+# --- Pipeline da colagem (sem Qt) ---
+def validate_pipeline_options(decode_quality=DECODE_QUALITY, backend=EXECUTION_BACKEND, assembly_mode=ASSEMBLY_MODE,
+                              perceptual_hash=PERCEPTUAL_HASH, frame_policy=FRAME_POLICY, content_hash=CONTENT_HASH,
+                              output_engine=OUTPUT_ENGINE, layout_mode=LAYOUT_MODE, save_preset=None,
+                              output_format=OUTPUT_FORMAT, png_compress_level=PNG_COMPRESS_LEVEL, profile_mode=None,
+                              max_in_flight=MAX_IN_FLIGHT, memory_budget=MEMORY_BUDGET, incremental=False,
+                              **other_options):
+    """Confere as opções de CollagePipeline sem criar um pipeline (ValueError; TypeError para nomes desconhecidos).
+
+    Devolve (output_format, png_compress_level) com o save_preset aplicado. As demais opções
+    do pipeline (other_options) só têm o nome conferido.
+    """
+    unknown = sorted(set(other_options) - set(inspect.signature(CollagePipeline).parameters))
+    if unknown:
+        raise TypeError(f"Opções desconhecidas para CollagePipeline: {', '.join(unknown)}")
+    if decode_quality not in DECODE_QUALITIES:
+        raise ValueError(f"Qualidade de decodificação inválida: {decode_quality!r} (use {DECODE_QUALITIES})")
+    if backend not in EXECUTION_BACKENDS:
+        raise ValueError(f"Backend de execução inválido: {backend!r} (use {EXECUTION_BACKENDS})")
+    if assembly_mode not in ASSEMBLY_MODES:
+        raise ValueError(f"Modo de montagem inválido: {assembly_mode!r} (use {ASSEMBLY_MODES})")
+    if perceptual_hash is not None and perceptual_hash not in PERCEPTUAL_HASHES:
+        raise ValueError(f"Hash perceptual inválido: {perceptual_hash!r} (use {PERCEPTUAL_HASHES})")
+    if frame_policy not in FRAME_POLICIES:
+        raise ValueError(f"Política de quadros inválida: {frame_policy!r} (use {FRAME_POLICIES})")
+    if content_hash not in CONTENT_HASHES:
+        raise ValueError(f"Hash de conteúdo inválido: {content_hash!r} (use {CONTENT_HASHES})")
+    if output_engine not in OUTPUT_ENGINES:
+        raise ValueError(f"Saída inválida: {output_engine!r} (use {OUTPUT_ENGINES})")
+    if layout_mode not in LAYOUT_MODES:
+        raise ValueError(f"Layout inválido: {layout_mode!r} (use {LAYOUT_MODES})")
+    if save_preset is not None:
+        if save_preset not in SAVE_PRESETS:
+            raise ValueError(f"Preset de gravação inválido: {save_preset!r} (use {tuple(SAVE_PRESETS)})")
+        output_format = SAVE_PRESETS[save_preset]['output_format']
+        png_compress_level = SAVE_PRESETS[save_preset]['png_compress_level']
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato de saída inválido: {output_format!r} (use {OUTPUT_FORMATS})")
+    if not 0 <= png_compress_level <= 9:
+        raise ValueError(f"Nível de compressão PNG inválido: {png_compress_level} (use 0-9)")
+    if profile_mode is not None and profile_mode not in PROFILE_MODES:
+        raise ValueError(f"Modo de perfil inválido: {profile_mode!r} (use {PROFILE_MODES})")
+    if max_in_flight is not None and max_in_flight < 1:
+        raise ValueError(f"max_in_flight deve ser >= 1: {max_in_flight}")
+    if memory_budget is not None and memory_budget != 'auto' and memory_budget <= 0:
+        raise ValueError(f"Orçamento de memória inválido: {memory_budget!r} (use bytes > 0 ou 'auto')")
+    if incremental and output_engine in ('png-strips', 'dzi'):
+        raise ValueError(f"O modo incremental atualiza uma tela única; saída {output_engine!r} não é suportada")
+    return output_format, png_compress_level
+
+
+class Signal:
+    """Substituto mínimo de pyqtSignal para o núcleo: connect()/emit() síncronos, na thread de quem emite."""
+
+    def __init__(self):
+        self._slots = []
+
+    def connect(self, slot):
+        self._slots.append(slot)
+
+    def emit(self, *args):
+        for slot in list(self._slots):
+            slot(*args)
+
+
+class CollagePipeline:
+    """Executa as etapas da colagem (dedup, processamento, layout, montagem, gravação).
+
+    Não depende de Qt: o progresso sai pelos sinais progress_update(int, str),
+    collage_finished(str) e error_occurred(str), e run() também devolve o caminho
+    salvo (None se cancelado ou com erro). A GUI embrulha esta classe num QThread.
+    """
+    # Estado global ao processo: o trabalho que está sendo perfilado e quantos rodam agora
+    _profiling_lock = threading.Lock()
+    _profiling_job = None
+    _running_jobs = 0
+
+    def __init__(self, image_paths, save_dir, decode_quality=DECODE_QUALITY,
+                 backend=EXECUTION_BACKEND, num_workers=NUM_WORKERS, assembly_mode=ASSEMBLY_MODE,
+                 cache_dir=CACHE_DIR, pre_decode_dedup=PRE_DECODE_DEDUP,
+                 perceptual_hash=PERCEPTUAL_HASH, perceptual_threshold=PERCEPTUAL_THRESHOLD,
+                 output_engine=OUTPUT_ENGINE, layout_mode=LAYOUT_MODE, layout_row_height=LAYOUT_ROW_HEIGHT,
+                 output_format=OUTPUT_FORMAT, png_compress_level=PNG_COMPRESS_LEVEL,
+                 encode_workers=ENCODE_WORKERS, save_preset=None, output_path=None,
+                 metrics_sinks=(), profile_mode=None, profile_dir=None, incremental=False,
+                 max_in_flight=MAX_IN_FLIGHT, memory_budget=MEMORY_BUDGET, content_hash=CONTENT_HASH,
+                 frame_policy=FRAME_POLICY, executor=None, dedup_index=None):
+        self.progress_update = Signal()
+        self.collage_finished = Signal()
+        self.error_occurred = Signal()
+        output_format, png_compress_level = validate_pipeline_options(
+            decode_quality=decode_quality, backend=backend, assembly_mode=assembly_mode, perceptual_hash=perceptual_hash,
+            frame_policy=frame_policy, content_hash=content_hash, output_engine=output_engine, layout_mode=layout_mode,
+            save_preset=save_preset, output_format=output_format, png_compress_level=png_compress_level,
+            profile_mode=profile_mode, max_in_flight=max_in_flight, memory_budget=memory_budget,
+            incremental=incremental)
+        if perceptual_hash and np is None:
+            print("Aviso: NumPy não encontrado, filtragem perceptual desativada. Instale com 'pip install numpy'")
+            perceptual_hash = None
+        if content_hash == 'xxh3_128' and xxhash is None:
+            print("Aviso: xxhash não encontrado, usando blake2b no hash de conteúdo. Instale com 'pip install xxhash'")
+            content_hash = 'blake2b'
+        self.image_paths = image_paths
+        self.save_dir = save_dir
+        self.output_path = output_path # Caminho exato do arquivo (a extensão segue o formato); None = nome único em save_dir
+        self.decode_quality = decode_quality
+        self.backend = backend
+        self.assembly_mode = assembly_mode
+        self.cache_dir = cache_dir
+        self.cache = None # ThumbnailCache, aberto em run() (thread do worker)
+        self.pre_decode_dedup = pre_decode_dedup
+        # Caminhos que realmente serão decodificados (sem os idênticos descartados na pré-filtragem)
+        self.paths_to_process = list(image_paths)
+        self.pre_dropped_count = 0
+        self.perceptual_hash = perceptual_hash
+        self.perceptual_threshold = perceptual_threshold
+        self.content_hash = content_hash
+        self.frame_policy = frame_policy
+        self.output_engine = output_engine
+        self.layout_mode = layout_mode
+        self.layout_row_height = layout_row_height
+        self.output_format = output_format
+        self.png_compress_level = png_compress_level
+        self.encode_workers = encode_workers # None = automático (png_encode_workers)
+        self.incremental = incremental
+        if incremental:
+            if output_path is None: # A colagem precisa de um nome estável para ser reencontrada
+                self.output_path = os.path.join(save_dir, INCREMENTAL_OUTPUT_NAME + OUTPUT_EXTENSIONS[output_format])
+            if output_format in ('jpeg', 'webp'):
+                print(f"Aviso: no modo incremental a colagem {output_format} é recomprimida (com perdas) a cada atualização.")
+        # Modo incremental: estado da execução anterior (None = primeira execução ou estado inutilizável),
+        # quantas células vêm dela (as primeiras de image_infos_for_collage) e o estado a gravar no fim
+        self._previous_state = None
+        self._previous_output = None
+        self._previous_infos: list[ProcessedImageInfo] = []
+        self._previous_count = 0
+        self._next_state = None
+        self._dedup_ctimes = ({}, {}) # (hash -> ctime, nome -> ctime) do mais antigo visto, para o estado
+        self._probes: dict[str, ImageProbe] = {} # Cabeçalhos lidos na sondagem (caminho -> ImageProbe)
+        # Lista para armazenar as informações completas de cada imagem processada
+        self.processed_image_info_list: list[ProcessedImageInfo] = []
+        # Lista final (já filtrada) das imagens a serem usadas na colagem, na ordem da grade
+        self.image_infos_for_collage: list[ProcessedImageInfo] = []
+        self.is_cancelled = False
+        self._cancel_event = None # multiprocessing.Event dos processos filhos (criado com o pool)
+        self._last_progress_time = 0.0 # Último progress_update das etapas com muitos itens (monotonic)
+        self.job_id = self.generateUniqueName()
+        self.final_path = None
+        self.metrics = MetricsRecorder(self.job_id, metrics_sinks)
+        # Tempo de parede por etapa (s): probe, pre_dedup, plan, process, dedup, layout, paste, encode, total
+        self.stage_times = self.metrics.stages
+        self.profile_mode = profile_mode
+        self.profile_dir = profile_dir
+        self._profiler = None
+        if num_workers is None:
+            num_workers = (os.cpu_count() or 1) * (2 if backend == 'thread' else 1)
+        self._requested_workers = num_workers
+        self.num_workers = max(1, min(len(image_paths), num_workers))
+        self.max_in_flight = max_in_flight # None = 2x num_workers (resolvido na Etapa 1)
+        self.memory_budget = memory_budget # None, bytes ou 'auto'
+        # Executor reaproveitado entre as passadas; criado sob demanda em _get_executor()
+        self._executor = None
+        self._process_pool_failed = False
+        # Modo vigia: executor de decodificação de vida longa (não é encerrado no fim do trabalho)
+        # e DedupIndex com o que os lotes anteriores já colocaram em colagens
+        self.shared_executor = executor
+        self.dedup_index = dedup_index
+
+    def run(self):
+        start_time = time.time()
+        self.metrics.start_memory_sampling()
+        self._start_profiling()
+        self.metrics.increment('images_input', len(self.image_paths))
+        try:
+            self._open_cache()
+
+            if self.incremental:
+                self._load_previous_state()
+                if self._previous_state is not None and not self.image_paths:
+                    return self._finish(start_time, self._previous_output, "Nenhuma imagem nova; colagem inalterada")
+
+            # --- Etapa 0: Sondar cabeçalhos (arquivos ilegíveis saem aqui) ---
+            if not self._timed('probe', self._probe_headers) or self.is_cancelled: return
+
+            # --- Etapa 0b: Descartar arquivos idênticos sem decodificar ---
+            if self.pre_decode_dedup:
+                self._timed('pre_dedup', self._drop_identical_files)
+                if self.is_cancelled: return
+
+            # --- Etapa 0c: Planejar com o que sobrou e rejeitar planos impossíveis antes de decodificar ---
+            if not self._timed('plan', self._plan_from_probes): return
+
+            # --- Etapa 1: Carregamento, Hash, Redimensionamento Paralelo ---
+            # No modo streaming esta passada só coleta metadados; os pixels vêm na Etapa 4
+            self._timed('process', self._process_images_parallel, with_pixels=self.assembly_mode == 'memory')
+            if self.is_cancelled or not self.processed_image_info_list: return
+
+            # --- Etapa 2: Filtragem de Duplicatas ---
+            initial_count = len(self.processed_image_info_list)
+            self.progress_update.emit(55, f"Filtrando duplicatas de {initial_count} imagens...")
+            self._timed('dedup', self._filter_duplicates)
+            final_count = len(self.image_infos_for_collage) - self._previous_count # Só as novas
+            removed_count = initial_count - final_count + self.pre_dropped_count
+            filter_msg = f"Filtragem concluída. {final_count} imagens únicas."
+            if self._previous_count:
+                filter_msg = f"Filtragem concluída. {final_count} imagens novas ({self._previous_count} já na colagem)."
+            if removed_count > 0:
+                filter_msg += f" ({removed_count} duplicatas removidas)."
+            print(filter_msg) # Log no console
+            self.progress_update.emit(60, filter_msg) # Atualiza GUI
+
+            if self._previous_count and not final_count and not self.is_cancelled:
+                # Só duplicatas do que já está na colagem: atualiza os índices e mantém a tela
+                self._next_state = self._build_incremental_state(self._previous_layout())
+                return self._finish(start_time, self._previous_output, "Nenhuma imagem nova; colagem inalterada")
+
+            if self.is_cancelled or not self.image_infos_for_collage:
+                 if not self.is_cancelled: # Só emite erro se não foi cancelado
+                    self.error_occurred.emit("Nenhuma imagem restante após filtrar duplicatas.")
+                 return
+
+            # --- Etapa 3: Calcular Layout e Dimensões (usa imagens filtradas) ---
+            self.progress_update.emit(65, f"Calculando layout ({self.layout_mode})...")
+            layout = self._timed('layout', self._calculate_layout)
+            if self.is_cancelled: return
+            layout_msg = (f"Layout {layout.mode}: {layout.width}x{layout.height} px, "
+                          f"preenchimento {layout.fill_ratio:.0%}")
+            print(layout_msg)
+            if self.incremental:
+                self._next_state = self._build_incremental_state(layout)
+
+            output_engine = self._resolve_output_engine(layout)
+            if output_engine == 'single':
+                # --- Etapa 4: Criar Imagem da Colagem (usa imagens filtradas) ---
+                self.progress_update.emit(70, f"Criando tela da colagem ({layout_msg})...")
+                collage_image = self._timed('paste', self._create_collage_image, layout)
+                if self.is_cancelled or collage_image is None: return
+
+                # Libera memória das infos e imagens processadas
+                del self.processed_image_info_list
+                self.processed_image_info_list = []
+                del self.image_infos_for_collage
+                self.image_infos_for_collage = []
+
+                # --- Etapa 5: Salvar Imagem Final ---
+                self.progress_update.emit(95, f"Salvando colagem no disco ({self.output_format})...")
+                final_path = self._timed('encode', self._save_collage_image, collage_image)
+            else:
+                # --- Etapas 4 e 5 juntas: montar e gravar faixa por faixa ---
+                self.progress_update.emit(70, f"Montando colagem em faixas ({layout_msg}, saída {output_engine})...")
+                final_path = self._write_tiled_output(output_engine, layout)
+            if self.is_cancelled or final_path is None: return
+
+            # --- Conclusão ---
+            self.metrics.increment('output_bytes', self._output_size(final_path))
+            return self._finish(start_time, final_path)
+
+        except Exception as e:
+            print("Erro detalhado no worker:")
+            traceback.print_exc()
+            self.metrics.increment('errors', type=type(e).__name__, stage='pipeline')
+            self.error_occurred.emit(f"Erro inesperado: {e}")
+        finally:
+            # Garante limpeza final
+            self._shutdown_executor()
+            self._close_cache()
+            self.processed_image_info_list = []
+            self.image_infos_for_collage = []
+            self._stop_profiling()
+            self.metrics.close('ok' if self.final_path else 'cancelled' if self.is_cancelled else 'error')
+
+    def _finish(self, start_time, final_path, message="Colagem salva!"):
+        """Conclui o trabalho: grava o estado incremental (se houver) e emite collage_finished."""
+        duration = time.time() - start_time
+        self.stage_times['total'] = duration
+        if self._next_state is not None:
+            self._write_incremental_state(final_path)
+        self.final_path = final_path
+        self.progress_update.emit(100, f"{message} ({duration:.2f}s)")
+        self.collage_finished.emit(final_path)
+        return final_path
+
+    def _resolve_output_engine(self, layout):
+        """Saída efetiva para o layout ('auto' vira 'single' ou 'png-strips').
+
+        'auto' só fica com a tela única se ela couber no limite de dimensões e na memória
+        disponível agora (RGB, 3 bytes por pixel).
+        """
+        if self.incremental:
+            return 'single' # A tela anterior é atualizada e regravada inteira
+        if self.output_engine == 'auto':
+            if max(layout.width, layout.height) > MAX_CANVAS_DIMENSION:
+                return 'png-strips'
+            available = available_memory_bytes()
+            return 'single' if available is None or layout.width * layout.height * 3 <= available else 'png-strips'
+        return self.output_engine
+
+    @staticmethod
+    def _output_size(path):
+        """Bytes gravados (o .dzi soma a pasta de tiles)."""
+        if not path.endswith('.dzi'):
+            return os.path.getsize(path)
+        files_dir = os.path.splitext(path)[0] + '_files'
+        return os.path.getsize(path) + sum(os.path.getsize(os.path.join(root, name))
+                                           for root, _, names in os.walk(files_dir) for name in names)
+
+    # --- Instrumentação ---
+
+    def _start_profiling(self):
+        """Liga o perfil pedido se nenhum outro trabalho do processo estiver sendo perfilado."""
+        self._profiler = None
+        self._started_tracemalloc = False
+        self._profiling = False
+        with CollagePipeline._profiling_lock:
+            CollagePipeline._running_jobs += 1
+            if self.profile_mode is None:
+                return
+            if CollagePipeline._profiling_job is not None:
+                print(f"Aviso: perfil desativado em {self.job_id}: {CollagePipeline._profiling_job} já está "
+                      f"sendo perfilado (profiler e tracemalloc são globais ao processo).")
+                return
+            CollagePipeline._profiling_job = self.job_id
+            others = CollagePipeline._running_jobs - 1
+        self._profiling = True
+        if others:
+            print(f"Aviso: {others} outros trabalhos rodando; o tracemalloc de {self.job_id} inclui as alocações deles.")
+        if self.profile_mode in ('tracemalloc', 'both'):
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._started_tracemalloc = True
+        if self.profile_mode in ('cprofile', 'both'):
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def _stop_profiling(self):
+        """Grava perfil_<job>.prof/.txt (cProfile) e perfil_<job>_tracemalloc.txt no diretório de perfil."""
+        with CollagePipeline._profiling_lock:
+            CollagePipeline._running_jobs -= 1
+        if not self._profiling:
+            return
+        if self._profiler is not None:
+            self._profiler.disable()
+        try:
+            directory = self.profile_dir or self.save_dir
+            os.makedirs(directory, exist_ok=True)
+            base = os.path.join(directory, f'perfil_{self.job_id}')
+            if self._profiler is not None:
+                self._profiler.dump_stats(base + '.prof')
+                with open(base + '.txt', 'w', encoding='utf-8') as f:
+                    pstats.Stats(self._profiler, stream=f).sort_stats('cumulative').print_stats(PROFILE_TOP_ENTRIES)
+                print(f"Perfil cProfile gravado em {base}.prof")
+            if self.profile_mode in ('tracemalloc', 'both') and tracemalloc.is_tracing():
+                self.metrics.sample_memory()
+                snapshot = tracemalloc.take_snapshot()
+                with open(base + '_tracemalloc.txt', 'w', encoding='utf-8') as f:
+                    f.write(f"Pico rastreado (processo inteiro): "
+                            f"{self.metrics.memory['tracemalloc_process'] / 1024**2:.1f} MB\n\n")
+                    for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ENTRIES]:
+                        f.write(f"{stat}\n")
+                print(f"Alocações (tracemalloc) gravadas em {base}_tracemalloc.txt")
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar o perfil: {e}")
+        finally:
+            self._profiler = None
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            self._profiling = False
+            with CollagePipeline._profiling_lock:
+                CollagePipeline._profiling_job = None
+
+    def _record_image_metrics(self, image_info, pass_number=1):
+        """Contadores e span por imagem a partir das medições feitas na decodificação."""
+        metrics = image_info.metrics
+        if metrics is None: # Veio do cache
+            self.metrics.increment('cache_hits')
+            return
+        self.metrics.increment('images_decoded')
+        self.metrics.increment('bytes_read', metrics['bytes_read'])
+        self.metrics.increment('pixels_decoded', metrics['pixels_decoded'])
+        if self.metrics.enabled:
+            duration = metrics['decode_s'] + metrics['hash_s'] + metrics['resize_s'] + metrics['perceptual_s']
+            self.metrics.record_span('image', 'process_image', time.time() - duration, duration,
+                                     path=image_info.original_path, **{'pass': pass_number},
+                                     **{key: round(value, 6) for key, value in metrics.items() if key.endswith('_s')})
+
+    def _timed(self, stage, function, *args, **kwargs):
+        """Executa uma etapa como span, acumulando o tempo de parede em self.stage_times[stage]."""
+        with self.metrics.span('stage', stage):
+            return function(*args, **kwargs)
+
+    # --- Modo incremental ---
+
+    def _incremental_settings(self):
+        """Opções que precisam coincidir para reaproveitar a colagem anterior."""
+        settings = {'resize_factor': RESIZE_FACTOR, 'decode_quality': self.decode_quality,
+                    'layout_mode': self.layout_mode, 'layout_row_height': self.layout_row_height,
+                    'perceptual_hash': self.perceptual_hash, 'perceptual_threshold': self.perceptual_threshold}
+        if self.content_hash != 'sha256': # Estados gravados antes do hash configurável continuam válidos
+            settings['content_hash'] = self.content_hash
+        if self.frame_policy != 'first':
+            settings['frame_policy'] = self.frame_policy
+        return settings
+
+    def _load_previous_state(self):
+        """Carrega o estado salvo e reduz image_paths aos arquivos ainda não vistos.
+
+        As células anteriores viram as primeiras entradas de image_infos_for_collage (sem pixels).
+        Se o estado não bater com as opções atuais ou a colagem tiver sumido, tudo o que já foi
+        visto é reprocessado junto com os arquivos novos.
+        """
+        state = load_incremental_state(incremental_state_path(self.output_path))
+        if state is None:
+            return
+        seen = {path_key(path) for path in state['seen']}
+        new_paths = [path for path in self.image_paths if path_key(path) not in seen]
+        output_file = os.path.join(os.path.dirname(self.output_path), state['output_file'])
+        if state['settings'] != self._incremental_settings() or not os.path.isfile(output_file):
+            print("Aviso: colagem incremental anterior ausente ou com outras opções; refazendo com todas as imagens.")
+            self.image_paths = list(state['seen']) + new_paths
+        else:
+            skipped = len(self.image_paths) - len(new_paths)
+            if skipped:
+                self.metrics.increment('images_skipped', skipped, reason='already_seen')
+                print(f"Modo incremental: {skipped} imagens já vistas ignoradas, {len(new_paths)} novas.")
+            self.image_paths = new_paths
+            self._previous_state = state
+            self._previous_output = output_file
+            self._previous_infos = [
+                ProcessedImageInfo(cell['path'], cell['creation_time'], cell['content_hash'], tuple(cell['size']),
+                                   perceptual_hash=cell['perceptual_hash'])
+                for cell in state['cells']]
+            self._previous_count = len(self._previous_infos)
+        self.paths_to_process = list(self.image_paths)
+        self.num_workers = max(1, min(len(self.image_paths), self._requested_workers))
+
+    def _previous_layout(self):
+        """Layout salvo da colagem anterior."""
+        state = self._previous_state
+        grid = tuple(state['grid']) if state['grid'] else None
+        placements = [tuple(cell['placement']) for cell in state['cells']]
+        return CollageLayout(self.layout_mode, state['width'], state['height'], placements, [], grid, state['resume'])
+
+    def _build_incremental_state(self, layout):
+        """Estado a gravar depois da colagem: layout, células na ordem do layout e índices de dedup."""
+        seen = list(self._previous_state['seen']) if self._previous_state else []
+        processing = set(self.paths_to_process)
+        # Idênticos descartados na pré-filtragem também contam como vistos; falhas serão tentadas de novo
+        seen += [os.path.abspath(path) for path in self.image_paths if path not in processing]
+        seen += [os.path.abspath(info.original_path) for info in self.processed_image_info_list]
+        # Quadros e folhas de contato contam como o arquivo real (expandido de novo se for refeito)
+        seen = list(dict.fromkeys(split_frame_path(path)[0] for path in seen))
+        by_hash, by_filename = self._dedup_ctimes
+        cells = [{'path': os.path.abspath(info.original_path), 'creation_time': info.creation_time,
+                  'content_hash': info.content_hash, 'size': list(info.resized_size),
+                  'perceptual_hash': info.perceptual_hash, 'placement': list(placement)}
+                 for info, placement in zip(self.image_infos_for_collage, layout.placements)]
+        return {'version': INCREMENTAL_STATE_VERSION, 'settings': self._incremental_settings(),
+                'output_file': None, 'width': layout.width, 'height': layout.height,
+                'grid': list(layout.grid) if layout.grid else None, 'resume': layout.resume,
+                'cells': cells, 'by_hash': by_hash, 'by_filename': by_filename, 'seen': seen}
+
+    def _write_incremental_state(self, final_path):
+        state = self._next_state
+        state['output_file'] = os.path.basename(final_path)
+        try:
+            save_incremental_state(incremental_state_path(self.output_path), state)
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar o estado incremental: {e}")
+
+    # --- Cache persistente ---
+
+    def _open_cache(self):
+        if not self.cache_dir:
+            return
+        try:
+            self.cache = ThumbnailCache(self.cache_dir)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Aviso: cache em '{self.cache_dir}' indisponível, continuando sem cache: {e}")
+            self.cache = None
+
+    def _close_cache(self):
+        if self.cache is None:
+            return
+        stats = self.cache.stats()
+        print(f"Cache: {stats['hits']} acertos, {stats['misses']} faltas, {stats['stores']} gravações, "
+              f"{stats['evictions']} remoções ({stats['bytes'] / 1024**2:.1f} MB em disco).")
+        try:
+            self.cache.close()
+        except sqlite3.Error as e:
+            print(f"Aviso: erro ao fechar o cache: {e}")
+        self.cache = None
+
+    def _cache_get(self, path, with_pixels=True, with_hash=True):
+        if self.cache is None:
+            return None
+        perceptual = self.perceptual_hash if with_hash else None
+        try:
+            cached_info = self.cache.get(path, RESIZE_FACTOR, self.decode_quality, with_pixels, perceptual,
+                                         self.content_hash)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Aviso: erro ao ler o cache para '{os.path.basename(path)}': {e}")
+            return None
+        if (cached_info is not None and perceptual and cached_info.perceptual_hash is None
+                and cached_info.resized_image is not None):
+            # Entrada gravada sem o hash perceptual: recalcula a partir da miniatura e completa o cache
+            cached_info.perceptual_hash = compute_perceptual_hash(cached_info.resized_image, perceptual)
+            self._cache_put(cached_info)
+        return cached_info
+
+    def _cache_put(self, image_info):
+        if self.cache is None or image_info is None:
+            return
+        try:
+            self.cache.put(image_info, RESIZE_FACTOR, self.decode_quality, self.perceptual_hash, self.content_hash)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Aviso: erro ao gravar no cache '{os.path.basename(image_info.original_path)}': {e}")
+
+    # --- Executor (threads ou processos) ---
+
+    def _get_executor(self):
+        """Executor da etapa de decodificação, criado sob demanda e reaproveitado entre as passadas."""
+        if self._executor is None:
+            if self.shared_executor is not None and not self._process_pool_failed:
+                self._executor = self.shared_executor
+                return self._executor
+            if self.backend == 'process' and not self._process_pool_failed:
+                try:
+                    if self._cancel_event is None:
+                        self._cancel_event = multiprocessing.Event()
+                        if self.is_cancelled: self._cancel_event.set()
+                    self._executor = new_process_pool(self.num_workers, self._cancel_event)
+                    return self._executor
+                except (OSError, NotImplementedError, ValueError) as e:
+                    print(f"Aviso: não foi possível iniciar o pool de processos: {e}")
+                    self._process_pool_failed = True
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='ImgProc')
+        return self._executor
+
+    def _fallback_to_threads(self):
+        """Descarta um pool de processos quebrado; as próximas tarefas vão para threads."""
+        print("Aviso: pool de processos indisponível, continuando com threads.")
+        self._process_pool_failed = True
+        self._shutdown_executor()
+
+    def _shutdown_executor(self):
+        if self._executor is not None:
+            if self._executor is not self.shared_executor: # O compartilhado é encerrado por quem o criou
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _submit_image_task(self, path, with_pixels=True, with_hash=True, target_size=None):
+        """Submete UMA imagem ao executor atual; devolve (future, tarefa).
+
+        Com processos, os pixels voltam por um buffer compartilhado alocado aqui com o
+        tamanho da sondagem (ou target_size); a tarefa guarda (caminho, SharedMemory, tamanho, modo).
+        """
+        executor = self._get_executor()
+        if not isinstance(executor, ProcessPoolExecutor):
+            future = executor.submit(self.process_single_image, path, with_pixels, with_hash,
+                                     report_errors=True, target_size=target_size)
+            return future, (path, None, None, None)
+
+        shm, size, mode = None, None, None
+        if with_pixels:
+            probe = self._probes.get(path)
+            shm, size, mode = allocate_shared_buffer(path, RESIZE_FACTOR,
+                                                     target_size or (probe.target_size if probe else None))
+        try:
+            future = executor.submit(process_image_to_shared_memory, path, RESIZE_FACTOR, self.decode_quality,
+                                     shm.name if shm else None, size, mode, with_pixels, with_hash,
+                                     self.perceptual_hash, True, target_size, self.content_hash)
+        except BaseException:
+            if shm: release_shared_buffer(shm)
+            raise
+        return future, (path, shm, size, mode)
+
+    def _collect_image_task(self, future, task):
+        """Resultado de uma tarefa (ProcessedImageInfo ou None); lê e libera o buffer compartilhado."""
+        path, shm, size, mode = task
+        try:
+            image_info = future.result()
+            if isinstance(image_info, ImageFailure):
+                self.metrics.increment('errors', type=image_info.error_type, stage='process')
+                return None
+            if image_info is not None and shm is not None and image_info.resized_image is None:
+                image_info.resized_image = read_shared_buffer(shm, size, mode)
+            return image_info
+        finally:
+            if shm: release_shared_buffer(shm)
+
+    # --- Etapa 0 ---
+
+    def _probe_headers(self):
+        """Lê os cabeçalhos de todas as imagens em paralelo, sem decodificar.
+
+        Arquivos ilegíveis saem já aqui e a política de quadros é aplicada. Devolve False se
+        nada for legível ou se o trabalho for cancelado durante a sondagem.
+        """
+        self.progress_update.emit(0, f"Lendo cabeçalhos de {len(self.image_paths)} imagens...")
+        try:
+            readable = self._probe_paths(self.image_paths, with_frames=self.frame_policy != 'first')
+            if len(readable) < len(self.image_paths):
+                print(f"Aviso: {len(self.image_paths) - len(readable)} arquivos ignorados (cabeçalho ilegível).")
+            if self.frame_policy != 'first':
+                readable = self._expand_frames(readable)
+        except OperationCancelled:
+            return False
+        if readable != self.image_paths:
+            self.image_paths = readable
+            self.paths_to_process = list(readable)
+        if not readable:
+            self.error_occurred.emit("Nenhuma imagem legível entre os arquivos recebidos.")
+            return False
+        return True
+
+    def _plan_from_probes(self):
+        """Planeja a colagem com as sondagens do que sobrou da pré-filtragem (ver _check_plan).
+
+        A filtragem por hash de pixels ainda pode tirar imagens, então na grade o plano é um
+        limite superior.
+        """
+        sizes = ([info.resized_size for info in self._previous_infos]
+                 + [self._probes[path].target_size for path in self.paths_to_process])
+        return self._check_plan(sizes)
+
+    def _probe_paths(self, paths, with_frames=False):
+        """Sonda os cabeçalhos e guarda as sondagens; devolve só os caminhos legíveis, em ordem."""
+        readable = []
+        for probe in probe_images(paths, RESIZE_FACTOR, self.decode_quality, self.num_workers, with_frames,
+                                  self._cancel_requested):
+            if isinstance(probe, ImageProbe):
+                self._probes[probe.original_path] = probe
+                readable.append(probe.original_path)
+            else:
+                print(f"Erro ao ler o cabeçalho de '{os.path.basename(probe.original_path)}': {probe.message}")
+                self.metrics.increment('errors', type=probe.error_type, stage='probe')
+        return readable
+
+    def _expand_frames(self, paths):
+        """Aplica a política de quadros: arquivos com vários quadros viram quadros ou uma folha."""
+        multi_frame = [path for path in paths if self._probes[path].frames > 1]
+        if not multi_frame:
+            return paths
+        if self.frame_policy == 'all':
+            extra = {path: [frame_path(path, index) for index in range(1, self._probes[path].frames)]
+                     for path in multi_frame}
+        else:
+            extra = {path: [frame_path(path, FRAME_SHEET)] for path in multi_frame}
+        readable = set(self._probe_paths([virtual for virtuals in extra.values() for virtual in virtuals]))
+        expanded = []
+        for path in paths:
+            if path in extra and self.frame_policy == 'sheet' and extra[path][0] in readable:
+                expanded.append(extra[path][0]) # A folha substitui o primeiro quadro
+                continue
+            expanded.append(path)
+            expanded += [virtual for virtual in extra.get(path, ()) if virtual in readable]
+        self.metrics.increment('multi_frame_files', len(multi_frame), policy=self.frame_policy)
+        print(f"Quadros ({self.frame_policy}): {len(multi_frame)} arquivos com vários quadros, "
+              f"{len(expanded)} imagens no total.")
+        return expanded
+
+    def _check_plan(self, sizes):
+        """Layout planejado, tamanho da tela e memória estimada; False (com erro emitido) se impossível.
+
+        Só a tela única pedida explicitamente (ou exigida pelo modo incremental) pode ser
+        rejeitada: 'auto' já troca para 'png-strips' quando ela não cabe. Fora da grade só há aviso.
+        """
+        layout = self._layout_for_sizes(sizes)
+        output_engine = self._resolve_output_engine(layout)
+        canvas_bytes = layout.width * layout.height * 3 if output_engine == 'single' else 0
+        thumbnails_bytes = sum(w * h * 3 for w, h in sizes) if self.assembly_mode == 'memory' else 0
+        print(f"Plano: {len(sizes)} imagens, layout {layout.mode} {layout.width}x{layout.height} px "
+              f"(saída {output_engine}), ~{(canvas_bytes + thumbnails_bytes) / 1024**2:.0f} MB de tela e miniaturas")
+
+        available = available_memory_bytes()
+        problem = None
+        if output_engine == 'single' and max(layout.width, layout.height) > MAX_CANVAS_DIMENSION:
+            problem = (f"Dimensões planejadas da colagem ({layout.width}x{layout.height}) excedem o limite de "
+                       f"{MAX_CANVAS_DIMENSION} px (use a saída 'png-strips' ou 'dzi').")
+        elif available is not None and canvas_bytes > available:
+            problem = (f"A tela planejada ({canvas_bytes / 1024**2:.0f} MB) não cabe na memória disponível "
+                       f"({available / 1024**2:.0f} MB); use a saída 'png-strips' ou 'dzi'.")
+        elif available is not None and canvas_bytes + thumbnails_bytes > available:
+            print("Aviso: tela e miniaturas planejadas passam da memória disponível; considere o modo 'streaming'.")
+        if problem is None:
+            return True
+        if self.layout_mode != 'grid':
+            print(f"Aviso: {problem} A filtragem de duplicatas ainda pode reduzir o layout.")
+            return True
+        self.metrics.increment('jobs_rejected', reason='plan')
+        self.error_occurred.emit(f"{problem} Trabalho rejeitado antes de decodificar.")
+        return False
+
+    def _drop_identical_files(self):
+        """Remove de paths_to_process arquivos byte a byte idênticos a um mais antigo.
+
+        Mesma regra de _filter_duplicates: um arquivo só sai se não for o mais
+        antigo do seu conteúdo NEM o mais antigo com o seu nome.
+        """
+        self.progress_update.emit(0, f"Procurando arquivos idênticos entre {len(self.image_paths)} imagens...")
+        groups = find_identical_files(self.image_paths, self.num_workers)
+        if not groups:
+            return
+
+        ctimes = {}
+        best_by_filename: dict[str, tuple[float, int]] = {} # basename -> (ctime, index)
+        for index, path in enumerate(self.image_paths):
+            try:
+                ctimes[index] = os.path.getctime(path)
+            except OSError:
+                continue
+            basename = os.path.basename(path)
+            if basename not in best_by_filename or ctimes[index] < best_by_filename[basename][0]:
+                best_by_filename[basename] = (ctimes[index], index)
+
+        indices_to_drop = set()
+        for group in groups:
+            group = [index for index in group if index in ctimes]
+            if len(group) < 2:
+                continue
+            oldest = min(group, key=lambda index: (ctimes[index], index))
+            for index in group:
+                basename = os.path.basename(self.image_paths[index])
+                if index != oldest and best_by_filename[basename][1] != index:
+                    indices_to_drop.add(index)
+
+        if indices_to_drop:
+            self.paths_to_process = [path for index, path in enumerate(self.image_paths) if index not in indices_to_drop]
+            self.pre_dropped_count = len(indices_to_drop)
+            self.metrics.increment('duplicates_dropped', self.pre_dropped_count, kind='pre_decode')
+            print(f"Pré-filtragem: {self.pre_dropped_count} arquivos idênticos descartados sem decodificar.")
+
+    # --- Etapa 1 ---
+
+    def _process_images_parallel(self, with_pixels=True):
+        """Carrega, obtém hash/ctime, redimensiona em paralelo (threads ou processos)."""
+        num_images = len(self.paths_to_process)
+        self.progress_update.emit(0, f"Iniciando processamento de {num_images} imagens...")
+        self._processed_count = 0
+        self._process_errors = 0
+        self._window_size = self.max_in_flight or 2 * self.num_workers
+        self._budget_bytes = self._resolve_memory_budget()
+
+        pending_paths = list(self.paths_to_process)
+        while pending_paths and not self.is_cancelled:
+            # Só sobram caminhos se o pool de processos quebrar; a nova rodada usa threads
+            pending_paths = self._run_image_tasks(pending_paths, with_pixels)
+        if self.is_cancelled:
+            return # Não emitir erro aqui, run() tratará
+        # Os resultados chegam na ordem em que ficam prontos; a colagem segue a ordem de entrada
+        order = {path: index for index, path in enumerate(self.paths_to_process)}
+        self.processed_image_info_list.sort(key=lambda info: order[info.original_path])
+
+        process_errors = self._process_errors
+        # Não emite erro aqui se algumas imagens falharam, a menos que NENHUMA tenha sido processada
+        if not self.processed_image_info_list and process_errors > 0:
+            self.error_occurred.emit(f"Nenhuma imagem pôde ser processada ({process_errors} erros).")
+        elif process_errors > 0:
+             print(f"Aviso: Falha ao processar {process_errors} de {num_images} imagens.")
+
+    def _resolve_memory_budget(self):
+        """Orçamento da janela de submissão em bytes (None = sem limite de memória)."""
+        if self.memory_budget != 'auto':
+            return self.memory_budget
+        available = available_memory_bytes()
+        if available is None:
+            print("Aviso: memória disponível desconhecida; orçamento 'auto' desativado.")
+            return None
+        budget = int(available * MEMORY_BUDGET_FRACTION)
+        print(f"Orçamento de memória da decodificação: {budget / 1024**2:.0f} MB")
+        return budget
+
+    def _run_image_tasks(self, paths, with_pixels):
+        """Processa um lote de caminhos; devolve os que precisam ser refeitos (pool de processos quebrado).
+
+        As imagens entram no executor por uma janela: no máximo _window_size em voo e, com
+        orçamento de memória, a soma das estimativas (estimate_decode_bytes) dentro dele.
+        """
+        queue = deque(paths)
+        future_to_task = {} # future -> (tarefa, bytes estimados)
+        retry_paths = []
+        budget_used = 0
+        estimate = None # Estimativa do próximo caminho da fila (lida uma vez só)
+        try:
+            while queue or future_to_task:
+                while queue and not self.is_cancelled:
+                    path = queue[0]
+                    if estimate is None:
+                        cached_info = self._cache_get(path, with_pixels)
+                        if cached_info is not None:
+                            queue.popleft()
+                            self._record_result(cached_info) # Arquivo inalterado: sem decodificar
+                            continue
+                        estimate = 0
+                        if self._budget_bytes: # Cabeçalho ilegível conta como 0; o worker reporta o erro
+                            probe = self._probes.get(path)
+                            estimate = (probe.estimated_bytes if probe else
+                                        estimate_decode_bytes(path, RESIZE_FACTOR, self.decode_quality) or 0)
+                    if len(future_to_task) >= self._window_size:
+                        break
+                    if self._budget_bytes and future_to_task and budget_used + estimate > self._budget_bytes:
+                        self.metrics.increment('memory_throttled') # Espera uma imagem terminar
+                        break
+                    try:
+                        future, task = self._submit_image_task(path, with_pixels)
+                    except BrokenProcessPool:
+                        retry_paths.extend(queue)
+                        queue.clear()
+                        break
+                    queue.popleft()
+                    future_to_task[future] = (task, estimate)
+                    budget_used += estimate
+                    estimate = None
+
+                if self.is_cancelled:
+                    for f in future_to_task: f.cancel()
+                    return []
+                if not future_to_task:
+                    continue
+
+                done, _ = wait(future_to_task, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if self.is_cancelled: # Resultados interrompidos; o finally libera os buffers
+                        break
+                    task, task_estimate = future_to_task.pop(future)
+                    budget_used -= task_estimate
+                    try:
+                        # Espera o resultado (ProcessedImageInfo ou None)
+                        image_info = self._collect_image_task(future, task)
+                    except BrokenProcessPool:
+                        retry_paths.append(task[0])
+                        continue
+                    except Exception as exc:
+                        print(f"Erro ao obter resultado para {os.path.basename(task[0])}: {exc}")
+                        self.metrics.increment('errors', type=type(exc).__name__, stage='process')
+                        image_info = None
+                    self._cache_put(image_info)
+                    self._record_result(image_info)
+        finally:
+            # Garante que nenhum buffer fique órfão (cancelamento ou pool quebrado)
+            for (_, shm, _, _), _ in future_to_task.values():
+                if shm: release_shared_buffer(shm)
+        if retry_paths:
+            self._fallback_to_threads()
+        return retry_paths
+
+    def _record_result(self, image_info):
+        if isinstance(image_info, ProcessedImageInfo):
+            self.processed_image_info_list.append(image_info)
+            self._record_image_metrics(image_info)
+        else: # Erro ocorreu dentro de process_single_image
+            self._process_errors += 1
+        self._processed_count += 1
+        processed_count = self._processed_count
+        num_images = len(self.paths_to_process)
+        # Processamento agora vai até ~55%
+        progress = int((processed_count / num_images) * 55)
+        if self._progress_due(final=processed_count == num_images):
+            msg = f"Processando: {processed_count}/{num_images}"
+            if self._process_errors > 0:
+                msg += f" ({self._process_errors} erros)"
+            self.progress_update.emit(progress, msg)
+
+    def process_single_image(self, image_path, with_pixels=True, with_hash=True,
+                             report_errors=False, target_size=None) -> ProcessedImageInfo | ImageFailure | None:
+        """Carrega, obtém hash/ctime, converte modo e redimensiona UMA imagem."""
+        return load_and_resize_image(image_path, RESIZE_FACTOR, self.decode_quality, with_pixels, with_hash,
+                                     self.perceptual_hash, report_errors, target_size, self.content_hash,
+                                     self._cancel_requested)
+
+    # --- Etapas 2 e 3 ---
+
+    def _filter_duplicates(self):
+        """Filtra a lista processed_image_info_list, mantendo os mais antigos.
+
+        Com dedup_index (modo vigia) o que lotes anteriores já usaram também conta e as imagens
+        mantidas entram no índice; lotes simultâneos filtram um de cada vez.
+        """
+        if self.dedup_index is None:
+            self._drop_duplicates()
+            return
+        with self.dedup_index.lock:
+            self._drop_duplicates()
+            self.dedup_index.add(self.image_infos_for_collage, *self._dedup_ctimes)
+
+    def _drop_duplicates(self):
+        """Duplicatas exatas (mesmo hash ou nome; fica a mais antiga) e, se configurado, perceptuais."""
+        if not self.processed_image_info_list:
+            self.image_infos_for_collage = []
+            return
+
+        # hash/basename -> (ctime, index); index None = imagem de uma execução anterior (modo incremental)
+        best_by_hash: dict[str, tuple[float, int | None]] = {}
+        best_by_filename: dict[str, tuple[float, int | None]] = {}
+        if self._previous_state is not None:
+            best_by_hash = {key: (ctime, None) for key, ctime in self._previous_state['by_hash'].items()}
+            best_by_filename = {key: (ctime, None) for key, ctime in self._previous_state['by_filename'].items()}
+        if self.dedup_index is not None: # Só as chaves deste lote: o índice cresce a cada lote
+            for info in self.processed_image_info_list:
+                basename = os.path.basename(info.original_path)
+                if info.content_hash in self.dedup_index.by_hash:
+                    best_by_hash.setdefault(info.content_hash, (self.dedup_index.by_hash[info.content_hash], None))
+                if basename in self.dedup_index.by_filename:
+                    best_by_filename.setdefault(basename, (self.dedup_index.by_filename[basename], None))
+
+        for index, info in enumerate(self.processed_image_info_list):
+            current_hash = info.content_hash
+            # Normalizar nome do arquivo (lowercase, ignorar extensão?) - Vamos usar basename por enquanto
+            current_basename = os.path.basename(info.original_path)
+            current_ctime = info.creation_time
+
+            # Atualizar melhor por hash
+            if current_hash not in best_by_hash or current_ctime < best_by_hash[current_hash][0]:
+                best_by_hash[current_hash] = (current_ctime, index)
+
+            # Atualizar melhor por nome de arquivo
+            if current_basename not in best_by_filename or current_ctime < best_by_filename[current_basename][0]:
+                best_by_filename[current_basename] = (current_ctime, index)
+
+        # Coletar os índices únicos dos itens a serem mantidos
+        final_indices_to_keep = set()
+        for _, index in best_by_hash.values():
+            final_indices_to_keep.add(index)
+        for _, index in best_by_filename.values():
+            final_indices_to_keep.add(index)
+        final_indices_to_keep.discard(None) # Células anteriores ficam sempre (não há como tirá-las da tela)
+        self._dedup_ctimes = ({key: ctime for key, (ctime, _) in best_by_hash.items()},
+                              {key: ctime for key, (ctime, _) in best_by_filename.items()})
+
+        # Criar a lista final para a colagem
+        # Mantém a ordem original de arraste/solte o máximo possível (novas depois das anteriores)
+        self.image_infos_for_collage = self._previous_infos + [
+            self.processed_image_info_list[i]
+            for i in sorted(list(final_indices_to_keep)) # Ordena por índice original
+        ]
+
+        self.metrics.increment('duplicates_dropped',
+                               len(self.processed_image_info_list) - len(final_indices_to_keep), kind='exact')
+        if self.perceptual_hash:
+            self._filter_near_duplicates()
+
+    def _filter_near_duplicates(self):
+        """Remove quase-duplicatas (distância de Hamming <= limite), mantendo a mais antiga.
+
+        As imagens são visitadas da mais antiga para a mais nova; cada uma só entra
+        na árvore BK se nenhuma já mantida estiver a até perceptual_threshold bits.
+        """
+        tree = BKTree()
+        shared_tree = self.dedup_index.perceptual if self.dedup_index is not None else None # Lotes anteriores
+        indices_to_keep = set(range(self._previous_count)) # Células anteriores ficam e entram na árvore
+        for index in indices_to_keep:
+            if self.image_infos_for_collage[index].perceptual_hash is not None:
+                tree.add(self.image_infos_for_collage[index].perceptual_hash, index)
+        by_age = sorted(range(self._previous_count, len(self.image_infos_for_collage)),
+                        key=lambda i: (self.image_infos_for_collage[i].creation_time, i))
+        for index in by_age:
+            value = self.image_infos_for_collage[index].perceptual_hash
+            if value is None: # Sem hash perceptual (não deveria acontecer): mantém
+                indices_to_keep.add(index)
+                continue
+            if (tree.find_within(value, self.perceptual_threshold) is None
+                    and (shared_tree is None or shared_tree.find_within(value, self.perceptual_threshold) is None)):
+                tree.add(value, index)
+                indices_to_keep.add(index)
+
+        removed_count = len(self.image_infos_for_collage) - len(indices_to_keep)
+        self.metrics.increment('duplicates_dropped', removed_count, kind='perceptual')
+        if removed_count:
+            print(f"Filtragem perceptual ({self.perceptual_hash}): {removed_count} quase-duplicatas removidas.")
+        self.image_infos_for_collage = [info for i, info in enumerate(self.image_infos_for_collage) if i in indices_to_keep]
+
+
+    def _calculate_grid_dimensions(self, sizes=None):
+        """Calcula dimensões da grade baseado nas imagens JÁ FILTRADAS (ou nos tamanhos planejados)."""
+        if sizes is None: # Usa a lista filtrada (tamanho vale também sem pixels)
+            sizes = [info.resized_size for info in self.image_infos_for_collage]
+        num_images = len(sizes)
+        if num_images == 0:
+            # Este erro não deveria acontecer se a verificação em run() estiver correta
+            raise ValueError("Nenhuma imagem final para calcular dimensões.")
+
+        cols = math.ceil(math.sqrt(num_images))
+        rows = math.ceil(num_images / cols)
+
+        max_w, max_h = 0, 0
+        for w, h in sizes:
+            max_w = max(w, max_w)
+            max_h = max(h, max_h)
+
+        if max_w == 0 or max_h == 0:
+             raise ValueError("Dimensões de imagem filtrada inválidas.")
+
+        return cols, rows, max_w, max_h
+
+    def _calculate_layout(self):
+        """Posiciona as imagens FILTRADAS conforme layout_mode."""
+        sizes = [info.resized_size for info in self.image_infos_for_collage]
+        if self._previous_count:
+            layout = self._continue_previous_layout(sizes)
+            if layout is not None:
+                return layout
+            print(f"Modo incremental: o layout {self.layout_mode} precisa crescer e será refeito.")
+            self.metrics.increment('incremental_relayouts')
+        return self._layout_for_sizes(sizes)
+
+    def _layout_for_sizes(self, sizes):
+        """Layout novo (layout_mode) para os tamanhos dados, na ordem recebida."""
+        if self.layout_mode == 'grid':
+            cols, rows, cell_width, cell_height = self._calculate_grid_dimensions(sizes)
+            return compute_grid_layout(sizes, cols, rows, cell_width, cell_height)
+        if not sizes:
+            raise ValueError("Nenhuma imagem final para calcular dimensões.")
+        if self.layout_mode == 'justified':
+            return compute_justified_layout(sizes, self.layout_row_height)
+        return compute_skyline_layout(sizes)
+
+    def _continue_previous_layout(self, sizes):
+        """Modo incremental: acrescenta as novas imagens ao layout anterior; None se ele precisa crescer.
+
+        A grade só é mantida se as novas cabem nas células vazias e no tamanho de célula atual.
+        """
+        state = self._previous_state
+        new_sizes = sizes[self._previous_count:]
+        if self.layout_mode == 'grid':
+            cols, rows, cell_width, cell_height = state['grid']
+            if len(sizes) > cols * rows or any(w > cell_width or h > cell_height for w, h in new_sizes):
+                return None
+            return compute_grid_layout(sizes, cols, rows, cell_width, cell_height)
+        resume = state['resume']
+        if self.layout_mode == 'justified':
+            layout = compute_justified_layout(sizes, resume['row_height'], resume['target_width'])
+        else:
+            if any(w > resume['width'] for w, _ in new_sizes):
+                return None
+            layout = compute_skyline_layout(sizes, resume['width'], placed=[cell['placement'] for cell in state['cells']],
+                                            skyline=resume['skyline'])
+        if layout.height > INCREMENTAL_MAX_ASPECT * layout.width:
+            return None
+        return layout
+
+    def _create_collage_image(self, layout):
+        """Cria a imagem final colando as imagens FILTRADAS.
+
+        No modo incremental parte da colagem anterior (ver _reuse_previous_canvas) e só
+        decodifica as células novas ou reescaladas pelo layout.
+        """
+        collage_width, collage_height = layout.width, layout.height
+        try:
+            # Verificar se as dimensões não são excessivas antes de criar
+            max_dimension = MAX_CANVAS_DIMENSION
+            if collage_width > max_dimension or collage_height > max_dimension:
+                 self.error_occurred.emit(f"Dimensões da colagem ({collage_width}x{collage_height}) excedem o limite. Muitas imagens ou imagens muito grandes "
+                                          "(use a saída 'png-strips' ou 'dzi').")
+                 return None
+            if self._previous_count:
+                collage_image, indices_to_paste = self._reuse_previous_canvas(layout)
+            else:
+                collage_image = Image.new('RGB', (collage_width, collage_height), (0, 0, 0))
+                indices_to_paste = range(len(self.image_infos_for_collage)) # Usa a lista filtrada
+        except ValueError as e:
+             self.error_occurred.emit(f"Erro ao criar tela ({collage_width}x{collage_height}): {e}.")
+             return None
+
+        paste_total = len(indices_to_paste)
+        with closing(self._iter_cell_images(indices_to_paste, layout)) as images_to_paste:
+            for pasted_count, (image_index, img_to_paste) in enumerate(images_to_paste, 1):
+                if self.is_cancelled: return None
+                if img_to_paste is not None:
+                    x, y, w, h = layout.placements[image_index]
+                    self._paste_image(collage_image, self._fit_to_placement(img_to_paste, w, h), image_index, x, y)
+                    del img_to_paste # No modo streaming a imagem sai da memória logo após colar
+
+                # Ajuste percentual da colagem: 70-95%
+                progress = 70 + int((pasted_count / paste_total) * 25)
+                if self._progress_due(final=pasted_count == paste_total):
+                     self.progress_update.emit(progress, f"Montando colagem: {pasted_count}/{paste_total}")
+
+        return collage_image
+
+    def _reuse_previous_canvas(self, layout):
+        """Modo incremental: tela com as células anteriores já no lugar; devolve (tela, índices a colar).
+
+        Se nenhuma célula anterior mudou e o tamanho da tela é o mesmo, a própria colagem
+        anterior é atualizada. Senão as células que mantêm o tamanho são copiadas para a nova
+        posição e as reescaladas pelo layout voltam a ser decodificadas do original.
+        """
+        with Image.open(self._previous_output) as previous:
+            previous = previous.convert('RGB')
+        previous_placements = [tuple(cell['placement']) for cell in self._previous_state['cells']]
+        new_indices = list(range(self._previous_count, len(self.image_infos_for_collage)))
+        if (previous.size == (layout.width, layout.height)
+                and previous_placements == layout.placements[:self._previous_count]):
+            return previous, new_indices
+
+        collage_image = Image.new('RGB', (layout.width, layout.height), (0, 0, 0))
+        indices_to_paste = []
+        for index, (x, y, w, h) in enumerate(previous_placements):
+            new_x, new_y, new_w, new_h = layout.placements[index]
+            if (new_w, new_h) == (w, h):
+                collage_image.paste(previous.crop((x, y, x + w, y + h)), (new_x, new_y))
+            else:
+                indices_to_paste.append(index)
+        del previous
+        return collage_image, indices_to_paste + new_indices
+
+    def _write_tiled_output(self, output_engine, layout):
+        """Monta a colagem faixa por faixa (layout.bands) e entrega cada faixa ao writer.
+
+        As imagens são processadas em ordem de y; uma faixa é gravada assim que todas
+        as imagens que começam acima do seu fim chegaram. Pico de memória: uma faixa
+        mais as imagens em voo ou que ainda cruzam as próximas faixas.
+        """
+        if output_engine == 'dzi':
+            writer = DeepZoomWriter(self._output_filename('.dzi'), layout.width, layout.height)
+        else:
+            writer = PngStripWriter(self._output_filename('.png'), layout.width, layout.height,
+                                    self.png_compress_level,
+                                    workers=png_encode_workers((layout.width, layout.height), self.encode_workers))
+
+        paste_total = len(self.image_infos_for_collage)
+        order = sorted(range(paste_total), key=lambda i: (layout.placements[i][1], layout.placements[i][0]))
+        tops = [layout.placements[i][1] for i in order]
+        infos_in_order = [self.image_infos_for_collage[i] for i in order]
+        if self.assembly_mode == 'streaming':
+            images_to_paste = self._iter_streamed_images(infos_in_order, [layout.placements[i][2:] for i in order])
+        else:
+            images_to_paste = ((position, info.resized_image) for position, info in enumerate(infos_in_order))
+
+        active = {} # índice -> imagem já no tamanho do layout (None se falhou), até sair da última faixa
+        arrived = set()
+        contiguous = 0 # Quantas imagens, na ordem de y, já chegaram sem lacunas
+        band_index = 0
+        try:
+            with closing(images_to_paste):
+                for pasted_count, (position, img) in enumerate(images_to_paste, 1):
+                    if self.is_cancelled:
+                        writer.abort()
+                        return None
+                    image_index = order[position]
+                    _, _, w, h = layout.placements[image_index]
+                    active[image_index] = self._fit_to_placement(img, w, h) if img is not None else None
+                    arrived.add(position)
+                    while contiguous in arrived:
+                        contiguous += 1
+
+                    # Grava todas as faixas que já estão completas, em ordem
+                    while band_index < len(layout.bands):
+                        band_top, band_bottom = layout.bands[band_index]
+                        if contiguous < bisect_left(tops, band_bottom):
+                            break
+                        if self.is_cancelled:
+                            writer.abort()
+                            return None
+                        strip = self._timed('paste', self._render_band, layout, active, band_top, band_bottom)
+                        self._timed('encode', writer.write_strip, strip)
+                        for index in [i for i in active if sum(layout.placements[i][1::2]) <= band_bottom]:
+                            del active[index] # Imagem não cruza mais nenhuma faixa
+                        band_index += 1
+
+                    # Ajuste percentual da colagem: 70-95%
+                    progress = 70 + int((pasted_count / paste_total) * 25)
+                    if self._progress_due(final=pasted_count == paste_total):
+                         self.progress_update.emit(progress, f"Montando colagem: {pasted_count}/{paste_total} "
+                                                             f"(faixa {band_index}/{len(layout.bands)})")
+
+            while band_index < len(layout.bands): # Faixas finais sem imagens
+                if self.is_cancelled:
+                    writer.abort()
+                    return None
+                band_top, band_bottom = layout.bands[band_index]
+                strip = self._timed('paste', self._render_band, layout, active, band_top, band_bottom)
+                self._timed('encode', writer.write_strip, strip)
+                band_index += 1
+            return self._timed('encode', writer.close)
+        except BaseException:
+            writer.abort() # Não deixa arquivo/tiles parciais
+            raise
+
+    def _render_band(self, layout, active, band_top, band_bottom):
+        """Faixa [band_top, band_bottom) da tela com as imagens ativas que a cruzam."""
+        strip = Image.new('RGB', (layout.width, band_bottom - band_top), (0, 0, 0))
+        for index, img in active.items():
+            x, y, _, h = layout.placements[index]
+            if img is not None and y < band_bottom and y + h > band_top:
+                self._paste_image(strip, img, index, x, y - band_top) # Pillow recorta o que sair da faixa
+        return strip
+
+    def _fit_to_placement(self, img, width, height):
+        """Reescala a imagem para o tamanho reservado pelo layout (no-op na grade)."""
+        if img.size == (width, height):
+            return img
+        return img.resize((width, height), RESAMPLING_FILTER)
+
+    def _paste_image(self, collage_image, img_to_paste, image_index, paste_x, paste_y):
+        """Cola uma imagem na posição do layout (com transparência para RGBA).
+
+        Os workers já entregam RGB composto sobre preto; RGBA só chega de entradas antigas do cache.
+        """
+        try:
+            if img_to_paste.mode == 'RGBA':
+                collage_image.paste(img_to_paste, (paste_x, paste_y), img_to_paste)
+            else:
+                collage_image.paste(img_to_paste, (paste_x, paste_y))
+        except IndexError:
+             print(f"Aviso: Problema ao obter máscara alfa para imagem {image_index}, colando sem transparência.")
+             collage_image.paste(img_to_paste.convert('RGB'), (paste_x, paste_y))
+        except Exception as e:
+             print(f"Erro ao colar imagem {image_index}: {e}")
+             # Decide: Parar ou continuar? Vamos continuar.
+
+    def _iter_cell_images(self, indices, layout):
+        """Gera (índice, imagem redimensionada ou None) para as células pedidas.
+
+        Imagens já em memória saem direto; as demais (modo streaming ou, no modo
+        incremental, células anteriores) são decodificadas por _iter_streamed_images
+        já no tamanho da célula do layout.
+        """
+        infos = self.image_infos_for_collage
+        missing = []
+        for index in indices:
+            if infos[index].resized_image is None:
+                missing.append(index)
+            else:
+                yield index, infos[index].resized_image
+        if missing:
+            stream = self._iter_streamed_images([infos[index] for index in missing],
+                                                [layout.placements[index][2:] for index in missing])
+            with closing(stream):
+                for position, img in stream:
+                    yield missing[position], img
+
+    def _iter_streamed_images(self, image_infos, target_sizes=None):
+        """2ª passada do modo streaming: gera (índice, imagem redimensionada ou None).
+
+        Mantém no máximo num_workers imagens em voo e entrega na ordem em que
+        ficam prontas, então o pico de memória é a tela mais essas imagens.
+        Com target_sizes (células do layout), as imagens que o layout reescala são
+        decodificadas direto no tamanho final (um resample só, sem passar pelo cache).
+        """
+        tasks = iter(enumerate(image_infos))
+        in_flight = {} # future -> (índice, tarefa)
+        ready = deque() # Acertos do cache, entregues sem passar pelo executor
+
+        def submit_next():
+            for index, info in tasks:
+                cached_info = self._cache_get(info.original_path, with_hash=False)
+                if cached_info is not None:
+                    self._record_image_metrics(cached_info, pass_number=2)
+                    ready.append((index, cached_info.resized_image))
+                    return
+                planned_size = tuple(target_sizes[index]) if target_sizes else None
+                if planned_size == tuple(info.resized_size):
+                    planned_size = None # Mesmo tamanho da miniatura: decodifica pelo fator e grava no cache
+                try:
+                    future, task = self._submit_image_task(info.original_path, with_hash=False,
+                                                           target_size=planned_size)
+                except BrokenProcessPool:
+                    self._fallback_to_threads()
+                    future, task = self._submit_image_task(info.original_path, with_hash=False,
+                                                           target_size=planned_size)
+                in_flight[future] = (index, task, planned_size)
+                return
+
+        try:
+            for _ in range(self.num_workers):
+                submit_next()
+            while in_flight or ready:
+                while ready:
+                    yield ready.popleft()
+                    submit_next()
+                if not in_flight:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, task, planned_size = in_flight.pop(future)
+                    path = task[0]
+                    try:
+                        image_info = self._collect_image_task(future, task)
+                    except BrokenProcessPool:
+                        self._fallback_to_threads()
+                        image_info = self.process_single_image(path, with_hash=False, target_size=planned_size)
+                    except Exception as exc:
+                        print(f"Erro ao obter resultado para {os.path.basename(path)}: {exc}")
+                        self.metrics.increment('errors', type=type(exc).__name__, stage='stream')
+                        image_info = None
+                    if image_info is None:
+                        print(f"Aviso: '{os.path.basename(path)}' falhou na 2ª passada; célula {index} ficará vazia.")
+                    else:
+                        self._record_image_metrics(image_info, pass_number=2)
+                    if planned_size is None: # O cache guarda só miniaturas no tamanho do fator
+                        self._cache_put(image_info)
+                    yield index, image_info.resized_image if image_info else None
+                    submit_next()
+        finally:
+            for future, (_, task, _) in in_flight.items():
+                future.cancel()
+                if task[1]: release_shared_buffer(task[1])
+
+    # generateUniqueName, cancel permanecem iguais
+
+    def _save_collage_image(self, collage_image):
+        """Salva a imagem da colagem no disco no formato configurado e informa o tempo gasto.
+
+        Devolve o caminho salvo, ou None se o trabalho foi cancelado durante a gravação.
+        """
+        if collage_image is None:
+             raise ValueError("Imagem da colagem não foi criada ou ocorreu erro.")
+
+        output_format = self.output_format
+        if output_format.startswith('webp') and max(collage_image.size) > WEBP_MAX_DIMENSION:
+            print(f"Aviso: colagem {collage_image.width}x{collage_image.height} excede o limite do WebP "
+                  f"({WEBP_MAX_DIMENSION} px); salvando em PNG.")
+            output_format = 'png'
+        filename = self._output_filename(OUTPUT_EXTENSIONS[output_format])
+        # Grava ao lado e renomeia: uma falha não deixa arquivo parcial nem estraga a colagem
+        # anterior (no modo incremental o arquivo é sobrescrito)
+        temporary_path = f'{filename}.{os.getpid()}.tmp'
+        try:
+            elapsed = save_collage(collage_image, temporary_path, output_format,
+                                   self.png_compress_level, self.encode_workers, self._cancel_requested)
+            os.replace(temporary_path, filename)
+        except OperationCancelled: # save_collage já removeu o arquivo parcial
+            print("Gravação da colagem cancelada.")
+            return None
+        except Exception as e:
+             if os.path.exists(temporary_path):
+                 os.remove(temporary_path)
+             raise IOError(f"Erro ao salvar a imagem final em {filename}: {e}") from e
+        encode_workers = png_encode_workers(collage_image.size, self.encode_workers)
+        detail = f"nível {self.png_compress_level}, {encode_workers} threads" if output_format == 'png' else output_format
+        print(f"Gravação ({detail}): {elapsed:.2f}s, {os.path.getsize(filename) / 1024**2:.1f} MB")
+        return filename
+
+    def _output_filename(self, extension):
+        """Caminho de saída (output_path ou nome único em save_dir); o diretório é criado se preciso."""
+        if self.output_path:
+            filename = os.path.splitext(self.output_path)[0] + extension
+        else:
+            unique_name = self.generateUniqueName()
+            # Nome reflete redimensionamento e filtragem
+            filename = os.path.join(self.save_dir, f'colagem_filtrada_{unique_name}{extension}')
+
+        output_dir = os.path.dirname(filename) or '.'
+        if not os.path.exists(output_dir):
+            try: os.makedirs(output_dir)
+            except OSError as e: raise OSError(f"Erro fatal ao criar diretório '{output_dir}' antes de salvar: {e}") from e
+        return filename
+
+    def generateUniqueName(self):
+        timestamp = int(time.time() * 1000)
+        random_part = hashlib.md5(os.urandom(8)).hexdigest()[:8]
+        return f"{timestamp}_{random_part}"
+
+    def _cancel_requested(self):
+        """cancel_check das operações longas (decodificação, hash, redimensionamento, gravação)."""
+        return self.is_cancelled
+
+    def _progress_due(self, final=False):
+        """True se um progress_update de etapa com muitos itens deve sair agora.
+
+        No máximo um a cada PROGRESS_INTERVAL s (os intermediários são descartados: a GUI só
+        mostra o mais recente); final=True (último item da etapa) sempre sai.
+        """
+        now = time.monotonic()
+        if not final and now - self._last_progress_time < PROGRESS_INTERVAL:
+            return False
+        self._last_progress_time = now
+        return True
+
+    def cancel(self):
+        """Pede o cancelamento; as operações em andamento param no próximo bloco (ver OperationCancelled)."""
+        print("Sinal de cancelamento recebido pelo worker.")
+        self.is_cancelled = True
+        if self._cancel_event is not None: # Tarefas já em execução nos processos filhos
+            self._cancel_event.set()
+
+
+# --- Fila de trabalhos (várias colagens ao mesmo tempo) ---
+@dataclass
+class CollageJob:
+    """Um trabalho da CollageJobQueue: entradas e opções de CollagePipeline."""
+    job_id: int
+    image_paths: list
+    save_dir: str
+    options: dict
+    exclusive_key: str | None = None # Trabalhos com a mesma chave nunca rodam juntos (ex.: mesma saída incremental)
+    state: str = 'queued' # 'queued', 'running', 'finished' ou 'cancelled'
+    workers: int = 0 # Workers de decodificação concedidos enquanto roda
+
+    @property
+    def size(self):
+        return len(self.image_paths)
+
+
+class CollageJobQueue:
+    """Fila de colagens com orçamento global de workers de decodificação.
+
+    Não cria threads: quem executa (QThreads da GUI, daemon) chama submit(), pede a
+    start_ready() os trabalhos que cabem agora (já com job.workers definido, para passar
+    como num_workers) e chama finish() quando cada um termina, liberando os workers.
+    Um trabalho leva todo o orçamento livre, exceto se houver outros esperando que
+    poderiam rodar junto: aí fica com orçamento / max_concurrent. Com smallest_first, trabalhos com menos imagens saem da fila antes (empate: ordem de chegada).
+    """
+
+    def __init__(self, worker_budget=DECODE_WORKER_BUDGET, max_concurrent=MAX_CONCURRENT_JOBS, smallest_first=False):
+        if worker_budget is None:
+            worker_budget = 2 * (os.cpu_count() or 1)
+        if worker_budget < 1 or max_concurrent < 1:
+            raise ValueError(f"Orçamento ({worker_budget}) e trabalhos simultâneos ({max_concurrent}) devem ser >= 1")
+        self.worker_budget = worker_budget
+        self.max_concurrent = max_concurrent
+        self.smallest_first = smallest_first
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._queued: list[CollageJob] = []
+        self._running: dict[int, CollageJob] = {}
+
+    def submit(self, image_paths, save_dir, exclusive_key=None, **options) -> CollageJob:
+        """Enfileira um trabalho (as opções vão para CollagePipeline, exceto num_workers, que é concedido)."""
+        with self._lock:
+            job = CollageJob(self._next_id, list(image_paths), save_dir, options, exclusive_key)
+            self._next_id += 1
+            self._queued.append(job)
+        return job
+
+    def cancel(self, job):
+        """Tira um trabalho da fila; False se ele já estiver rodando (cancele o pipeline) ou concluído."""
+        with self._lock:
+            if job not in self._queued:
+                return False
+            self._queued.remove(job)
+            job.state = 'cancelled'
+        return True
+
+    def start_ready(self) -> list[CollageJob]:
+        """Trabalhos que podem começar agora, já marcados como 'running' e com workers concedidos."""
+        started = []
+        with self._lock:
+            share = max(1, self.worker_budget // self.max_concurrent)
+            order = sorted(self._queued, key=lambda job: job.size) if self.smallest_first else list(self._queued)
+            busy_keys = {job.exclusive_key for job in self._running.values() if job.exclusive_key is not None}
+            for job in order:
+                free = self.worker_budget - sum(running.workers for running in self._running.values())
+                if len(self._running) >= self.max_concurrent or free < 1:
+                    break
+                if job.exclusive_key is not None and job.exclusive_key in busy_keys:
+                    continue # Espera o trabalho com a mesma saída terminar
+                blocked = busy_keys | {job.exclusive_key}
+                others_waiting = (len(self._running) + 1 < self.max_concurrent
+                                  and any(other is not job and (other.exclusive_key is None
+                                                                or other.exclusive_key not in blocked)
+                                          for other in self._queued))
+                limit = share if others_waiting else free # Sozinho, o trabalho usa o que estiver livre
+                requested = job.options.get('num_workers') or limit
+                job.workers = max(1, min(requested, limit, free, job.size))
+                job.state = 'running'
+                self._queued.remove(job)
+                self._running[job.job_id] = job
+                if job.exclusive_key is not None:
+                    busy_keys.add(job.exclusive_key)
+                started.append(job)
+        return started
+
+    def finish(self, job, cancelled=False):
+        """Libera os workers de um trabalho que terminou (com sucesso, erro ou cancelado)."""
+        with self._lock:
+            self._running.pop(job.job_id, None)
+            job.state = 'cancelled' if cancelled else 'finished'
+            job.workers = 0
+
+    def pipeline_options(self, job):
+        """Argumentos de CollagePipeline para o trabalho (opções + workers concedidos)."""
+        return dict(job.options, num_workers=job.workers)
+
+    @property
+    def queued(self):
+        with self._lock:
+            return list(self._queued)
+
+    @property
+    def running(self):
+        with self._lock:
+            return list(self._running.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queued) + len(self._running)
+
+
+# --- Modo vigia (pastas monitoradas) ---
+_IN_CLOSE_WRITE, _IN_MOVED_TO, _IN_CREATE = 0x008, 0x080, 0x100
+_IN_Q_OVERFLOW, _IN_IGNORED, _IN_ISDIR = 0x4000, 0x8000, 0x40000000
+_INOTIFY_EVENT = struct.Struct('iIII') # wd, mask, cookie, len; seguido do nome (len bytes)
+
+def is_watched_image(path):
+    """Imagem que o modo vigia aceita: extensão conhecida e nome não oculto (ex.: '.foto.jpg.part')."""
+    name = os.path.basename(path)
+    return not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS)
+
+def _scan_images(directory, recursive=False):
+    """Gera (caminho, os.stat_result) das imagens da pasta, em ordem de nome; o que sumir no meio é ignorado."""
+    try:
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from _scan_images(entry.path, recursive)
+            elif is_watched_image(entry.name) and entry.is_file():
+                yield entry.path, entry.stat()
+        except OSError:
+            continue
+
+
+class PollingWatcher:
+    """Detecta imagens novas varrendo as pastas a cada poll_interval s (qualquer sistema de arquivos).
+
+    Uma imagem é entregue quando varreduras separadas por ao menos settle_time s a veem com o
+    mesmo tamanho e mtime (a cópia terminou). Imagens entregues não voltam enquanto existirem;
+    as que saem da pasta são esquecidas.
+    """
+
+    def __init__(self, directories, recursive=False, include_existing=False,
+                 poll_interval=WATCH_POLL_INTERVAL, settle_time=WATCH_SETTLE_TIME):
+        self.directories = list(directories)
+        self.recursive = recursive
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self._candidates = {} # caminho -> ((tamanho, mtime_ns), visto assim desde)
+        self._delivered = set() if include_existing else set(self._scan())
+        self._next_scan = time.monotonic()
+
+    def _scan(self):
+        """caminho -> (tamanho, mtime_ns) das imagens de todas as pastas."""
+        return {path: (stat.st_size, stat.st_mtime_ns) for directory in self.directories
+                for path, stat in _scan_images(directory, self.recursive)}
+
+    def poll(self, timeout):
+        """Espera até timeout s pela próxima varredura; devolve as imagens que ficaram prontas."""
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, delay))
+        self._next_scan = time.monotonic() + self.poll_interval
+        now = time.monotonic()
+        current = self._scan()
+        self._delivered &= current.keys()
+        ready, candidates = [], {}
+        for path, signature in current.items():
+            if path in self._delivered:
+                continue
+            previous = self._candidates.get(path)
+            since = previous[1] if previous is not None and previous[0] == signature else now
+            if now - since >= self.settle_time:
+                ready.append(path)
+                self._delivered.add(path)
+            else:
+                candidates[path] = (signature, since)
+        self._candidates = candidates
+        return ready
+
+    def close(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def _inotify_libc():
+    """libc com as funções do inotify (OSError fora do Linux)."""
+    if not sys.platform.startswith('linux'):
+        raise OSError("inotify só existe no Linux")
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("libc sem inotify_init1")
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    return libc
+
+
+class InotifyWatcher:
+    """Detecta imagens novas com inotify (Linux, via ctypes), sem varrer as pastas a cada ciclo.
+
+    Entrega imagens fechadas depois de escritas (IN_CLOSE_WRITE) ou movidas para a pasta
+    (IN_MOVED_TO, de quem grava com outro nome e renomeia no fim). Com recursive, subpastas
+    novas ganham watch e são varridas (o que chegou antes do watch). Se a fila do kernel
+    transbordar, as pastas são varridas de novo; o DedupIndex descarta as repetidas.
+    """
+    WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, directories, recursive=False, include_existing=False):
+        self._libc = _inotify_libc()
+        self.directories = list(directories)
+        self.recursive = recursive
+        self._watches = {} # descritor do watch -> pasta
+        self._ready = []
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        try:
+            for directory in self.directories:
+                self._add_directory(directory, scan=include_existing)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_directory(self, directory, scan):
+        """Vigia a pasta (e as subpastas, com recursive); scan=True entrega as imagens que já estão nela."""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno() # ENOSPC: acabaram os watches (fs.inotify.max_user_watches)
+            raise OSError(error, f"inotify_add_watch: {os.strerror(error)}", directory)
+        self._watches[wd] = directory
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            if self.recursive and entry.is_dir(follow_symlinks=False):
+                self._add_directory(entry.path, scan)
+            elif scan and is_watched_image(entry.name) and entry.is_file():
+                self._ready.append(entry.path)
+
+    def poll(self, timeout):
+        """Espera até timeout s por eventos; devolve as imagens novas."""
+        if not self._ready and select.select([self._fd], [], [], timeout)[0]:
+            self._read_events()
+        ready, self._ready = self._ready, []
+        return ready
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + _INOTIFY_EVENT.size:offset + _INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += _INOTIFY_EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                print("Aviso: a fila do inotify transbordou; varrendo as pastas vigiadas de novo.")
+                for directory in self.directories:
+                    self._add_directory(directory, scan=True)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & _IN_IGNORED: # Pasta removida ou desmontada
+                del self._watches[wd]
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & _IN_ISDIR:
+                if self.recursive and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    try:
+                        self._add_directory(path, scan=True)
+                    except OSError as e:
+                        print(f"Aviso: não foi possível vigiar '{path}': {e}")
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO) and is_watched_image(path):
+                self._ready.append(path)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def open_folder_watcher(directories, recursive=False, watch_mode=WATCH_MODE, include_existing=False,
+                        poll_interval=WATCH_POLL_INTERVAL):
+    """InotifyWatcher ou PollingWatcher conforme watch_mode ('auto' tenta inotify e cai para varredura)."""
+    if watch_mode not in WATCH_MODES:
+        raise ValueError(f"Modo de vigia inválido: {watch_mode!r} (use {WATCH_MODES})")
+    if watch_mode != 'poll':
+        try:
+            return InotifyWatcher(directories, recursive, include_existing)
+        except OSError as e:
+            if watch_mode == 'inotify':
+                raise
+            print(f"Aviso: inotify indisponível ({e}); varrendo as pastas a cada {poll_interval:g}s.")
+    return PollingWatcher(directories, recursive, include_existing, poll_interval)
+
+
+class DedupIndex:
+    """Índices de deduplicação que valem entre trabalhos (lotes do modo vigia).
+
+    Hash de conteúdo e nome do arquivo -> ctime do mais antigo já usado, e uma BKTree com os
+    hashes perceptuais das imagens já usadas. CollagePipeline(dedup_index=...) trata o que está
+    aqui como células de uma execução anterior e acrescenta o que manteve (sob self.lock).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_hash = {}
+        self.by_filename = {}
+        self.perceptual = BKTree()
+        self.image_count = 0
+
+    def add(self, image_infos, by_hash, by_filename):
+        """Registra as imagens mantidas por um trabalho e os ctimes calculados na filtragem dele."""
+        for index, ctimes in ((self.by_hash, by_hash), (self.by_filename, by_filename)):
+            for key, ctime in ctimes.items():
+                index[key] = min(ctime, index.get(key, ctime))
+        for info in image_infos:
+            if info.perceptual_hash is not None:
+                self.perceptual.add(info.perceptual_hash, info.original_path)
+        self.image_count += len(image_infos)
+
+
+class CollageWatchDaemon:
+    """Modo vigia: transforma as imagens que chegam nas pastas em colagens, lote a lote.
+
+    Um único executor de decodificação (threads ou processos) e um DedupIndex servem todos os
+    lotes: nada é recriado por lote e o que já entrou numa colagem não se repete nas seguintes.
+    Os lotes passam por uma CollageJobQueue (concurrent_batches ao mesmo tempo, dividindo os
+    workers); enquanto um lote espera na fila, os arquivos novos se acumulam no próximo.
+    Sinais: batch_started(lote, imagens), progress_update(lote, int, str),
+    collage_finished(lote, str) e error_occurred(lote, str). run() bloqueia até stop().
+    """
+    BUSY_POLL = 0.25 # Com um lote esperando, o laço volta logo para iniciá-lo quando outro termina
+
+    def __init__(self, directories, save_dir, recursive=False, batch_size=WATCH_BATCH_SIZE,
+                 batch_window=WATCH_BATCH_WINDOW, watch_mode=WATCH_MODE, poll_interval=WATCH_POLL_INTERVAL,
+                 include_existing=False, concurrent_batches=WATCH_CONCURRENT_BATCHES, metrics_sinks_factory=None,
+                 **options):
+        if batch_size < 1:
+            raise ValueError(f"batch_size deve ser >= 1: {batch_size}")
+        if batch_window <= 0 or poll_interval <= 0:
+            raise ValueError(f"Janela ({batch_window}) e intervalo de varredura ({poll_interval}) devem ser > 0")
+        if watch_mode not in WATCH_MODES:
+            raise ValueError(f"Modo de vigia inválido: {watch_mode!r} (use {WATCH_MODES})")
+        if options.get('incremental') or options.get('output_path'):
+            raise ValueError("O modo vigia grava uma colagem nova por lote em save_dir (sem incremental/output_path)")
+        if not directories:
+            raise ValueError("Nenhuma pasta para vigiar")
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise ValueError(f"Pasta vigiada não encontrada: {directory!r}")
+            watched, output = path_key(directory), path_key(save_dir)
+            if output == watched or (recursive and output.startswith(os.path.join(watched, ''))):
+                raise ValueError(f"A pasta de saída {save_dir!r} não pode ficar dentro da pasta vigiada {directory!r}")
+        self.backend = options.pop('backend', EXECUTION_BACKEND)
+        num_workers = options.pop('num_workers', None)
+        if num_workers is None:
+            num_workers = (os.cpu_count() or 1) * (2 if self.backend == 'thread' else 1)
+        validate_pipeline_options(backend=self.backend, **options) # Opções inválidas falham antes de vigiar
+        self.batch_started = Signal()
+        self.progress_update = Signal()
+        self.collage_finished = Signal()
+        self.error_occurred = Signal()
+        self.directories = list(directories)
+        self.save_dir = save_dir
+        self.recursive = recursive
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.watch_mode = watch_mode
+        self.poll_interval = poll_interval
+        self.include_existing = include_existing
+        self.num_workers = num_workers
+        self.options = options
+        self.metrics_sinks_factory = metrics_sinks_factory # Função sem argumentos -> sinks de cada lote
+        self.job_queue = CollageJobQueue(num_workers, concurrent_batches)
+        self.dedup_index = DedupIndex()
+        self.collages_saved = 0
+        self._stop = threading.Event()
+        self._lock = threading.RLock() # stop() também roda no handler de SIGTERM
+        self._pipelines = set()
+        self._executor = None
+        self._cancel_event = multiprocessing.Event() if self.backend == 'process' else None
+
+    def run(self):
+        """Vigia as pastas e gera colagens até stop() (ou KeyboardInterrupt); lotes na fila são descartados."""
+        watcher = open_folder_watcher(self.directories, self.recursive, self.watch_mode, self.include_existing,
+                                      self.poll_interval)
+        self._executor = self._create_executor()
+        runner = ThreadPoolExecutor(max_workers=self.job_queue.max_concurrent, thread_name_prefix='lote')
+        pending = {} # caminho -> None: ordem de chegada, sem repetidos
+        first_arrival = None # Chegada do arquivo mais antigo em pending (monotonic)
+        print(f"Vigiando {', '.join(self.directories)} ({type(watcher).__name__}, {self.backend} x{self.num_workers}); "
+              f"colagens em {self.save_dir}")
+        try:
+            while not self._stop.is_set():
+                timeout = self.poll_interval
+                if self.job_queue.queued:
+                    timeout = min(timeout, self.BUSY_POLL)
+                elif pending:
+                    timeout = max(0.0, min(timeout, first_arrival + self.batch_window - time.monotonic()))
+                for path in watcher.poll(timeout):
+                    pending.setdefault(path)
+                if pending and first_arrival is None:
+                    first_arrival = time.monotonic()
+                # Um lote por vez na fila: com os lotes ocupados, os arquivos novos vão para o próximo
+                while pending and not self.job_queue.queued and (
+                        len(pending) >= self.batch_size or time.monotonic() - first_arrival >= self.batch_window):
+                    batch = list(pending)[:self.batch_size]
+                    for path in batch:
+                        del pending[path]
+                    self.job_queue.submit(batch, self.save_dir, **self.options)
+                    self._start_ready_batches(runner)
+                if not pending:
+                    first_arrival = None
+                self._start_ready_batches(runner)
+        finally:
+            self.stop()
+            runner.shutdown(wait=True)
+            watcher.close()
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        return self.collages_saved
+
+    def stop(self):
+        """Para de vigiar e cancela os lotes em andamento (os arquivos continuam nas pastas)."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+        with self._lock:
+            for pipeline in self._pipelines:
+                pipeline.cancel()
+
+    def _create_executor(self):
+        """Executor de vida longa da decodificação, compartilhado por todos os lotes."""
+        if self.backend == 'process':
+            try:
+                return new_process_pool(self.num_workers, self._cancel_event)
+            except (OSError, NotImplementedError, ValueError) as e:
+                print(f"Aviso: não foi possível iniciar o pool de processos: {e}; usando threads.")
+                self.backend = 'thread'
+        return ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='ImgProc')
+
+    def _start_ready_batches(self, runner):
+        for job in self.job_queue.start_ready():
+            runner.submit(self._run_batch, job)
+
+    def _run_batch(self, job):
+        """Roda um lote (na thread do runner) com o executor e o DedupIndex compartilhados."""
+        executor = self._executor
+        pipeline = None
+        try:
+            sinks = self.metrics_sinks_factory() if self.metrics_sinks_factory else ()
+            pipeline = CollagePipeline(job.image_paths, job.save_dir, backend=self.backend, executor=executor,
+                                       dedup_index=self.dedup_index, metrics_sinks=sinks,
+                                       **self.job_queue.pipeline_options(job))
+            pipeline.progress_update.connect(lambda percent, message: self.progress_update.emit(job.job_id, percent, message))
+            pipeline.collage_finished.connect(lambda path: self.collage_finished.emit(job.job_id, path))
+            pipeline.error_occurred.connect(lambda message: self.error_occurred.emit(job.job_id, message))
+            with self._lock:
+                self._pipelines.add(pipeline)
+                if self._stop.is_set():
+                    pipeline.cancel()
+            self.batch_started.emit(job.job_id, job.size)
+            if pipeline.run():
+                with self._lock:
+                    self.collages_saved += 1
+        except Exception as e: # Não deixa um lote derrubar o daemon (o erro some dentro do runner)
+            traceback.print_exc()
+            self.error_occurred.emit(job.job_id, f"Erro inesperado no lote: {e}")
+        finally:
+            with self._lock:
+                self._pipelines.discard(pipeline)
+            self.job_queue.finish(job, cancelled=pipeline is not None and pipeline.is_cancelled)
+        if pipeline is not None and pipeline._process_pool_failed and isinstance(executor, ProcessPoolExecutor):
+            self._replace_executor(executor)
+
+    def _replace_executor(self, broken):
+        """Troca um pool de processos quebrado por um novo (uma vez, mesmo com vários lotes afetados)."""
+        with self._lock:
+            if self._executor is not broken or self._stop.is_set():
+                return
+            print("Aviso: o pool de processos do modo vigia quebrou; iniciando outro.")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._create_executor()
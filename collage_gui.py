@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""Interface PyQt5 do gerador de colagens: arrastar e soltar imagens numa janela.
+
+O processamento fica em collage_core.CollagePipeline; aqui ele roda num QThread
+e os sinais do núcleo são repassados como sinais Qt para a thread da interface.
+Cada arraste vira um trabalho de uma collage_core.CollageJobQueue: vários rodam ao
+mesmo tempo, dividindo o orçamento global de workers de decodificação.
+"""
+
+import sys
+import os
+import time
+
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QMainWindow,
+                             QProgressBar, QMessageBox, QCheckBox, QComboBox, QPushButton, QScrollArea)
+from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal
+from PyQt5.QtGui import QDragEnterEvent, QDropEvent
+
+from collage_core import (CollagePipeline, CollageJobQueue, IMAGE_EXTENSIONS, RESIZE_FACTOR, FRAME_POLICY,
+                          INCREMENTAL_OUTPUT_NAME)
+
+# Rótulos da política de quadros (GIF animado, TIFF de várias páginas) -> valor de frame_policy
+FRAME_POLICY_LABELS = (('Vários quadros: só o primeiro', 'first'),
+                       ('Vários quadros: cada quadro é uma imagem', 'all'),
+                       ('Vários quadros: folha de contato', 'sheet'))
+# Espera máxima (ms) ao fechar com trabalhos cancelados: o núcleo interrompe decodificação,
+# hash, redimensionamento e gravação no próximo bloco, então normalmente sobra bastante folga
+CLOSE_WAIT_MS = 10000
+DEFAULT_SAVE_PATH = r'C:\colagens_filtradas' # Pasta das colagens quando nenhuma é indicada
+
+
+# --- Worker Thread ---
+class CollageWorker(QThread):
+    """Roda um CollagePipeline fora da thread da interface.
+
+    Aceita os mesmos argumentos de CollagePipeline; o pipeline fica em self.pipeline.
+    """
+    progress_update = pyqtSignal(int, str)
+    collage_finished = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+
+    def __init__(self, image_paths, save_dir, **options):
+        super().__init__()
+        self.pipeline = CollagePipeline(image_paths, save_dir, **options)
+        # Emitidos na thread do worker; o Qt entrega aos slots da GUI por fila
+        self.pipeline.progress_update.connect(self.progress_update.emit)
+        self.pipeline.collage_finished.connect(self.collage_finished.emit)
+        self.pipeline.error_occurred.connect(self.error_occurred.emit)
+
+    def run(self):
+        self.pipeline.run()
+
+    def cancel(self):
+        self.pipeline.cancel()
+
+
+# --- Linha de um trabalho na fila (progresso e cancelamento) ---
+class JobRow(QWidget):
+    """Rótulo, barra de progresso e botão de cancelar de um trabalho da fila."""
+    cancel_requested = pyqtSignal(int)
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job_id = job.job_id
+        self.title = f"#{job.job_id} ({job.size} imagens)"
+        self.label = QLabel(f"{self.title}: na fila", self)
+        self.label.setWordWrap(True)
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setRange(0, 100)
+        self.progressBar.setValue(0)
+        self.cancelButton = QPushButton('Cancelar', self)
+        self.cancelButton.clicked.connect(lambda: self.cancel_requested.emit(self.job_id))
+        row = QHBoxLayout(self)
+        row.setContentsMargins(0, 0, 0, 0)
+        row.addWidget(self.label, 2)
+        row.addWidget(self.progressBar, 3)
+        row.addWidget(self.cancelButton)
+
+    def setStatus(self, text, style=''):
+        self.label.setText(f"{self.title}: {text}")
+        self.label.setStyleSheet(style)
+
+    def updateProgress(self, percentage, message):
+        self.progressBar.setValue(percentage)
+        self.progressBar.setFormat(f"%p% - {message}")
+
+    def setDone(self, text, style):
+        self.setStatus(text, style)
+        self.cancelButton.setEnabled(False)
+
+
+# --- Main GUI Widget (pequenas alterações em textos e save_path) ---
+class ImageCollage(QWidget):
+    def __init__(self, save_path=None):
+        super().__init__()
+        self.save_path = save_path or DEFAULT_SAVE_PATH
+        self.cache_dir = os.path.join(self.save_path, 'cache') # Miniaturas reaproveitadas entre arrastes
+        # Arrastes viram trabalhos na fila; vários rodam ao mesmo tempo dentro do orçamento de workers
+        self.job_queue = CollageJobQueue()
+        self.workers = {} # job_id -> CollageWorker em execução
+        self.job_rows = {} # job_id -> JobRow
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle('Criador de Colagens (Redim. + Anti-Duplicata)')
+        self.setMinimumSize(500, 350)
+
+        self.layout = QVBoxLayout()
+        self.label = QLabel(f'Arraste imagens aqui.\n({int(RESIZE_FACTOR*100)}% do original, duplicatas removidas pelo mais antigo)')
+        self.label.setAlignment(Qt.AlignCenter)
+        self.label.setWordWrap(True)
+        self.base_style = 'border: 2px dashed blue; padding: 20px; font-size: 14px;'
+        self.label.setStyleSheet(self.base_style)
+
+        # Modo incremental: cada arraste acrescenta só as imagens novas à mesma colagem
+        self.incrementalCheckBox = QCheckBox('Acrescentar à colagem existente (modo incremental)', self)
+        self.framePolicyComboBox = QComboBox(self)
+        for label, policy in FRAME_POLICY_LABELS:
+            self.framePolicyComboBox.addItem(label, policy)
+        self.framePolicyComboBox.setCurrentIndex(self.framePolicyComboBox.findData(FRAME_POLICY))
+        self.smallestFirstCheckBox = QCheckBox('Priorizar trabalhos menores na fila', self)
+        self.smallestFirstCheckBox.toggled.connect(self.setSmallestFirst)
+
+        # Trabalhos (na fila, rodando e concluídos recentemente)
+        self.jobsLayout = QVBoxLayout()
+        self.jobsLayout.addStretch()
+        jobsWidget = QWidget(self)
+        jobsWidget.setLayout(self.jobsLayout)
+        self.jobsArea = QScrollArea(self)
+        self.jobsArea.setWidgetResizable(True)
+        self.jobsArea.setWidget(jobsWidget)
+        self.jobsArea.setVisible(False)
+
+        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.incrementalCheckBox)
+        self.layout.addWidget(self.framePolicyComboBox)
+        self.layout.addWidget(self.smallestFirstCheckBox)
+        self.layout.addWidget(self.jobsArea)
+        self.setLayout(self.layout)
+
+        self.setAcceptDrops(True)
+
+    def dragEnterEvent(self, event: QDragEnterEvent):
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+            self.label.setStyleSheet('border: 2px dashed red; padding: 20px; font-size: 14px;')
+            self.label.setText('Solte as imagens para enfileirar...')
+        else:
+            event.ignore()
+
+    def dragLeaveEvent(self, event):
+        self.resetLabel()
+
+    def dropEvent(self, event: QDropEvent):
+        urls = event.mimeData().urls()
+        imagePaths = []
+        for url in urls:
+            file_path = url.toLocalFile()
+            if os.path.isfile(file_path) and file_path.lower().endswith(IMAGE_EXTENSIONS):
+                imagePaths.append(file_path)
+
+        if not imagePaths:
+            self.showError("Nenhuma imagem válida encontrada.")
+            return
+
+        try:
+            if not os.path.exists(self.save_path): os.makedirs(self.save_path)
+        except OSError as e:
+            self.showError(f"Erro CRÍTICO ao criar diretório:\n{self.save_path}\n{e}\nVerifique permissões.", critical=True)
+            return
+
+        self.startProcessing(imagePaths)
+
+    def startProcessing(self, imagePaths):
+        """Enfileira um trabalho com as opções atuais da janela; começa assim que houver capacidade."""
+        incremental = self.incrementalCheckBox.isChecked()
+        # Trabalhos incrementais atualizam a mesma colagem: rodam um de cada vez
+        exclusive_key = os.path.join(self.save_path, INCREMENTAL_OUTPUT_NAME) if incremental else None
+        job = self.job_queue.submit(imagePaths, self.save_path, exclusive_key=exclusive_key,
+                                    cache_dir=self.cache_dir, incremental=incremental,
+                                    frame_policy=self.framePolicyComboBox.currentData())
+        row = JobRow(job, self)
+        row.cancel_requested.connect(self.cancelJob)
+        self.job_rows[job.job_id] = row
+        self.jobsLayout.insertWidget(self.jobsLayout.count() - 1, row) # Antes do espaçador
+        self.jobsArea.setVisible(True)
+        self.resetLabel()
+        self.startReadyJobs()
+
+    def startReadyJobs(self):
+        """Inicia os trabalhos da fila que cabem no orçamento de workers."""
+        for job in self.job_queue.start_ready():
+            worker = CollageWorker(job.image_paths, job.save_dir, **self.job_queue.pipeline_options(job))
+            row = self.job_rows[job.job_id]
+            row.setStatus(f"processando com {job.workers} workers")
+            worker.progress_update.connect(row.updateProgress)
+            worker.collage_finished.connect(lambda path, job=job: self.onProcessingFinished(job, path))
+            worker.error_occurred.connect(lambda message, job=job: self.onProcessingError(job, message))
+            worker.finished.connect(lambda job=job: self.onWorkerThreadFinished(job))
+            self.workers[job.job_id] = worker
+            worker.start()
+        self.resetLabel()
+
+    def setSmallestFirst(self, enabled):
+        self.job_queue.smallest_first = enabled
+
+    def cancelJob(self, job_id):
+        row = self.job_rows.get(job_id)
+        if job_id in self.workers:
+            self.workers[job_id].cancel() # onWorkerThreadFinished libera os workers
+            row.setStatus("cancelando...")
+            return
+        for job in self.job_queue.queued:
+            if job.job_id == job_id and self.job_queue.cancel(job):
+                row.setDone("cancelado", 'color: gray;')
+                self.scheduleRowRemoval(job_id)
+        self.resetLabel()
+
+    def onProcessingFinished(self, job, saved_path):
+        row = self.job_rows[job.job_id]
+        # Tenta extrair a mensagem final da barra de progresso (inclui tempo e contagem)
+        progress_text_parts = row.progressBar.format().split("-")
+        status_message = progress_text_parts[-1].strip() if len(progress_text_parts) > 1 else "Concluído!"
+        row.setDone(f'Sucesso! {status_message}\nSalvo em: {saved_path}', 'color: green;')
+        row.progressBar.setValue(100)
+
+    def onProcessingError(self, job, error_message):
+        print(f"Erro no trabalho #{job.job_id}: {error_message}")
+        self.job_rows[job.job_id].setDone(f"Erro: {error_message}", 'color: red;')
+
+    def onWorkerThreadFinished(self, job):
+        print(f"Worker do trabalho #{job.job_id} finalizado.")
+        worker = self.workers.pop(job.job_id)
+        cancelled = worker.pipeline.is_cancelled
+        self.job_queue.finish(job, cancelled=cancelled)
+        row = self.job_rows[job.job_id]
+        if cancelled:
+            row.setDone("cancelado", 'color: gray;')
+        elif row.cancelButton.isEnabled(): # Terminou sem sucesso nem erro emitido
+            row.setDone("concluído sem colagem", 'color: gray;')
+        self.scheduleRowRemoval(job.job_id)
+        self.startReadyJobs() # Workers liberados: próximo da fila
+
+    def scheduleRowRemoval(self, job_id):
+        QTimer.singleShot(10000, lambda: self.removeRow(job_id))
+
+    def removeRow(self, job_id):
+        row = self.job_rows.pop(job_id, None)
+        if row is not None:
+            self.jobsLayout.removeWidget(row)
+            row.deleteLater()
+        self.jobsArea.setVisible(bool(self.job_rows))
+
+    def showError(self, message, critical=False):
+        print(f"GUI Error Display: {message}")
+        if critical:
+            QMessageBox.critical(self, "Erro Crítico", message)
+            self.resetLabel() # Resetar após erro crítico
+        else:
+            # Erros não críticos na label
+            self.label.setStyleSheet('border: 2px solid red; padding: 20px; font-size: 14px; color: red;')
+            self.label.setText(message)
+            QTimer.singleShot(6000, self.resetLabel) # Resetar após um tempo
+
+    def resetLabel(self):
+        # Atualiza texto inicial (com o resumo da fila, se houver trabalhos)
+        text = f'Arraste imagens aqui.\n({int(RESIZE_FACTOR*100)}% do original, duplicatas removidas pelo mais antigo)'
+        running, queued = len(self.workers), len(self.job_queue.queued)
+        if running or queued:
+            text += f'\n{running} em andamento, {queued} na fila'
+        self.label.setText(text)
+        self.resetLabelStyle()
+
+    def resetLabelStyle(self):
+         self.label.setStyleSheet(self.base_style + "color: black;")
+
+    def closeEvent(self, event):
+        if self.workers or self.job_queue.queued:
+            reply = QMessageBox.question(self, 'Processamento em Andamento',
+                                           "Deseja cancelar os trabalhos atuais e sair?",
+                                           QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply == QMessageBox.Yes:
+                print("Usuário solicitou cancelamento ao fechar.")
+                for job in self.job_queue.queued:
+                    self.job_queue.cancel(job)
+                for worker in list(self.workers.values()):
+                    worker.cancel()
+                deadline = time.monotonic() + CLOSE_WAIT_MS / 1000
+                for worker in list(self.workers.values()):
+                    remaining_ms = max(0, int((deadline - time.monotonic()) * 1000))
+                    if not worker.wait(remaining_ms):
+                        print(f"Aviso: trabalho {worker.pipeline.job_id} não terminou em {CLOSE_WAIT_MS} ms.")
+                event.accept()
+            else:
+                event.ignore()
+        else:
+            event.accept()
+
+
+# --- Main Application Setup ---
+class MainWindow(QMainWindow):
+    # ... (igual à versão anterior) ...
+    def __init__(self, save_path=None):
+        super().__init__()
+        self.collageWidget = ImageCollage(save_path)
+        self.setCentralWidget(self.collageWidget)
+        self.setWindowTitle(self.collageWidget.windowTitle())
+        self.resize(650, 450)
+
+    def closeEvent(self, event):
+        self.collageWidget.closeEvent(event)
+
+
+def main(argv=None, save_path=None):
+    app = QApplication(sys.argv if argv is None else argv)
+    window = MainWindow(save_path)
+    window.show()
+    return app.exec_()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
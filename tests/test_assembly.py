@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Montagem em streaming: a primeira passada não guarda pixels e a colagem é a mesma do modo memória."""
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from collage_core import CollagePipeline
+
+
+@pytest.fixture(scope='module')
+def paths(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('fotos')
+    paths = []
+    for index, size in enumerate([(400, 300), (300, 400), (640, 200), (256, 256), (500, 380), (200, 520)]):
+        path = directory / f'{index}.png'
+        Image.effect_noise(size, 40 + 10 * index).convert('RGB' if index % 2 else 'RGBA').save(path)
+        paths.append(str(path))
+    with Image.open(paths[0]) as first:
+        first.save(directory / 'copia.png') # Duplicata de conteúdo com outro nome
+    return paths + [str(directory / 'copia.png')]
+
+
+@pytest.mark.parametrize('layout_mode', ['grid', 'justified', 'skyline'])
+def test_streaming_matches_memory(tmp_path, monkeypatch, paths, layout_mode):
+    outputs = {}
+    held_pixels = {}
+    original_filter = CollagePipeline._filter_duplicates
+
+    def spy_filter(pipeline):
+        held_pixels[pipeline.assembly_mode] = sum(info.resized_image is not None
+                                                  for info in pipeline.processed_image_info_list)
+        return original_filter(pipeline)
+
+    monkeypatch.setattr(CollagePipeline, '_filter_duplicates', spy_filter)
+    for assembly_mode in ('memory', 'streaming'):
+        pipeline = CollagePipeline(paths, str(tmp_path / assembly_mode), num_workers=2,
+                                   assembly_mode=assembly_mode, layout_mode=layout_mode)
+        outputs[assembly_mode] = pipeline.run()
+        assert outputs[assembly_mode] is not None
+    assert held_pixels == {'memory': len(paths), 'streaming': 0}
+    with Image.open(outputs['memory']) as memory, Image.open(outputs['streaming']) as streaming:
+        assert memory.size == streaming.size
+        difference = ImageChops.difference(memory, streaming)
+        if layout_mode == 'justified':
+            # O streaming decodifica direto no tamanho da célula (um resample só, em vez de dois)
+            assert max(ImageStat.Stat(difference).mean) < 4
+        else:
+            assert difference.getbbox() is None
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Backend de processos: pixels pela memória compartilhada e mesma colagem que o backend de threads."""
+
+from PIL import Image, ImageChops
+
+import collage_core
+from collage_core import (CollagePipeline, allocate_shared_buffer, load_and_resize_image,
+                          process_image_to_shared_memory, read_shared_buffer, release_shared_buffer,
+                          RESIZE_FACTOR)
+
+
+def _corpus(directory):
+    paths = []
+    for index, mode in enumerate(['RGB', 'RGBA', 'L', 'P', 'RGB']):
+        img = Image.effect_noise((320 + 40 * index, 240), 50 + 20 * index).convert(mode)
+        path = directory / f'{index}.png'
+        img.save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_process_backend_matches_threads(tmp_path, monkeypatch):
+    pools = []
+    original_pool = collage_core.new_process_pool
+    monkeypatch.setattr(collage_core, 'new_process_pool', lambda *args: pools.append(args) or original_pool(*args))
+    paths = _corpus(tmp_path)
+    outputs = {}
+    for backend in ('thread', 'process'):
+        pipeline = CollagePipeline(paths, str(tmp_path / backend), num_workers=2, backend=backend)
+        outputs[backend] = pipeline.run()
+        assert outputs[backend] is not None
+    with Image.open(outputs['thread']) as thread_collage, Image.open(outputs['process']) as process_collage:
+        assert thread_collage.size == process_collage.size
+        assert ImageChops.difference(thread_collage, process_collage).getbbox() is None
+    assert len(pools) == 1 # Só o backend 'process' abriu um pool de processos
+
+
+def test_shared_buffer_roundtrip(tmp_path):
+    path = _corpus(tmp_path)[1] # RGBA: chega composta sobre preto, em RGB
+    shm, size, mode = allocate_shared_buffer(path)
+    try:
+        info = process_image_to_shared_memory(path, RESIZE_FACTOR, 'fast', shm.name, size, mode)
+        assert info.resized_image is None # Pixels foram para o buffer
+        expected = load_and_resize_image(path, RESIZE_FACTOR, 'fast').resized_image
+        assert ImageChops.difference(read_shared_buffer(shm, size, mode), expected).getbbox() is None
+    finally:
+        release_shared_buffer(shm)
+
+
+def test_size_mismatch_falls_back_to_pickled_image(tmp_path):
+    path = _corpus(tmp_path)[0]
+    shm, size, mode = allocate_shared_buffer(path)
+    try:
+        info = process_image_to_shared_memory(path, RESIZE_FACTOR, 'fast', shm.name, (size[0] + 1, size[1]), mode)
+        assert info.resized_image is not None
+    finally:
+        release_shared_buffer(shm)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""measure_components: mede o hash de conteúdo que o pipeline usa, não um SHA-256 de tobytes."""
+
+from PIL import Image
+
+import collage_benchmark
+
+
+def test_components_use_pipeline_hasher(tmp_path, monkeypatch):
+    path = tmp_path / 'a.jpg'
+    Image.effect_noise((300, 200), 60).convert('RGB').save(path, quality=90)
+    created = []
+    original = collage_benchmark.new_content_hasher
+
+    def recording_hasher(name):
+        created.append(name)
+        return original(name)
+
+    monkeypatch.setattr(collage_benchmark, 'new_content_hasher', recording_hasher)
+    result = collage_benchmark.measure_components([str(path)], quality='fast', content_hash='blake2b')
+    assert created == ['blake2b']
+    assert result['content_hash'] == 'blake2b'
+    # O hash cobre os pixels em resolução total, então o modo 'fast' decodifica sem draft.
+    assert result['decoded_megapixels'] == 0.06
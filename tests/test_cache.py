@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""ThumbnailCache compartilhado por vários trabalhos (--each, --jobs, modo vigia)."""
+
+import threading
+
+from PIL import Image
+
+from collage_core import ThumbnailCache, ProcessedImageInfo
+
+
+def _info(path, color):
+    thumbnail = Image.new('RGB', (8, 6), color)
+    return ProcessedImageInfo(original_path=str(path), creation_time=0.0, content_hash=f'hash-{color}',
+                              resized_size=thumbnail.size, resized_image=thumbnail)
+
+
+def _source(tmp_path, name, color):
+    path = tmp_path / name
+    Image.new('RGB', (16, 12), color).save(path)
+    return path
+
+
+def test_round_trip(tmp_path):
+    source = _source(tmp_path, 'a.png', 'red')
+    cache = ThumbnailCache(str(tmp_path / 'cache'))
+    try:
+        cache.put(_info(source, 'red'))
+        cached = cache.get(str(source))
+    finally:
+        cache.close()
+    assert cached.content_hash == 'hash-red'
+    assert cached.resized_image.tobytes() == Image.new('RGB', (8, 6), 'red').tobytes()
+
+
+def test_concurrent_caches_do_not_block_each_other(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    first, second = ThumbnailCache(cache_dir), ThumbnailCache(cache_dir)
+    red, blue = _source(tmp_path, 'red.png', 'red'), _source(tmp_path, 'blue.png', 'blue')
+    try:
+        first.put(_info(red, 'red'))
+        assert first.get(str(red)) is not None # get também escreve (last_used)
+        # Com uma transação aberta no primeiro cache, o segundo esperaria o timeout de 30 s
+        writer = threading.Thread(target=second.put, args=(_info(blue, 'blue'),))
+        writer.start()
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+        assert second.stores == 1
+        assert second.get(str(red)) is not None
+        assert first.get(str(blue)) is not None
+    finally:
+        first.close()
+        second.close()
+
+
+def test_changed_file_is_a_miss(tmp_path):
+    source = _source(tmp_path, 'a.png', 'red')
+    cache = ThumbnailCache(str(tmp_path / 'cache'))
+    try:
+        cache.put(_info(source, 'red'))
+        Image.new('RGB', (20, 12), 'green').save(source)
+        assert cache.get(str(source)) is None
+    finally:
+        cache.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Cancelamento cooperativo: as operações longas param no próximo bloco e não deixam arquivos parciais."""
+
+import os
+
+import pytest
+from PIL import Image
+
+from collage_core import (OperationCancelled, CollagePipeline, hash_image_pixels, resize_to_target,
+                          load_and_resize_image, save_collage, save_png_parallel, CHUNKED_RESIZE_MIN_PIXELS)
+
+
+def cancelled():
+    return True
+
+
+def cancel_after(calls):
+    """cancel_check que passa `calls` vezes e depois pede o cancelamento."""
+    remaining = [calls]
+    def check():
+        remaining[0] -= 1
+        return remaining[0] < 0
+    return check
+
+
+def test_hash_stops_between_blocks():
+    with pytest.raises(OperationCancelled):
+        hash_image_pixels(Image.new('RGB', (64, 64)), block_bytes=64 * 3, cancel_check=cancel_after(3))
+
+
+def test_large_resize_is_banded_and_cancellable():
+    side = int(CHUNKED_RESIZE_MIN_PIXELS ** 0.5) + 1
+    img = Image.new('L', (side, side))
+    with pytest.raises(OperationCancelled):
+        resize_to_target(img, (side // 3, side // 3), quality='exact', cancel_check=cancel_after(1))
+
+
+def test_load_and_resize_returns_none(tmp_path):
+    path = str(tmp_path / 'a.png')
+    Image.new('RGB', (300, 200), 'red').save(path)
+    assert load_and_resize_image(path, cancel_check=cancelled) is None
+
+
+@pytest.mark.parametrize('output_format, workers', [('png', 1), ('png', 2), ('jpeg', 1)])
+def test_save_removes_partial_file(tmp_path, output_format, workers):
+    path = str(tmp_path / f'colagem.{output_format}')
+    canvas = Image.effect_noise((900, 900), 64).convert('RGB')
+    with pytest.raises(OperationCancelled):
+        save_collage(canvas, path, output_format, encode_workers=workers, cancel_check=cancel_after(1))
+    assert not os.path.exists(path)
+
+
+def test_save_png_parallel_removes_partial_file(tmp_path):
+    path = str(tmp_path / 'colagem.png')
+    with pytest.raises(OperationCancelled):
+        save_png_parallel(Image.new('RGB', (50, 1000)), path, workers=2, strip_rows=100, cancel_check=cancel_after(4))
+    assert not os.path.exists(path)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = []
+    for index, color in enumerate(('red', 'green', 'blue', 'yellow')):
+        paths.append(str(tmp_path / f'{index}.png'))
+        Image.new('RGB', (120, 90), color).save(paths[-1])
+    return paths
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_pipeline_cancel_during_processing(tmp_path, sources, backend):
+    output_dir = tmp_path / 'saida'
+    pipeline = CollagePipeline(sources, str(output_dir), backend=backend, num_workers=2, cache_dir=None)
+    pipeline.progress_update.connect(lambda value, message: pipeline.cancel() if value > 0 else None)
+    errors = []
+    pipeline.error_occurred.connect(errors.append)
+    assert pipeline.run() is None
+    assert pipeline.is_cancelled and not errors
+    assert not output_dir.exists() or not os.listdir(output_dir)
+
+
+def test_pipeline_cancel_during_probe(tmp_path, sources):
+    output_dir = tmp_path / 'saida'
+    pipeline = CollagePipeline(sources, str(output_dir), num_workers=2, cache_dir=None)
+    pipeline.progress_update.connect(lambda value, message: pipeline.cancel()) # Primeiro aviso: 'Lendo cabeçalhos'
+    errors = []
+    pipeline.error_occurred.connect(errors.append)
+    assert pipeline.run() is None
+    assert not errors and not any(name == 'errors' for name, _ in pipeline.metrics.counters)
+    assert not output_dir.exists() or not os.listdir(output_dir)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Linha de comando em lote: sem PyQt5, trabalhos por entrada/--each/--jobs e códigos de saída."""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+import Collage_generator
+from Collage_generator import main, parse_memory_budget
+
+
+@pytest.fixture
+def albums(tmp_path):
+    for album, colors in (('praia', ['red', 'blue']), ('serra', ['green', 'yellow', 'purple'])):
+        (tmp_path / album).mkdir()
+        for color in colors:
+            Image.new('RGB', (200, 150), color).save(tmp_path / album / f'{color}.png')
+    return tmp_path
+
+
+def test_import_does_not_load_qt():
+    code = "import sys, Collage_generator; sys.exit('PyQt5' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(Collage_generator.__file__)).returncode == 0
+
+
+def test_single_job(albums):
+    output = albums / 'colagem.jpg'
+    assert main([str(albums / 'praia'), '-o', str(output), '-q']) == 0
+    with Image.open(output) as collage:
+        assert collage.format == 'JPEG'
+
+
+def test_each_creates_one_collage_per_album(albums):
+    output_dir = albums / 'saidas'
+    assert main([str(albums / '*/'), '--each', '-o', str(output_dir), '-q', '--layout', 'skyline']) == 0
+    assert len(list(output_dir.iterdir())) == 2
+
+
+def test_jobs_file_and_failures(albums, capsys):
+    jobs = albums / 'trabalhos.json'
+    jobs.write_text(json.dumps([
+        {'inputs': [str(albums / 'serra')], 'output': str(albums / 'serra.png'), 'layout_mode': 'justified'},
+        {'inputs': [str(albums / 'vazio')], 'output': str(albums / 'vazio.png')},
+    ]), encoding='utf-8')
+    assert main(['--jobs', str(jobs), '-q']) == 1 # Um dos trabalhos não tem imagens
+    assert (albums / 'serra.png').is_file()
+    assert 'Nenhuma imagem válida' in capsys.readouterr().err
+
+
+def test_invalid_pipeline_option(albums):
+    jobs = albums / 'trabalhos.json'
+    jobs.write_text(json.dumps([{'inputs': [str(albums / 'praia')], 'layout_mode': 'espiral'}]), encoding='utf-8')
+    assert main(['--jobs', str(jobs), '-q']) == 2
+
+
+def test_parse_memory_budget():
+    assert parse_memory_budget('auto') == 'auto'
+    assert parse_memory_budget('1536') == 1536
+    assert parse_memory_budget('4G') == 4 * 1024**3
+    for text in ('0', '-1M', 'muito'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_memory_budget(text)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Decodificação em modo 'fast' (draft de JPEG) sem mudar o hash de conteúdo."""
+
+import hashlib
+
+import pytest
+from PIL import Image
+
+from collage_core import CollagePipeline, open_image_reduced, load_and_resize_image, calculate_target_size
+
+
+@pytest.fixture
+def jpeg_and_png(tmp_path):
+    """Um JPEG e a regravação sem perdas (PNG) dos mesmos pixels, com o mesmo nome em pastas diferentes."""
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    jpeg, png = tmp_path / 'a' / 'foto', tmp_path / 'b' / 'foto'
+    Image.effect_noise((1600, 1200), 60).convert('RGB').save(jpeg, format='JPEG', quality=90)
+    with Image.open(jpeg) as img:
+        img.save(png, format='PNG')
+    return str(jpeg), str(png)
+
+
+def test_fast_decode_uses_draft(jpeg_and_png):
+    jpeg, _ = jpeg_and_png
+    fast, target_size = open_image_reduced(jpeg, quality='fast')
+    exact, _ = open_image_reduced(jpeg, quality='exact')
+    assert exact.size == (1600, 1200)
+    assert target_size == calculate_target_size((1600, 1200))
+    assert target_size[0] <= fast.width < exact.width # Reduzido no domínio DCT, nunca abaixo do alvo
+
+
+@pytest.mark.parametrize('quality', ['fast', 'exact'])
+def test_content_hash_ignores_decode_quality(jpeg_and_png, quality):
+    jpeg, png = jpeg_and_png
+    with Image.open(png) as img:
+        expected = hashlib.sha256(img.tobytes()).hexdigest()
+    for path in (jpeg, png):
+        info = load_and_resize_image(path, quality=quality)
+        assert info.content_hash == expected
+        assert info.resized_size == calculate_target_size((1600, 1200))
+
+
+def test_default_mode_dedupes_png_reencode(tmp_path, jpeg_and_png):
+    pipeline = CollagePipeline(list(jpeg_and_png), str(tmp_path / 'saida'), num_workers=1)
+    assert pipeline.run() is not None
+    dropped = {dict(labels).get('kind'): value for (name, labels), value in pipeline.metrics.counters.items()
+               if name == 'duplicates_dropped'}
+    assert sum(dropped.values()) == 1
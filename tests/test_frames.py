@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Arquivos com vários quadros (política de quadros) e leitura de TIFFs grandes por faixas."""
+
+import hashlib
+
+import pytest
+from PIL import Image, ImageChops
+
+import collage_core
+from collage_core import (CollagePipeline, decode_strips_reduced, frame_path, split_frame_path,
+                          strip_reduce_factor, new_content_hasher)
+
+
+@pytest.fixture
+def animated_gif(tmp_path):
+    path = tmp_path / 'anim.gif'
+    frames = [Image.new('RGB', (240, 160), color) for color in ('red', 'green', 'blue')]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=100)
+    return str(path)
+
+
+def test_frame_paths():
+    assert split_frame_path(frame_path('a/b.gif', 2)) == ('a/b.gif', 2)
+    assert split_frame_path(frame_path('a/b.gif', collage_core.FRAME_SHEET)) == ('a/b.gif', collage_core.FRAME_SHEET)
+    assert split_frame_path('a/b.gif') == ('a/b.gif', 0)
+    assert split_frame_path('a/b#quadro=x.gif') == ('a/b#quadro=x.gif', 0)
+
+
+@pytest.mark.parametrize('frame_policy, decoded', [('first', 1), ('all', 3), ('sheet', 1)])
+def test_frame_policy(tmp_path, animated_gif, frame_policy, decoded):
+    pipeline = CollagePipeline([animated_gif], str(tmp_path / 'saida'), num_workers=1, frame_policy=frame_policy)
+    output_path = pipeline.run()
+    assert output_path is not None
+    counters = {name: value for (name, _), value in pipeline.metrics.counters.items()}
+    assert counters['images_decoded'] == decoded
+    if frame_policy == 'sheet':
+        with Image.open(output_path) as collage:
+            colors = {collage.convert('RGB').getpixel((x, y)) for x in range(0, collage.width, 8)
+                      for y in range(0, collage.height, 8)}
+        assert {(255, 0, 0), (0, 128, 0), (0, 0, 255)} <= colors # Os três quadros na folha
+
+
+@pytest.mark.parametrize('compression', ['raw', 'tiff_deflate', 'packbits'])
+@pytest.mark.parametrize('mode', ['RGB', 'L', 'RGBA'])
+def test_strip_decode_matches_full_decode(tmp_path, compression, mode):
+    source = Image.effect_noise((517, 389), 60).convert(mode)
+    path = tmp_path / 'grande.tif'
+    source.save(path, compression=compression, rowsperstrip=37)
+    hasher = new_content_hasher('sha256')
+    with Image.open(path) as img:
+        reduced = decode_strips_reduced(img, 4, hasher, band_bytes=20000)
+    expected = source.convert(collage_core.collage_mode_for(mode)).reduce(4)
+    assert reduced.size == expected.size
+    assert ImageChops.difference(reduced, expected).getbbox() is None
+    assert hasher.hexdigest() == hashlib.sha256(source.tobytes()).hexdigest()
+
+
+def test_strip_decode_only_for_large_images(tmp_path, monkeypatch):
+    path = tmp_path / 'grande.tif'
+    Image.new('RGB', (800, 600)).save(path)
+    with Image.open(path) as img:
+        assert strip_reduce_factor(img, (200, 150)) == 0 # Abaixo de STRIP_DECODE_MIN_BYTES
+        monkeypatch.setattr(collage_core, 'STRIP_DECODE_MIN_BYTES', 1)
+        assert strip_reduce_factor(img, (200, 150)) == 4
+        assert strip_reduce_factor(img, (500, 400)) == 0 # Menos de 2x maior que o alvo
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""hash_image_pixels: mesmo resultado que hash(img.tobytes()), com ou sem o encoder raw do Pillow."""
+
+import hashlib
+
+import pytest
+from PIL import Image
+
+import collage_core
+from collage_core import hash_image_pixels, new_content_hasher, feed_image_pixels
+
+MODES = ['RGB', 'RGBA', 'L', 'LA', 'P', '1', 'I', 'I;16', 'F', 'CMYK']
+
+
+@pytest.fixture(scope='module')
+def noise():
+    return Image.effect_noise((257, 131), 80)
+
+
+def _expected(img):
+    return hashlib.sha256(img.tobytes()).hexdigest()
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_matches_tobytes(noise, mode):
+    img = noise.convert(mode)
+    assert hash_image_pixels(img, 'sha256', block_bytes=1000) == _expected(img)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'P', 'I;16'])
+def test_fallback_without_pillow_internals(noise, monkeypatch, mode):
+    monkeypatch.setattr(collage_core, '_open_raw_encoder', lambda img: None)
+    collage_core._raw_encoder_matches.cache_clear()
+    try:
+        img = noise.convert(mode)
+        assert not collage_core._raw_encoder_matches(mode)
+        assert hash_image_pixels(img, 'sha256', block_bytes=1000) == _expected(img)
+    finally:
+        collage_core._raw_encoder_matches.cache_clear()
+
+
+def test_consecutive_strips_hash_like_whole_image(noise):
+    img = noise.convert('RGB')
+    hasher = new_content_hasher('sha256')
+    for top in range(0, img.height, 50):
+        feed_image_pixels(hasher, img.crop((0, top, img.width, min(top + 50, img.height))))
+    assert hasher.hexdigest() == _expected(img)
+
+
+def test_prefixed_algorithms(noise):
+    img = noise.convert('RGB')
+    assert hash_image_pixels(img, 'blake2b') == 'blake2b:' + hashlib.blake2b(img.tobytes(), digest_size=32).hexdigest()
+    with pytest.raises(ValueError):
+        hash_image_pixels(img, 'md5')
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Pré-filtragem de arquivos idênticos: grupos byte a byte e a regra conteúdo OU nome."""
+
+import os
+
+from collage_core import CollagePipeline, find_identical_files, PARTIAL_HASH_BLOCK
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_groups_only_identical_bytes(tmp_path):
+    paths = [_write(tmp_path / 'a', b'x' * 100), _write(tmp_path / 'b', b'x' * 100),
+             _write(tmp_path / 'c', b'y' * 100), _write(tmp_path / 'd', b'x' * 99)]
+    assert [sorted(group) for group in find_identical_files(paths, max_workers=2)] == [[0, 1]]
+
+
+def test_large_files_differing_only_in_the_middle(tmp_path):
+    head = os.urandom(PARTIAL_HASH_BLOCK)
+    tail = os.urandom(PARTIAL_HASH_BLOCK)
+    paths = [_write(tmp_path / name, head + middle + tail)
+             for name, middle in (('a', b'1' * 1000), ('b', b'2' * 1000), ('c', b'1' * 1000))]
+    assert [sorted(group) for group in find_identical_files(paths)] == [[0, 2]]
+
+
+def test_missing_file_is_ignored(tmp_path):
+    paths = [_write(tmp_path / 'a', b'z' * 10), str(tmp_path / 'sumiu'), _write(tmp_path / 'b', b'z' * 10)]
+    assert [sorted(group) for group in find_identical_files(paths)] == [[0, 2]]
+
+
+def test_copy_dropped_only_when_neither_oldest_content_nor_name(tmp_path):
+    data = b'\x89PNG fake'
+    original = _write(tmp_path / 'a' / 'foto.png', data)
+    same_name = _write(tmp_path / 'b' / 'foto.png', data)
+    new_name = _write(tmp_path / 'b' / 'outra.png', data)
+    other = _write(tmp_path / 'b' / 'diferente.png', b'outro conteudo')
+    pipeline = CollagePipeline([original, same_name, new_name, other], str(tmp_path / 'saida'), num_workers=1)
+    pipeline._drop_identical_files()
+    assert pipeline.paths_to_process == [original, new_name, other]
+    assert pipeline.pre_dropped_count == 1
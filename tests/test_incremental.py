@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Modo incremental: estado salvo entre execuções, só as imagens novas são processadas."""
+
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from collage_core import (CollagePipeline, incremental_state_path, load_incremental_state, save_incremental_state,
+                          INCREMENTAL_STATE_VERSION)
+
+COLORS = ['red', 'green', 'blue', 'yellow', 'purple', 'orange']
+
+
+@pytest.fixture
+def folder(tmp_path):
+    directory = tmp_path / 'fotos'
+    directory.mkdir()
+    return directory
+
+
+def _add_images(folder, names):
+    for name in names:
+        Image.new('RGB', (400, 300), COLORS[len(os.listdir(folder)) % len(COLORS)]).save(folder / f'{name}.png')
+
+
+def _run(folder, save_dir, layout_mode='skyline'):
+    paths = sorted(str(path) for path in folder.iterdir())
+    pipeline = CollagePipeline(paths, str(save_dir), num_workers=1, incremental=True, layout_mode=layout_mode)
+    return pipeline, pipeline.run()
+
+
+def _counter(pipeline, counter):
+    return sum(value for (name, _), value in pipeline.metrics.counters.items() if name == counter)
+
+
+def test_state_roundtrip(tmp_path, capsys):
+    state_path = incremental_state_path(str(tmp_path / 'colagem.png'))
+    assert state_path.endswith('colagem.estado.json')
+    assert load_incremental_state(state_path) is None
+    save_incremental_state(state_path, {'version': INCREMENTAL_STATE_VERSION, 'seen': ['a']})
+    assert load_incremental_state(state_path)['seen'] == ['a']
+    assert os.listdir(tmp_path) == ['colagem.estado.json'] # Sem temporários sobrando
+
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': INCREMENTAL_STATE_VERSION + 1}, f)
+    assert load_incremental_state(state_path) is None
+    with open(state_path, 'w', encoding='utf-8') as f:
+        f.write('{quebrado')
+    assert load_incremental_state(state_path) is None
+    assert 'Aviso' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('layout_mode', ['grid', 'justified', 'skyline'])
+def test_second_run_appends_new_images(folder, tmp_path, layout_mode):
+    _add_images(folder, ['a', 'b', 'c'])
+    first, output_path = _run(folder, tmp_path, layout_mode)
+    assert output_path is not None
+    state = load_incremental_state(incremental_state_path(output_path))
+    assert len(state['cells']) == 3 and len(state['seen']) == 3
+    with Image.open(output_path) as previous:
+        previous_collage = previous.copy()
+
+    _add_images(folder, ['d'])
+    second, output_path = _run(folder, tmp_path, layout_mode)
+    assert _counter(second, 'images_skipped') == 3
+    assert second.paths_to_process == [str(folder / 'd.png')]
+    new_state = load_incremental_state(incremental_state_path(output_path))
+    assert len(new_state['cells']) == 4 and len(new_state['seen']) == 4
+    assert [cell['path'] for cell in new_state['cells'][:3]] == [cell['path'] for cell in state['cells']]
+    # Células que não mudaram de lugar nem de tamanho mantêm os pixels da colagem anterior
+    with Image.open(output_path) as collage:
+        for old, new in zip(state['cells'], new_state['cells']):
+            if old['placement'] == new['placement']:
+                x, y, w, h = old['placement']
+                assert collage.getpixel((x + w // 2, y + h // 2)) == previous_collage.getpixel((x + w // 2, y + h // 2))
+
+
+def test_no_new_images_leaves_collage_untouched(folder, tmp_path):
+    _add_images(folder, ['a', 'b'])
+    _, output_path = _run(folder, tmp_path)
+    modified = os.path.getmtime(output_path)
+    again, same_path = _run(folder, tmp_path)
+    assert same_path == output_path
+    assert os.path.getmtime(output_path) == modified
+    assert _counter(again, 'images_decoded') == 0
+
+
+def test_changed_settings_rebuild_everything(folder, tmp_path):
+    _add_images(folder, ['a', 'b', 'c'])
+    _run(folder, tmp_path, 'skyline')
+    _add_images(folder, ['d'])
+    rebuilt, output_path = _run(folder, tmp_path, 'justified')
+    assert _counter(rebuilt, 'images_decoded') == 4
+    assert len(load_incremental_state(incremental_state_path(output_path))['cells']) == 4
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""CollageJobQueue: orçamento global de workers entre colagens simultâneas."""
+
+from collage_core import CollageJobQueue
+
+
+def _submit(queue, images=10, **options):
+    return queue.submit([f'{index}.jpg' for index in range(images)], 'saida', **options)
+
+
+def test_lone_job_gets_the_whole_budget():
+    queue = CollageJobQueue(worker_budget=8, max_concurrent=2)
+    job = _submit(queue)
+    assert queue.start_ready() == [job]
+    assert job.workers == 8
+    assert queue.pipeline_options(job)['num_workers'] == 8
+
+
+def test_jobs_waiting_together_share_the_budget():
+    queue = CollageJobQueue(worker_budget=8, max_concurrent=2)
+    first, second, third = _submit(queue), _submit(queue), _submit(queue)
+    assert queue.start_ready() == [first, second]
+    assert (first.workers, second.workers) == (4, 4)
+    queue.finish(first)
+    assert queue.start_ready() == [third]
+    assert third.workers == 4 # Só o que o primeiro liberou
+
+
+def test_later_job_waits_for_free_workers():
+    queue = CollageJobQueue(worker_budget=8, max_concurrent=2)
+    first = _submit(queue)
+    queue.start_ready()
+    second = _submit(queue)
+    assert queue.start_ready() == []
+    queue.finish(first)
+    assert queue.start_ready() == [second] and second.workers == 8
+
+
+def test_grant_is_capped_by_request_and_size():
+    queue = CollageJobQueue(worker_budget=8, max_concurrent=2)
+    small, requested = _submit(queue, images=3), _submit(queue, num_workers=2)
+    queue.start_ready()
+    assert (small.workers, requested.workers) == (3, 2)
+
+
+def test_exclusive_key_runs_one_at_a_time():
+    queue = CollageJobQueue(worker_budget=8, max_concurrent=2)
+    first, second = _submit(queue, exclusive_key='a'), _submit(queue, exclusive_key='a')
+    assert queue.start_ready() == [first]
+    assert first.workers == 8 # O outro não poderia rodar junto
+    queue.finish(first)
+    assert queue.start_ready() == [second]
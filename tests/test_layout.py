@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Layouts grid/justified/skyline: todas as imagens posicionadas, dentro da tela, sem sobreposição."""
+
+import random
+
+import pytest
+
+from collage_core import compute_grid_layout, compute_justified_layout, compute_skyline_layout
+
+
+@pytest.fixture(scope='module')
+def sizes():
+    rng = random.Random(7)
+    return [(rng.randint(40, 400), rng.randint(40, 400)) for _ in range(60)] + [(1600, 90)] # Um panorama
+
+
+def _check_packing(layout, count):
+    assert len(layout.placements) == count
+    for x, y, w, h in layout.placements:
+        assert w > 0 and h > 0
+        assert 0 <= x and x + w <= layout.width
+        assert 0 <= y and y + h <= layout.height
+    boxes = sorted(layout.placements)
+    for i, (x, y, w, h) in enumerate(boxes):
+        for other_x, other_y, other_w, other_h in boxes[i + 1:]:
+            if other_x >= x + w:
+                break # Ordenadas por x: as seguintes começam ainda mais à direita
+            assert y + h <= other_y or other_y + other_h <= y, "imagens sobrepostas"
+
+
+def _check_bands(layout):
+    assert layout.bands[0][0] == 0 and layout.bands[-1][1] == layout.height
+    for (_, end), (start, _) in zip(layout.bands, layout.bands[1:]):
+        assert end == start
+
+
+def test_grid(sizes):
+    cell = (max(w for w, _ in sizes), max(h for _, h in sizes))
+    layout = compute_grid_layout(sizes, 8, 8, *cell)
+    _check_packing(layout, len(sizes))
+    _check_bands(layout)
+    assert (layout.width, layout.height) == (8 * cell[0], 8 * cell[1])
+
+
+def test_justified_rows_fill_width(sizes):
+    layout = compute_justified_layout(sizes)
+    _check_packing(layout, len(sizes))
+    _check_bands(layout)
+    for top, bottom in layout.bands[:-1]:
+        row = [(x, w) for x, y, w, _ in layout.placements if y == top]
+        assert row[0][0] == 0
+        assert max(x + w for x, w in row) == layout.width # Linhas completas fecham a largura exata
+
+
+def test_justified_append_changes_only_last_row(sizes):
+    first = compute_justified_layout(sizes[:40])
+    resumed = compute_justified_layout(sizes, **first.resume)
+    closed = [placement for placement in first.placements if placement[1] < first.bands[-1][0]]
+    assert resumed.placements[:len(closed)] == closed
+
+
+def test_skyline(sizes):
+    layout = compute_skyline_layout(sizes, band_height=128)
+    _check_packing(layout, len(sizes))
+    _check_bands(layout)
+    assert all(w == size[0] and h == size[1] for (_, _, w, h), size in zip(layout.placements, sizes))
+    assert layout.fill_ratio > 0.6
+
+
+def test_skyline_resume_keeps_placed(sizes):
+    # O pipeline refaz o layout quando uma nova imagem é mais larga que a tela (o panorama)
+    sizes = sizes[:-1]
+    first = compute_skyline_layout(sizes[:40])
+    resumed = compute_skyline_layout(sizes, width=first.resume['width'], placed=first.placements,
+                                     skyline=first.resume['skyline'])
+    assert resumed.placements[:40] == first.placements
+    assert resumed.width == first.width
+    _check_packing(resumed, len(sizes))
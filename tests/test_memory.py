@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Orçamento de memória: leitura da RAM disponível."""
+
+import os
+
+import pytest
+
+import collage_core
+from collage_core import available_memory_bytes
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/meminfo'), reason="Sem /proc/meminfo")
+def test_uses_mem_available_without_psutil(monkeypatch):
+    monkeypatch.setattr(collage_core, 'psutil', None)
+    with open('/proc/meminfo') as f:
+        fields = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in f}
+    available = available_memory_bytes()
+    # MemAvailable oscila um pouco entre as leituras; MemFree costuma ficar bem abaixo
+    assert abs(available - fields['MemAvailable']) < 64 * 1024**2
+    assert available >= fields['MemFree'] - 64 * 1024**2
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Instrumentação: resumo do trabalho, picos de memória e perfil (global ao processo)."""
+
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from collage_core import CollagePipeline, CallbackSink, MetricsRecorder
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = []
+    for index in range(4):
+        paths.append(str(tmp_path / f'{index}.png'))
+        Image.new('RGB', (200, 150), (index * 60, 0, 0)).save(paths[-1])
+    return paths
+
+
+def test_summary_has_stages_counters_and_job_memory(tmp_path, sources):
+    summaries = []
+    sink = CallbackSink(lambda event: summaries.append(event) if event['type'] == 'summary' else None)
+    pipeline = CollagePipeline(sources, str(tmp_path / 'saida'), num_workers=1, metrics_sinks=[sink])
+    assert pipeline.run() is not None
+    summary, = summaries
+    assert summary['status'] == 'ok'
+    assert {'probe', 'process', 'dedup', 'layout', 'encode'} <= set(summary['stages'])
+    counters = {counter['name']: counter['value'] for counter in summary['counters'] if not counter['labels']}
+    assert counters['images_input'] == 4 and counters['images_decoded'] == 4
+    memory = summary['memory']
+    if memory['rss'] is not None:
+        assert 0 < memory['rss_start'] <= memory['rss']
+
+
+def test_memory_peak_is_scoped_to_the_job():
+    ballast = bytearray(64 * 1024**2) # Pico anterior ao trabalho
+    ballast[::4096] = b'\x01' * len(ballast[::4096])
+    del ballast
+    recorder = MetricsRecorder('teste')
+    recorder.start_memory_sampling(interval=0.01)
+    summary = recorder.close('ok')
+    if summary['memory']['rss'] is None:
+        pytest.skip("RSS atual indisponível nesta plataforma")
+    assert summary['memory']['rss'] < summary['memory']['rss_lifetime']
+
+
+def test_only_one_job_is_profiled_at_a_time(tmp_path, sources):
+    first = CollagePipeline(sources, str(tmp_path / 'a'), num_workers=1, profile_mode='tracemalloc')
+    second = CollagePipeline(sources, str(tmp_path / 'b'), num_workers=1, profile_mode='tracemalloc')
+    started, release = threading.Event(), threading.Event()
+    def hold(value, message): # Segura o primeiro trabalho rodando enquanto o segundo começa
+        if not started.is_set():
+            started.set()
+            release.wait(30)
+    first.progress_update.connect(hold)
+    runner = threading.Thread(target=first.run)
+    runner.start()
+    assert started.wait(30)
+    try:
+        assert second.run() is not None
+    finally:
+        release.set()
+        runner.join(30)
+    assert os.path.exists(tmp_path / 'a' / f'perfil_{first.job_id}_tracemalloc.txt')
+    assert not os.path.exists(tmp_path / 'b' / f'perfil_{second.job_id}_tracemalloc.txt')
+    assert CollagePipeline._profiling_job is None and CollagePipeline._running_jobs == 0
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Saídas faixa por faixa: PNG em faixas igual à tela única e pirâmide Deep Zoom completa."""
+
+import math
+import os
+
+import pytest
+from PIL import Image, ImageChops
+
+from collage_core import CollagePipeline, DeepZoomWriter
+
+
+@pytest.fixture(scope='module')
+def paths(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('fotos')
+    paths = []
+    for index, size in enumerate([(600, 400), (400, 600), (500, 500), (800, 300), (300, 300)]):
+        path = directory / f'{index}.png'
+        Image.effect_noise(size, 30 + 15 * index).convert('RGB').save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_dzi_pyramid(tmp_path):
+    canvas = Image.effect_noise((700, 300), 60).convert('RGB')
+    writer = DeepZoomWriter(str(tmp_path / 'c.dzi'), *canvas.size, tile_size=128, tile_format='png')
+    for top in range(0, canvas.height, 70): # Faixas que não coincidem com os tiles
+        writer.write_strip(canvas.crop((0, top, canvas.width, min(top + 70, canvas.height))))
+    assert writer.close() == str(tmp_path / 'c.dzi')
+
+    files_dir = tmp_path / 'c_files'
+    assert sorted(int(level) for level in os.listdir(files_dir)) == list(range(writer.max_level + 1))
+    assert writer.max_level == math.ceil(math.log2(700))
+    top_level = files_dir / str(writer.max_level)
+    assert len(os.listdir(top_level)) == math.ceil(700 / 128) * math.ceil(300 / 128)
+    with Image.open(top_level / '1_2.png') as tile:
+        assert ImageChops.difference(tile, canvas.crop((128, 256, 256, 300))).getbbox() is None
+    with Image.open(files_dir / '0' / '0_0.png') as tile:
+        assert tile.size == (1, 1)
+    assert 'Width="700" Height="300"' in (tmp_path / 'c.dzi').read_text(encoding='utf-8')
+
+
+def test_dzi_rejects_incomplete(tmp_path):
+    writer = DeepZoomWriter(str(tmp_path / 'c.dzi'), 100, 100)
+    writer.write_strip(Image.new('RGB', (100, 40)))
+    with pytest.raises(ValueError):
+        writer.close()
+    writer.abort()
+    assert not os.path.exists(tmp_path / 'c_files')
+
+
+@pytest.mark.parametrize('layout_mode', ['grid', 'skyline'])
+def test_png_strips_matches_single(tmp_path, paths, layout_mode):
+    outputs = {}
+    for engine in ('single', 'png-strips'):
+        pipeline = CollagePipeline(paths, str(tmp_path / engine), num_workers=1, output_engine=engine,
+                                   layout_mode=layout_mode)
+        outputs[engine] = pipeline.run()
+        assert outputs[engine] is not None
+    with Image.open(outputs['single']) as single, Image.open(outputs['png-strips']) as strips:
+        assert single.size == strips.size
+        assert ImageChops.difference(single, strips.convert(single.mode)).getbbox() is None
+
+
+def test_pipeline_dzi_output(tmp_path, paths):
+    pipeline = CollagePipeline(paths, str(tmp_path), num_workers=1, output_engine='dzi')
+    output_path = pipeline.run()
+    assert output_path.endswith('.dzi') and os.path.isfile(output_path)
+    files_dir = os.path.splitext(output_path)[0] + '_files'
+    assert os.path.isfile(os.path.join(files_dir, '0', '0_0.jpg'))
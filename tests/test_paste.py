@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Colagem: miniaturas RGBA chegam compostas sobre preto e a montagem só copia pixels RGB."""
+
+from PIL import Image, ImageChops
+
+from collage_core import CollagePipeline, flatten_over_black, load_and_resize_image
+
+
+def _translucent(size=(300, 200)):
+    img = Image.effect_noise(size, 70).convert('RGBA')
+    img.putalpha(Image.linear_gradient('L').resize(size))
+    return img
+
+
+def test_flatten_matches_masked_paste():
+    img = _translucent()
+    expected = Image.new('RGB', img.size, (0, 0, 0))
+    expected.paste(img, (0, 0), img)
+    flat = flatten_over_black(img)
+    assert flat.mode == 'RGB'
+    assert ImageChops.difference(flat, expected).getbbox() is None
+
+
+def test_workers_deliver_rgb(tmp_path):
+    path = tmp_path / 'alfa.png'
+    _translucent().save(path)
+    info = load_and_resize_image(str(path))
+    assert info.resized_image.mode == 'RGB'
+
+
+def test_transparent_areas_end_up_black(tmp_path):
+    img = Image.new('RGBA', (400, 200), (200, 120, 40, 255))
+    img.paste((255, 255, 255, 0), (0, 0, 200, 200)) # Metade esquerda transparente (cor escondida branca)
+    path = tmp_path / 'alfa.png'
+    img.save(path)
+    output_path = CollagePipeline([str(path)], str(tmp_path / 'saida'), num_workers=1).run()
+    with Image.open(output_path) as collage:
+        collage = collage.convert('RGB')
+        width, height = collage.size
+        assert collage.getpixel((width // 8, height // 2)) == (0, 0, 0)
+        assert collage.getpixel((width * 7 // 8, height // 2)) == (200, 120, 40)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Filtragem perceptual: busca na árvore BK e descarte de versões redimensionadas/reencodadas."""
+
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from collage_core import BKTree, CollagePipeline, compute_perceptual_hash, hamming_distance
+
+np = pytest.importorskip('numpy')
+
+
+def _scene(seed):
+    rng = random.Random(seed)
+    img = Image.linear_gradient('L').resize((640, 480)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(600), rng.randrange(440)
+        draw.ellipse((x, y, x + rng.randint(40, 200), y + rng.randint(40, 200)),
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    return img
+
+
+def test_bktree_matches_brute_force():
+    rng = random.Random(3)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    for _ in range(200):
+        query = rng.choice(values) ^ (1 << rng.randrange(64)) if rng.random() < 0.5 else rng.getrandbits(64)
+        found = tree.find_within(query, 10)
+        if found is None:
+            assert all(hamming_distance(query, value) > 10 for value in values)
+        else:
+            assert hamming_distance(query, values[found]) <= 10
+
+
+def test_empty_tree():
+    assert BKTree().find_within(0, 64) is None
+
+
+@pytest.mark.parametrize('method', ['dhash', 'phash'])
+def test_hash_survives_resize_and_jpeg(tmp_path, method):
+    original = _scene(1)
+    path = tmp_path / 'copia.jpg'
+    original.resize((320, 240)).save(path, quality=70)
+    with Image.open(path) as reencoded:
+        near = hamming_distance(compute_perceptual_hash(original, method), compute_perceptual_hash(reencoded, method))
+    far = hamming_distance(compute_perceptual_hash(original, method), compute_perceptual_hash(_scene(2), method))
+    assert near <= 6 < far
+
+
+def test_invalid_method():
+    with pytest.raises(ValueError):
+        compute_perceptual_hash(_scene(1), 'ahash')
+
+
+def test_pipeline_drops_near_duplicate(tmp_path):
+    paths = [str(tmp_path / name) for name in ('a.png', 'b.jpg', 'c.png')]
+    _scene(1).save(paths[0])
+    _scene(1).resize((480, 360)).save(paths[1], quality=80)
+    _scene(2).save(paths[2])
+    pipeline = CollagePipeline(paths, str(tmp_path / 'saida'), num_workers=1, perceptual_hash='dhash')
+    output_path = pipeline.run()
+    assert output_path is not None
+    dropped = {dict(labels).get('kind'): value for (name, labels), value in pipeline.metrics.counters.items()
+               if name == 'duplicates_dropped'}
+    assert dropped.get('perceptual') == 1
+    with Image.open(output_path) as collage:
+        assert collage.size == (640, 240) # Só duas imagens na grade
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""PngStripWriter / save_png_parallel: o PNG lido de volta tem exatamente os pixels gravados."""
+
+import pytest
+from PIL import Image
+
+import collage_core
+from collage_core import PngStripWriter, save_png_parallel, save_collage, png_encode_workers
+
+
+@pytest.fixture
+def canvas():
+    # Ruído + gradiente: exercita os filtros por linha e blocos deflate não triviais
+    noise = Image.effect_noise((333, 517), 64).convert('RGB')
+    return Image.blend(noise, Image.linear_gradient('L').resize((333, 517)).convert('RGB'), 0.5)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_save_png_parallel_round_trip(tmp_path, canvas, workers):
+    path = str(tmp_path / 'saida.png')
+    save_png_parallel(canvas, path, compress_level=6, workers=workers, strip_rows=64)
+    with Image.open(path) as saved:
+        saved.load()
+        assert (saved.mode, saved.size) == ('RGB', canvas.size)
+        assert saved.tobytes() == canvas.tobytes()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_strip_writer_uneven_strips(tmp_path, canvas, workers):
+    path = str(tmp_path / 'faixas.png')
+    writer = PngStripWriter(path, canvas.width, canvas.height, compress_level=1, workers=workers)
+    for top, bottom in ((0, 1), (1, 200), (200, 201), (201, canvas.height)):
+        writer.write_strip(canvas.crop((0, top, canvas.width, bottom)).convert('RGBA'))
+    writer.close()
+    with Image.open(path) as saved:
+        assert saved.convert('RGB').tobytes() == canvas.tobytes()
+
+
+def test_strip_writer_rejects_incomplete(tmp_path):
+    writer = PngStripWriter(str(tmp_path / 'curto.png'), 10, 10)
+    writer.write_strip(Image.new('RGB', (10, 4)))
+    with pytest.raises(ValueError):
+        writer.close()
+    writer.abort()
+    assert not (tmp_path / 'curto.png').exists()
+
+
+def test_save_collage_uses_parallel_encoder(tmp_path, canvas):
+    path = str(tmp_path / 'colagem.png')
+    save_collage(canvas, path, 'png', encode_workers=2)
+    with Image.open(path) as saved:
+        assert saved.tobytes() == canvas.tobytes()
+
+
+def test_default_workers_choose_pillow_unless_worth_it(monkeypatch):
+    large = (8000, 8000)
+    assert png_encode_workers((1000, 1000)) == 1
+    assert png_encode_workers((1000, 1000), 3) == 3 # Pedido explícito vale sempre
+    monkeypatch.setattr(collage_core, 'np', None) # Sem NumPy as linhas não seriam filtradas
+    assert png_encode_workers(large) == 1
+    assert png_encode_workers(large, 4) == 4
+
+
+def test_save_collage_defaults_to_pillow(tmp_path, canvas, monkeypatch):
+    def parallel(*args, **kwargs):
+        raise AssertionError("encoder paralelo usado numa imagem pequena")
+    monkeypatch.setattr(collage_core, 'save_png_parallel', parallel)
+    path = str(tmp_path / 'colagem.png')
+    save_collage(canvas, path, 'png')
+    with Image.open(path) as saved:
+        assert saved.tobytes() == canvas.tobytes()
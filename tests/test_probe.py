@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Sondagem de cabeçalhos (nada de decodificar pixels) e plano da colagem antes da decodificação."""
+
+import shutil
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+import collage_core
+from collage_core import (CollagePipeline, probe_image, probe_images, ImageProbe, OperationCancelled,
+                          EXIF_ORIENTATION_TAG, calculate_target_size)
+
+
+def _rotated_exif():
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = 6 # Girar 90° no sentido horário
+    return exif
+
+
+@pytest.fixture
+def png_loads(monkeypatch):
+    """Registra as chamadas a PngImageFile.load (quem decodifica os pixels)."""
+    calls = []
+    original = PngImagePlugin.PngImageFile.load
+    def load(self):
+        calls.append(self.filename)
+        return original(self)
+    monkeypatch.setattr(PngImagePlugin.PngImageFile, 'load', load)
+    return calls
+
+
+def test_png_probe_does_not_decode(tmp_path, png_loads):
+    path = tmp_path / 'grande.png'
+    Image.new('RGB', (640, 480), 'red').save(path)
+    probe = probe_image(str(path))
+    assert isinstance(probe, ImageProbe), probe
+    assert probe.size == (640, 480)
+    assert probe.orientation == 1
+    assert probe.target_size == calculate_target_size((640, 480))
+    assert png_loads == []
+
+
+def test_png_exif_before_idat_is_honoured(tmp_path, png_loads):
+    path = tmp_path / 'girada.png'
+    Image.new('RGB', (40, 20)).save(path, exif=_rotated_exif()) # O Pillow grava o eXIf antes do IDAT
+    probe = probe_image(str(path))
+    assert isinstance(probe, ImageProbe), probe
+    assert (probe.orientation, probe.size) == (6, (20, 40))
+    assert png_loads == []
+
+
+def test_jpeg_orientation(tmp_path):
+    path = tmp_path / 'girada.jpg'
+    Image.new('RGB', (40, 20)).save(path, exif=_rotated_exif())
+    probe = probe_image(str(path))
+    assert (probe.orientation, probe.size) == (6, (20, 40))
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_probe_images_honours_cancel(tmp_path, max_workers):
+    paths = []
+    for index in range(3):
+        paths.append(str(tmp_path / f'{index}.png'))
+        Image.new('RGB', (10, 10)).save(paths[-1])
+    with pytest.raises(OperationCancelled):
+        probe_images(paths, max_workers=max_workers, cancel_check=lambda: True)
+
+
+# --- Plano antes de decodificar ---
+@pytest.fixture
+def little_memory(monkeypatch):
+    monkeypatch.setattr(collage_core, 'available_memory_bytes', lambda: 20 * 1024**2)
+
+
+def _pipeline(paths, output_dir, **options):
+    pipeline = CollagePipeline(paths, str(output_dir), num_workers=1, **options)
+    errors = []
+    pipeline.error_occurred.connect(errors.append)
+    return pipeline, errors
+
+
+def test_plan_counts_only_files_left_by_pre_dedup(tmp_path, little_memory):
+    source = tmp_path / 'foto.png'
+    Image.effect_noise((2000, 2000), 40).convert('RGB').save(source)
+    paths = [str(source)]
+    for index in range(8): # 3x3 cópias: a grade planejada (27 MB) não caberia nos 20 MB
+        copy = tmp_path / str(index) / 'foto.png'
+        copy.parent.mkdir()
+        shutil.copyfile(source, copy)
+        paths.append(str(copy))
+    pipeline, errors = _pipeline(paths, tmp_path / 'saida')
+    assert pipeline.run() is not None and not errors
+    assert pipeline.pre_dropped_count == 8
+
+
+@pytest.fixture
+def distinct_images(tmp_path):
+    paths = []
+    for index in range(9):
+        paths.append(str(tmp_path / f'{index}.png'))
+        Image.new('RGB', (2000, 2000), (index * 25, 0, 0)).save(paths[-1])
+    return paths
+
+
+def test_auto_engine_falls_back_to_strips(tmp_path, little_memory, distinct_images):
+    pipeline, errors = _pipeline(distinct_images, tmp_path / 'saida')
+    final_path = pipeline.run()
+    assert final_path is not None and not errors
+    with Image.open(final_path) as collage:
+        assert collage.size == (3000, 3000)
+
+
+def test_explicit_single_is_rejected(tmp_path, little_memory, distinct_images):
+    pipeline, errors = _pipeline(distinct_images, tmp_path / 'saida', output_engine='single')
+    assert pipeline.run() is None
+    assert len(errors) == 1 and 'Trabalho rejeitado' in errors[0]
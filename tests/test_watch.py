@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Modo vigia: validação das opções e lotes que viram colagens."""
+
+import shutil
+import threading
+
+import pytest
+from PIL import Image
+
+import collage_core
+from collage_core import CollageWatchDaemon, validate_pipeline_options
+
+
+@pytest.fixture
+def folders(tmp_path):
+    watched, output = tmp_path / 'entrada', tmp_path / 'saida'
+    watched.mkdir()
+    return watched, output
+
+
+def test_options_are_validated_without_building_a_pipeline(folders, monkeypatch):
+    def no_pipeline(*args, **kwargs):
+        raise AssertionError("CollagePipeline criado só para validar opções")
+    monkeypatch.setattr(collage_core.CollagePipeline, '__init__', no_pipeline)
+    watched, output = folders
+    CollageWatchDaemon([str(watched)], str(output), layout_mode='skyline', num_workers=2)
+    with pytest.raises(ValueError):
+        CollageWatchDaemon([str(watched)], str(output), layout_mode='espiral')
+    with pytest.raises(TypeError):
+        CollageWatchDaemon([str(watched)], str(output), layuot_mode='grid')
+
+
+def test_validate_pipeline_options_applies_preset():
+    assert validate_pipeline_options(save_preset='fast') == ('png', 1)
+    with pytest.raises(ValueError):
+        validate_pipeline_options(incremental=True, output_engine='dzi')
+
+
+def test_output_inside_watched_folder_is_refused(folders):
+    watched, _ = folders
+    with pytest.raises(ValueError):
+        CollageWatchDaemon([str(watched)], str(watched / 'colagens'), recursive=True)
+
+
+def test_batches_become_collages_without_repeating_images(folders):
+    watched, output = folders
+    for index in range(2):
+        Image.new('RGB', (120, 90), (index * 100, 50, 0)).save(watched / f'{index}.png')
+    daemon = CollageWatchDaemon([str(watched)], str(output), recursive=True, watch_mode='poll', poll_interval=0.05,
+                                batch_window=0.2, include_existing=True, num_workers=2)
+    finished = []
+    collage_ready = threading.Semaphore(0)
+    daemon.collage_finished.connect(lambda job, path: (finished.append(path), collage_ready.release()))
+    runner = threading.Thread(target=daemon.run)
+    runner.start()
+    try:
+        assert collage_ready.acquire(timeout=30)
+        (watched / 'copia').mkdir() # Mesmo conteúdo e nome de um que já entrou: não se repete
+        shutil.copyfile(watched / '0.png', watched / 'copia' / '0.png')
+        Image.new('RGB', (120, 90), 'blue').save(watched / 'novo.png')
+        assert collage_ready.acquire(timeout=30)
+    finally:
+        daemon.stop()
+        runner.join(30)
+    assert len(finished) == 2 and daemon.collages_saved == 2
+    assert daemon.dedup_index.image_count == 3 # 0.png, 1.png e novo.png